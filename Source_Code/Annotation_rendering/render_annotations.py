@@ -0,0 +1,283 @@
+import os
+import sys
+import argparse
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import cv2
+
+# The stage scripts live next to this folder
+SOURCE_DIR = Path(__file__).resolve().parents[1]
+for stage_dir in ("Common", "YOLO"):
+    sys.path.append(str(SOURCE_DIR / stage_dir))
+from jsonl_records import iter_records
+from image_header import read_image_size
+from detection_store import DetectionStore
+from processing import class_map
+import instrumentation
+
+LAYERS = ["yolo", "ocr", "proximity"]
+
+# Supported image extensions
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# YOLO class names by id (class_map of YOLO/processing.py)
+CLASS_NAMES = {class_id: name for name, class_id in class_map.items()}
+
+# BGR colors: OCR texts in green as ocr_script.py drew them, proximity matches in orange, YOLO classes in their own hue
+OCR_COLOR = (0, 255, 0)
+PROXIMITY_COLOR = (0, 140, 255)
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# libjpeg can decode at 1/2, 1/4 or 1/8 of the size directly, which is much cheaper than decoding and resizing
+REDUCED_MODES = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Draw YOLO, OCR and proximity-matched boxes from stored results, only for the requested screenshots")
+    parser.add_argument('--image_dir', type=str, required=True, help="Directory containing the screenshots")
+    parser.add_argument('--images', type=str, nargs='*', default=[], help="Image names to render (e.g. screen_0001.png)")
+    parser.add_argument('--images_file', type=str, default=None, help="Text file with one image name per line to render")
+    parser.add_argument('--all', action='store_true', help="Render every screenshot of --image_dir (what the stages used to write on every run)")
+    parser.add_argument('--yolo', type=str, default=None, help="YOLO results of infer.py: detections.json/.jsonl, detections_store/ or the labels/ directory")
+    parser.add_argument('--ocr', type=str, default=None, help="OCR results of ocr_script.py: the JSON file or the --output_store directory")
+    parser.add_argument('--proximity', type=str, default=None, help="Proximity matching JSON of proximity_matching.py")
+    parser.add_argument('--layers', type=str, default=None, help=f"Comma-separated layers to draw out of: {', '.join(LAYERS)} (default: every layer with results)")
+    parser.add_argument('--output_dir', type=str, required=True, help="Directory to save the annotated images in")
+    parser.add_argument('--thumbnail', type=int, default=0, help="Longest side of the rendered images in pixels (0 = full size)")
+    parser.add_argument('--quality', type=int, default=90, help="JPEG quality of the rendered images")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if not args.yolo and not args.ocr and not args.proximity:
+        parser.error("at least one of --yolo, --ocr or --proximity is required")
+    if not args.images and not args.images_file and not args.all:
+        parser.error("name the images to render with --images or --images_file, or use --all")
+    return args
+
+# Distinct, stable color of a YOLO class
+def class_color(class_id):
+    hue = np.uint8((class_id * 37) % 180)
+    return tuple(int(c) for c in cv2.cvtColor(np.array([[[hue, 220, 230]]], dtype=np.uint8), cv2.COLOR_HSV2BGR)[0, 0])
+
+# Result loaders. Each returns a lookup function (image name, image width, image height) -> entries.
+# Detection stores are memory-mapped and label files are read per image; JSON results are parsed once,
+# keeping only the images in `only` when it is given.
+
+# YOLO detections in the detections.jsonl form of infer.py: {"class_id", "confidence", "bbox_xyxy"}
+def load_yolo(path, only=None):
+    if os.path.exists(os.path.join(path, "meta.json")):
+        store = DetectionStore(path)
+
+        def from_store(image_name, img_w, img_h):
+            i = store.index(image_name)
+            return store.detections(i) if i is not None else []
+        return from_store
+
+    if os.path.isdir(path):
+        def from_labels(image_name, img_w, img_h):
+            label_path = os.path.join(path, os.path.splitext(image_name)[0] + ".txt")
+            if not os.path.exists(label_path):
+                return []
+            detections = []
+            with open(label_path) as f:
+                for line in f:
+                    data = line.split()
+                    if not data:
+                        continue
+                    x_center, y_center, width, height = map(float, data[1:5])
+                    detections.append({"class_id": int(data[0]), "confidence": None, "bbox_xyxy": [
+                        (x_center - width / 2) * img_w, (y_center - height / 2) * img_h,
+                        (x_center + width / 2) * img_w, (y_center + height / 2) * img_h]})
+            return detections
+        return from_labels
+
+    detections = {}
+    for record in iter_records(path):
+        image_name = os.path.basename(record["image"])
+        if only is not None and image_name not in only:
+            continue
+        # detections.jsonl has one record per image, detections.json one record per box
+        detections.setdefault(image_name, []).extend(record["detections"] if "detections" in record else [record])
+    return lambda image_name, img_w, img_h: detections.get(image_name, [])
+
+# OCR texts in the JSON form of ocr_script.py: {"text", "bbox" (quad), "confidence"}
+def load_ocr(path, only=None):
+    if os.path.isdir(path):
+        store = DetectionStore(path)
+
+        def from_store(image_name, img_w, img_h):
+            i = store.index(image_name)
+            return store.texts(i) if i is not None else []
+        return from_store
+
+    texts = {entry["image_name"]: entry["texts"] for entry in iter_records(path)
+             if only is None or entry["image_name"] in only}
+    return lambda image_name, img_w, img_h: texts.get(image_name, [])
+
+# Widgets with their matched text, as proximity_matching.py saves them: {"class_id", "bbox", "matched_text"}
+def load_proximity(path, only=None):
+    elements = {entry["image_name"]: entry["ui_elements"] for entry in iter_records(path)
+                if only is None or entry["image_name"] in only}
+    return lambda image_name, img_w, img_h: elements.get(image_name, [])
+
+LOADERS = {"yolo": load_yolo, "ocr": load_ocr, "proximity": load_proximity}
+
+# Decode a screenshot so that its longest side is max_side (0 = full size). JPEGs are decoded at the
+# largest libjpeg reduction that is still big enough; returns the image, its scale and the original size.
+def decode_scaled(image_path, max_side=0):
+    if not max_side:
+        image = cv2.imread(image_path)
+        return image, 1.0, (image.shape[1], image.shape[0]) if image is not None else None
+    try:
+        img_w, img_h = read_image_size(image_path)
+    except (OSError, ValueError):
+        return None, 1.0, None
+    mode = cv2.IMREAD_COLOR
+    for factor, reduced in REDUCED_MODES:
+        if max(img_w, img_h) / factor >= max_side:
+            mode = reduced
+            break
+    image = cv2.imread(image_path, mode)
+    if image is None:
+        return None, 1.0, None
+    scale = min(1.0, max_side / max(img_w, img_h))
+    size = (max(1, round(img_w * scale)), max(1, round(img_h * scale)))
+    if (image.shape[1], image.shape[0]) != size:
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image, scale, (img_w, img_h)
+
+# Draw one box and its label (above the box, or inside its bottom edge). Thumbnails below half size
+# only get the boxes, as the labels would cover the screen.
+def draw_box(image, bbox, color, label, scale, below=False):
+    x_min, y_min, x_max, y_max = [int(round(v * scale)) for v in bbox]
+    cv2.rectangle(image, (x_min, y_min), (x_max, y_max), color, max(1, round(2 * scale)))
+    if label and scale >= 0.5:
+        font_scale = 0.5 * scale
+        y = y_max - 4 if below else max(y_min - 5, 10)
+        cv2.putText(image, label, (x_min + (3 if below else 0), y), FONT, font_scale, color, 1, cv2.LINE_AA)
+
+def draw_layer(image, layer, entries, scale):
+    for entry in entries:
+        if layer == "yolo":
+            label = CLASS_NAMES.get(entry["class_id"], str(entry["class_id"]))
+            if entry.get("confidence") is not None:
+                label = f"{label} {entry['confidence']:.2f}"
+            draw_box(image, entry["bbox_xyxy"], class_color(entry["class_id"]), label, scale)
+        elif layer == "ocr":
+            (x_min, y_min), (x_max, y_max) = entry["bbox"][0], entry["bbox"][2]
+            draw_box(image, [x_min, y_min, x_max, y_max], OCR_COLOR, entry["text"], scale)
+        else:
+            text = entry["matched_text"] if entry["matched_text"] != "No text nearby" else ""
+            draw_box(image, entry["bbox"], PROXIMITY_COLOR, text, scale, below=True)
+
+# Draws stored results onto screenshots on demand. Results are only read when a layer is first drawn,
+# and the encoded images of the last requests are kept in a small in-process cache (bounded in bytes),
+# so a viewer asking for the same screenshot again gets it without decoding, drawing or encoding.
+class AnnotationRenderer:
+    def __init__(self, image_dir, yolo=None, ocr=None, proximity=None, cache_mb=64, only=None):
+        self.image_dir = image_dir
+        self.paths = {"yolo": yolo, "ocr": ocr, "proximity": proximity}
+        self.only = set(only) if only else None
+        self.lookups = {}
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.max_cache_bytes = cache_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # Layers that have results
+    def layers(self):
+        return [layer for layer in LAYERS if self.paths[layer]]
+
+    def lookup(self, layer):
+        with self.lock:
+            if layer not in self.lookups:
+                with instrumentation.span(f"render.read_{layer}"):
+                    self.lookups[layer] = LOADERS[layer](self.paths[layer], self.only)
+            return self.lookups[layer]
+
+    # Annotated BGR image, or None if the screenshot cannot be read
+    def render(self, image_name, layers=None, max_side=0):
+        image_path = os.path.join(self.image_dir, image_name)
+        with instrumentation.span("render.decode"):
+            image, scale, size = decode_scaled(image_path, max_side)
+        if image is None:
+            return None
+        img_w, img_h = size
+        with instrumentation.span("render.draw"):
+            for layer in layers or self.layers():
+                draw_layer(image, layer, self.lookup(layer)(image_name, img_w, img_h), scale)
+        return image
+
+    # Annotated image as JPEG bytes, from the cache when it was rendered before with the same settings
+    def render_jpeg(self, image_name, layers=None, max_side=0, quality=90):
+        key = (image_name, tuple(layers or self.layers()), max_side, quality)
+        with self.lock:
+            data = self.cache.get(key)
+            if data is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                instrumentation.count("render.cache_hits")
+                return data
+            self.misses += 1
+
+        image = self.render(image_name, layers, max_side)
+        if image is None:
+            return None
+        with instrumentation.span("render.encode"):
+            data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+        with self.lock:
+            if key not in self.cache and len(data) <= self.max_cache_bytes:
+                self.cache[key] = data
+                self.cache_bytes += len(data)
+                while self.cache_bytes > self.max_cache_bytes:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cache_bytes -= len(evicted)
+        return data
+
+    def summary(self):
+        return f"Render cache: {self.hits} hits, {self.misses} misses, {len(self.cache)} images ({self.cache_bytes / 1024 / 1024:.1f} MB)"
+
+# Image names to render: the ones named on the command line and in --images_file, or every screenshot with --all
+def requested_images(image_dir, images=(), images_file=None, render_all=False):
+    if render_all:
+        return sorted(name for name in os.listdir(image_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+    names = list(images)
+    if images_file:
+        with open(images_file) as f:
+            names.extend(line.strip() for line in f if line.strip())
+    return list(dict.fromkeys(os.path.basename(name) for name in names))
+
+def main():
+    args = parse_args()
+    instrumentation.configure_from_args(args)
+    names = requested_images(args.image_dir, args.images, args.images_file, args.all)
+    renderer = AnnotationRenderer(args.image_dir, args.yolo, args.ocr, args.proximity, only=None if args.all else names)
+    layers = args.layers.split(",") if args.layers else renderer.layers()
+    for layer in layers:
+        if layer not in LAYERS or not renderer.paths[layer]:
+            print(f" No results given for layer '{layer}' (use --{layer})")
+            sys.exit(1)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    rendered = 0
+    for image_name in names:
+        data = renderer.render_jpeg(image_name, layers, args.thumbnail, args.quality)
+        if data is None:
+            print(f" Skipping unreadable image: {image_name}")
+            continue
+        output_path = os.path.join(args.output_dir, f"{os.path.splitext(image_name)[0]}_annotated.jpg")
+        with instrumentation.span("render.write"), open(output_path, "wb") as f:
+            f.write(data)
+        instrumentation.count("render.images")
+        instrumentation.log(f" Rendered: {output_path}")
+        rendered += 1
+
+    print(f"\n Done! {rendered} annotated image(s) saved to: {args.output_dir}")
+    instrumentation.report()
+
+if __name__ == "__main__":
+    main()
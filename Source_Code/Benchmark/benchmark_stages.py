@@ -0,0 +1,374 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import cv2
+
+# The stage scripts live next to this folder
+SOURCE_DIR = Path(__file__).resolve().parents[1]
+for stage_dir in ("Common", "YOLO", "OCR", "Proximity_matching", "CLIP", "Annotation_rendering"):
+    sys.path.append(str(SOURCE_DIR / stage_dir))
+
+STAGES = ["yolo", "ocr", "proximity", "clip", "render"]
+
+# Stages without a model, run once in mode "none"
+MODEL_FREE_STAGES = {"proximity", "render"}
+
+# Widget classes of YOLO/processing.py used in the synthetic layouts
+ICON, TEXT, TEXT_BUTTON, UPPER_TASK_BAR, SWITCH, CARD, TOOLBAR, BOTTOM_NAVIGATION = 2, 5, 6, 9, 11, 13, 15, 16
+
+# Labels of the synthetic settings-like screens
+WORDS = ["Wi-Fi", "Bluetooth", "Display", "Sound", "Battery", "Storage", "Location", "Security", "Accounts",
+         "Notifications", "Privacy", "About phone", "Apps", "Language", "Backup", "Date & time"]
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the YOLO, OCR, proximity matching, CLIP and annotation rendering stages on synthetic screenshots, with real and stub models")
+    parser.add_argument('--stages', type=str, default=",".join(STAGES), help=f"Comma-separated stages out of: {', '.join(STAGES)}")
+    parser.add_argument('--modes', type=str, default="stub,real", help="stub: constant-time models (pipeline overhead only); real: the actual models, skipped when unavailable")
+    parser.add_argument('--resolutions', type=str, default="720x1280,1080x1920,1440x3120", help="Comma-separated screenshot sizes")
+    parser.add_argument('--densities', type=str, default="6,12,24", help="Comma-separated numbers of list rows per screen (4 widgets and 2 texts per row, plus bars)")
+    parser.add_argument('--images', type=int, default=40, help="Screenshots per resolution and density for the throughput run")
+    parser.add_argument('--latency_images', type=int, default=10, help="Screenshots run one at a time for the latency percentiles")
+    parser.add_argument('--stub_ms', type=float, default=0.0, help="Fixed cost of a stub model call, in milliseconds")
+    parser.add_argument('--batch_size', type=int, default=8, help="Batch size of the YOLO and CLIP stages")
+    parser.add_argument('--workers', type=int, default=2, help="Decode/preprocess threads of the YOLO and CLIP stages")
+    parser.add_argument('--weights', type=str, default=None, help="YOLO weights for the real YOLO stage (skipped without)")
+    parser.add_argument('--rico_captions', type=str, default=None, help="RICO captions for the real CLIP stage (default: synthetic captions)")
+    parser.add_argument('--work_dir', type=str, default=None, help="Where to write the synthetic screenshots (default: a temporary directory)")
+    parser.add_argument('--output_json', type=str, default=None, help="Path to save the results as a baseline")
+    parser.add_argument('--baseline', type=str, default=None, help="Baseline JSON of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Relative slowdown in images/sec or p95 latency reported as a regression")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    return parser.parse_args()
+
+# Synthetic settings-like screenshot with known widgets and texts: status bar, toolbar, list rows
+# (card, icon, label, switch or button) and bottom navigation, drawn at any resolution.
+# Returns the BGR image, the widgets ({"class_id", "bbox"}, with their text) and the OCR texts.
+def synthetic_screen(rng, width, height, rows):
+    img = np.full((height, width, 3), 250, np.uint8)
+    widgets, texts = [], []
+    scale = height / 1920
+
+    def widget(class_id, box, color, text=None, filled=True):
+        x_min, y_min, x_max, y_max = [int(v) for v in box]
+        cv2.rectangle(img, (x_min, y_min), (x_max, y_max), color, -1 if filled else max(1, int(2 * scale)))
+        widgets.append({"class_id": class_id, "bbox": [x_min, y_min, x_max, y_max], "text": text})
+
+    def label(text, x, y_center, font_scale, color=(30, 30, 30)):
+        thickness = max(1, int(2 * scale))
+        (text_w, text_h), baseline = cv2.getTextSize(text, FONT, font_scale, thickness)
+        y = int(y_center + text_h / 2)
+        cv2.putText(img, text, (int(x), y), FONT, font_scale, color, thickness, cv2.LINE_AA)
+        x_min, y_min, x_max, y_max = float(int(x)), float(y - text_h), float(int(x) + text_w), float(y + baseline)
+        texts.append({"text": text, "bbox": [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]], "confidence": 0.99})
+        return text
+
+    bar_h, toolbar_h, nav_h = 0.03 * height, 0.07 * height, 0.08 * height
+    widget(UPPER_TASK_BAR, (0, 0, width - 1, bar_h), (60, 60, 60))
+    label("12:30", 0.03 * width, bar_h / 2, 0.8 * scale, (255, 255, 255))
+    title = str(rng.choice(WORDS))
+    widget(TOOLBAR, (0, bar_h, width - 1, bar_h + toolbar_h), (170, 110, 40), title)
+    label(title, 0.05 * width, bar_h + toolbar_h / 2, 1.6 * scale, (255, 255, 255))
+
+    top, bottom = bar_h + toolbar_h, height - nav_h
+    row_h = (bottom - top) / rows
+    font_scale = min(1.3 * scale, row_h / 45)
+    for row in range(rows):
+        y_min, y_max = top + row * row_h + 0.08 * row_h, top + (row + 1) * row_h - 0.08 * row_h
+        y_center = (y_min + y_max) / 2
+        text = str(rng.choice(WORDS))
+        widget(CARD, (0.02 * width, y_min, 0.98 * width, y_max), (235, 235, 235), text)
+        size = 0.7 * (y_max - y_min)
+        widget(ICON, (0.04 * width, y_center - size / 2, 0.04 * width + size, y_center + size / 2), (120, 160, 60))
+        widget(TEXT, (0.06 * width + size, y_min, 0.6 * width, y_max), (235, 235, 235), label(text, 0.06 * width + size, y_center, font_scale))
+        if rng.random() < 0.5:
+            widget(SWITCH, (0.82 * width, y_center - size / 3, 0.94 * width, y_center + size / 3), (200, 140, 60), "ON")
+            label("ON", 0.85 * width, y_center, 0.6 * font_scale, (255, 255, 255))
+        else:
+            widget(TEXT_BUTTON, (0.76 * width, y_min + 0.1 * row_h, 0.95 * width, y_max - 0.1 * row_h), (220, 220, 220), "OPEN")
+            label("OPEN", 0.79 * width, y_center, 0.8 * font_scale, (170, 110, 40))
+
+    widget(BOTTOM_NAVIGATION, (0, bottom, width - 1, height - 1), (245, 245, 245), filled=False)
+    for i in range(4):
+        x_center = (i + 0.5) * width / 4
+        widget(ICON, (x_center - 0.3 * nav_h, bottom + 0.2 * nav_h, x_center + 0.3 * nav_h, bottom + 0.8 * nav_h), (90, 90, 90))
+    return img, widgets, texts
+
+# Widget boxes as OCR-style quads
+def box_quad(box):
+    x_min, y_min, x_max, y_max = [float(v) for v in box]
+    return [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+
+# Screenshots plus their ground truth in the input formats of the stages: detections.jsonl (infer.py),
+# ocr.json (ocr_script.py) and widgets.json (the OCR-style input of clip_matching.py)
+def write_dataset(root, screens):
+    image_dir = root / "images"
+    image_dir.mkdir(parents=True, exist_ok=True)
+    ocr_results, widget_results = [], []
+    with open(root / "detections.jsonl", "w") as f:
+        for i, (img, widgets, texts) in enumerate(screens):
+            image_name = f"screen_{i:04d}.png"
+            cv2.imwrite(str(image_dir / image_name), img)
+            img_h, img_w = img.shape[:2]
+            f.write(json.dumps({"image": str(image_dir / image_name), "width": img_w, "height": img_h,
+                                "detections": [{"class_id": w["class_id"], "confidence": 0.99, "bbox_xyxy": w["bbox"]} for w in widgets]}) + "\n")
+            ocr_results.append({"image_name": image_name, "texts": texts})
+            widget_results.append({"image_name": image_name, "texts": [
+                {"text": w["text"] or "No text nearby", "bbox": box_quad(w["bbox"]), "confidence": 0.99} for w in widgets]})
+    with open(root / "ocr.json", "w") as f:
+        json.dump(ocr_results, f)
+    with open(root / "widgets.json", "w") as f:
+        json.dump(widget_results, f)
+
+# Full set for the throughput run, and one single-screenshot set per latency sample
+def make_dataset(root, rng, width, height, rows, images, latency_images):
+    screens = [synthetic_screen(rng, width, height, rows) for _ in range(images)]
+    write_dataset(root / "all", screens)
+    for i in range(min(latency_images, images)):
+        write_dataset(root / "single" / str(i), [screens[i]])
+    return {"root": str(root), "widgets": len(screens[0][1]), "texts": len(screens[0][2]),
+            "layout": {"widgets": screens[0][1], "texts": screens[0][2]}, "singles": min(latency_images, images)}
+
+# Stub models: constant outputs (the layout of the first screenshot) after a fixed cost, so the
+# benchmark measures everything around the model
+
+class StubBox:
+    def __init__(self, widget):
+        self.cls = np.array([widget["class_id"]], dtype=np.float32)
+        self.conf = np.array([0.99], dtype=np.float32)
+        self.xyxy = np.array([widget["bbox"]], dtype=np.float32)
+
+class StubResult:
+    def __init__(self, img, boxes):
+        self.orig_img = img
+        self.boxes = boxes
+
+    # Only called with infer.py --save_annotated; the image is still encoded, as the real results do
+    def save(self, filename):
+        cv2.imwrite(filename, self.orig_img)
+
+# Callable like ultralytics.YOLO on a list of decoded images
+class StubDetector:
+    def __init__(self, widgets, cost_s=0.0):
+        self.boxes = [StubBox(widget) for widget in widgets]
+        self.cost_s = cost_s
+
+    def __call__(self, images):
+        time.sleep(self.cost_s)
+        return [StubResult(img, self.boxes) for img in images]
+
+# Used like the PaddleOCR instance of ocr_script.py
+class StubOCR:
+    def __init__(self, texts, cost_s=0.0):
+        self.lines = [[text["bbox"], (text["text"], text["confidence"])] for text in texts]
+        self.cost_s = cost_s
+
+    # Without detection the input is a list of pages, each a list of crops, and PaddleOCR returns one
+    # (text, confidence) list per page
+    def ocr(self, image, det=True, cls=True):
+        time.sleep(self.cost_s)
+        if not det:
+            return [[("stub", 0.99) for _ in page] for page in image]
+        return [self.lines]
+
+# Same interface as clip_matching.WidgetCaptioner for process_widgets; crops are still decoded and
+# resized to the CLIP input size
+class StubCaptioner:
+    fingerprint = "stub"
+
+    def __init__(self, cost_s=0.0):
+        self.cost_s = cost_s
+
+    def prepare_crops(self, image_path, boxes):
+        img = cv2.imread(str(image_path))
+        return [cv2.resize(img[y_min:max(y_max, y_min + 1), x_min:max(x_max, x_min + 1)], (224, 224))
+                for x_min, y_min, x_max, y_max in boxes]
+
+    def caption_prepared(self, crops):
+        time.sleep(self.cost_s)
+        return ["stub caption"] * len(crops)
+
+# Synthetic caption file for the real CLIP stage when no RICO captions are given
+def write_synthetic_captions(path):
+    captions = [{"caption": f"{kind} {word.lower()}"} for word in WORDS
+                for kind in ("button for", "switch for", "icon of", "text about", "toolbar with")]
+    with open(path, "w") as f:
+        json.dump(captions, f)
+    return path
+
+# Load the model of a stage; returns None with the reason when the real model is unavailable
+def load_model(stage, mode, dataset, options):
+    cost_s = options["stub_ms"] / 1000
+    layout = dataset["layout"]
+    if stage in MODEL_FREE_STAGES:
+        return None, None
+    if mode == "stub":
+        stubs = {"yolo": lambda: StubDetector(layout["widgets"], cost_s), "ocr": lambda: StubOCR(layout["texts"], cost_s),
+                 "clip": lambda: StubCaptioner(cost_s)}
+        return stubs[stage](), None
+
+    try:
+        if stage == "yolo":
+            if not options["weights"]:
+                return None, "no --weights given"
+            from ultralytics import YOLO
+            return YOLO(options["weights"]), None
+        if stage == "ocr":
+            from ocr_script import get_ocr
+            return get_ocr(), None
+        from clip_matching import WidgetCaptioner
+        captions = options["rico_captions"] or write_synthetic_captions(os.path.join(dataset["root"], "captions.json"))
+        return WidgetCaptioner(captions, device="cpu"), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+# Run one stage over a dataset directory written by write_dataset
+def run_stage(stage, model, data_dir, out_dir, options):
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    out_dir.mkdir(parents=True)
+    if stage == "yolo":
+        from infer import run_inference
+        run_inference(options["weights"] or "stub", data_dir / "images", out_dir, options["batch_size"], options["workers"],
+                      "jsonl", model=model)
+    elif stage == "ocr":
+        import ocr_script
+        ocr_script.ocr = model
+        ocr_script.ocr_processing(str(data_dir / "images"), None, str(out_dir / "ocr.json"))
+    elif stage == "proximity":
+        from proximity_matching import proximity_matching
+        proximity_matching(None, str(data_dir / "ocr.json"), str(out_dir / "proximity.json"), yolo_jsonl=str(data_dir / "detections.jsonl"))
+    elif stage == "render":
+        # Every screenshot at full size, i.e. the cost the stages paid per image when they always saved annotated images
+        from render_annotations import AnnotationRenderer
+        renderer = AnnotationRenderer(str(data_dir / "images"), yolo=str(data_dir / "detections.jsonl"), ocr=str(data_dir / "ocr.json"))
+        for image_path in sorted((data_dir / "images").iterdir()):
+            with open(out_dir / f"{image_path.stem}_annotated.jpg", "wb") as f:
+                f.write(renderer.render_jpeg(image_path.name))
+    else:
+        from clip_matching import process_widgets
+        from jsonl_records import iter_records
+        process_widgets(iter_records(str(data_dir / "widgets.json")), model, str(data_dir / "images"), None,
+                        options["batch_size"], options["workers"])
+
+# Peak resident set size of this process, in MB
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+# One benchmark case, run in a fresh process so its peak RSS is its own
+def run_case(case):
+    # Benchmarks never download weights: a real model missing from the local caches is reported as skipped
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    stage, mode, dataset, options = case["stage"], case["mode"], case["dataset"], case["options"]
+    root = Path(dataset["root"])
+    out_dir = root / f"out_{stage}_{mode}"
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        model, skipped = load_model(stage, mode, dataset, options)
+        if skipped:
+            return {"skipped": skipped}
+        load_s = time.perf_counter() - start
+
+        # Warm-up on one screenshot, so lazy imports and first-call setup are not timed
+        run_stage(stage, model, root / "single" / "0", out_dir, options)
+
+        start = time.perf_counter()
+        run_stage(stage, model, root / "all", out_dir, options)
+        elapsed = time.perf_counter() - start
+
+        latencies = []
+        for i in range(dataset["singles"]):
+            start = time.perf_counter()
+            run_stage(stage, model, root / "single" / str(i), out_dir, options)
+            latencies.append(1000 * (time.perf_counter() - start))
+
+    return {"images_per_s": round(options["images"] / elapsed, 2), "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2), "peak_rss_mb": peak_rss_mb(), "load_s": round(load_s, 2)}
+
+def case_key(result):
+    return (result["stage"], result["mode"], result["resolution"], result["rows"])
+
+# Compare with a baseline: a case regresses when its throughput drops or its p95 latency grows by more than tolerance
+def compare(results, baseline, tolerance):
+    previous = {case_key(r): r for r in baseline["results"] if "images_per_s" in r}
+    regressions = []
+    print(f"\n{'stage':<10} {'mode':<5} {'resolution':>10} {'rows':>4} {'baseline img/s':>16} {'baseline p95 ms':>16}")
+    for result in results:
+        before = previous.get(case_key(result))
+        if before is None or "images_per_s" not in result:
+            continue
+        throughput = result["images_per_s"] / before["images_per_s"] - 1
+        latency = result["p95_ms"] / before["p95_ms"] - 1
+        regressed = throughput < -tolerance or latency > tolerance
+        if regressed:
+            regressions.append(result)
+        print(f"{result['stage']:<10} {result['mode']:<5} {result['resolution']:>10} {result['rows']:>4} "
+              f"{before['images_per_s']:>7.1f} {throughput:>+7.1%} {before['p95_ms']:>7.1f} {latency:>+7.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    args = parse_args()
+    stages = args.stages.split(",")
+    modes = args.modes.split(",")
+    options = {"stub_ms": args.stub_ms, "batch_size": args.batch_size, "workers": args.workers, "weights": args.weights,
+               "rico_captions": os.path.abspath(args.rico_captions) if args.rico_captions else None, "images": args.images}
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="deepui_bench_"))
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    print(f"{'stage':<10} {'mode':<5} {'resolution':>10} {'rows':>4} {'widgets':>7} {'img/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>7}")
+    for resolution in args.resolutions.split(","):
+        width, height = map(int, resolution.split("x"))
+        for rows in map(int, args.densities.split(",")):
+            dataset = make_dataset(work_dir / f"{resolution}_{rows}", rng, width, height, rows, args.images, max(1, args.latency_images))
+            for stage in stages:
+                for mode in (["none"] if stage in MODEL_FREE_STAGES else modes):
+                    # A new process per case, so model memory and caches of one case do not leak into the next
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                        metrics = pool.submit(run_case, {"stage": stage, "mode": mode, "dataset": dataset, "options": options}).result()
+                    result = {"stage": stage, "mode": mode, "resolution": resolution, "rows": rows,
+                              "widgets": dataset["widgets"], "texts": dataset["texts"], **metrics}
+                    results.append(result)
+                    if "skipped" in result:
+                        print(f"{stage:<10} {mode:<5} {resolution:>10} {rows:>4} {'skipped':>7} ({result['skipped'][:80]})")
+                    else:
+                        print(f"{stage:<10} {mode:<5} {resolution:>10} {rows:>4} {result['widgets']:>7} {result['images_per_s']:>8.1f} "
+                              f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['peak_rss_mb']:>7.0f}")
+
+    report = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                        "numpy": np.__version__, "opencv": cv2.__version__},
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output_json", "baseline", "work_dir")},
+        "results": results,
+    }
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"\n Results saved to: {args.output_json}")
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n {len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+from caption_index import create_index, set_search_params, INDEX_FILE
+
+# Backends compared by default: name -> index spec
+BACKENDS = {
+    "flat_ip": {"index_type": "flat_ip"},
+    "flat_pq": {"index_type": "flat_ip", "pq": 64},
+    "ivf": {"index_type": "ivf"},
+    "ivf_pq": {"index_type": "ivf", "pq": 64},
+    "hnsw": {"index_type": "hnsw"},
+    "hnsw_pq": {"index_type": "hnsw", "pq": 64},
+}
+
+# Argument parser for CLI
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare caption index backends: recall@1/@5 against the exact index and CPU queries per second.")
+    parser.add_argument("--index_dir", type=str, default=None, help="Saved flat caption index (caption_index.py) to take real caption embeddings from.")
+    parser.add_argument("--synthetic", type=int, default=200000, help="Number of synthetic clustered embeddings, used when no --index_dir is given.")
+    parser.add_argument("--dim", type=int, default=512, help="Embedding size of the synthetic data (ViT-B/32 uses 512).")
+    parser.add_argument("--queries", type=int, default=2000, help="Number of queries.")
+    parser.add_argument("--query_file", type=str, default=None, help="Optional .npy file of widget image embeddings to use as queries.")
+    parser.add_argument("--backends", type=str, default=",".join(BACKENDS), help=f"Comma-separated backends out of: {', '.join(BACKENDS)}.")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF clusters visited per query.")
+    parser.add_argument("--ef_search", type=int, default=64, help="HNSW search beam width.")
+    parser.add_argument("--threads", type=int, default=0, help="FAISS OpenMP threads (0 = FAISS default).")
+    parser.add_argument("--output_json", type=str, default=None, help="Optional path to save the results.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    return parser.parse_args()
+
+def normalized(x):
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    faiss.normalize_L2(x)
+    return x
+
+# Clustered unit vectors, closer to real caption embeddings than uniform noise
+def synthetic_embeddings(rng, count, dim, clusters=1000):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, clusters, count)
+    return normalized(centers[assignment] + 0.35 * rng.standard_normal((count, dim)).astype(np.float32))
+
+# Caption embeddings of a saved flat index
+def saved_embeddings(index_dir):
+    index = faiss.read_index(os.path.join(index_dir, INDEX_FILE))
+    return index.reconstruct_n(0, index.ntotal)
+
+# recall@1: the exact nearest caption is the first result; recall@5: it is among the first five
+def recall(exact_top1, approx_ids, k):
+    return float(np.mean([exact_top1[i] in approx_ids[i, :k] for i in range(len(exact_top1))]))
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    data = normalized(saved_embeddings(args.index_dir)) if args.index_dir else synthetic_embeddings(rng, args.synthetic, args.dim)
+    if args.query_file:
+        queries = normalized(np.load(args.query_file))
+    else:
+        # Perturbed captions stand in for widget image embeddings
+        picks = rng.integers(0, len(data), args.queries)
+        queries = normalized(data[picks] + 0.05 * rng.standard_normal(data[picks].shape).astype(np.float32))
+    print(f" {len(data)} captions x {data.shape[1]} dims, {len(queries)} queries")
+
+    # Ground truth from the exact inner-product index
+    exact = create_index(data, {"index_type": "flat_ip"})
+    _, exact_ids = exact.search(queries, 5)
+    exact_top1 = exact_ids[:, 0]
+
+    results = []
+    print(f"{'backend':>10} {'build (s)':>10} {'recall@1':>9} {'recall@5':>9} {'QPS (batch)':>12} {'ms/query (single)':>18}")
+    for name in args.backends.split(","):
+        start = time.perf_counter()
+        index = create_index(data, BACKENDS[name])
+        build_s = time.perf_counter() - start
+        set_search_params(index, args.nprobe, args.ef_search)
+
+        # Throughput: all queries in one call
+        start = time.perf_counter()
+        _, ids = index.search(queries, 5)
+        qps = len(queries) / (time.perf_counter() - start)
+
+        # Latency: one query per call, as process_widgets issues them for small batches
+        single = queries[:200]
+        start = time.perf_counter()
+        for i in range(len(single)):
+            index.search(single[i:i + 1], 5)
+        latency_ms = 1000 * (time.perf_counter() - start) / len(single)
+
+        row = {"backend": name, "spec": BACKENDS[name], "build_s": round(build_s, 3),
+               "recall@1": round(recall(exact_top1, ids, 1), 4), "recall@5": round(recall(exact_top1, ids, 5), 4),
+               "qps": round(qps, 1), "latency_ms": round(latency_ms, 4)}
+        results.append(row)
+        print(f"{name:>10} {row['build_s']:>10.2f} {row['recall@1']:>9.3f} {row['recall@5']:>9.3f} {row['qps']:>12.0f} {row['latency_ms']:>18.3f}")
+
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump({"captions": len(data), "dim": int(data.shape[1]), "queries": len(queries),
+                       "nprobe": args.nprobe, "ef_search": args.ef_search, "results": results}, f, indent=4)
+        print(f"\n Results saved to {args.output_json}")
+
+if __name__ == "__main__":
+    main()
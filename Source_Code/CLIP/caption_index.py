@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+from pathlib import Path
+import numpy as np
+import torch
+import open_clip
+import faiss
+from sklearn.preprocessing import normalize
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from result_cache import file_digest
+
+# CLIP model used to embed widget crops and RICO captions
+CLIP_MODEL_NAME = "ViT-B/32"
+CLIP_PRETRAINED = "openai"
+
+# Index backends. Embeddings are L2-normalized, so inner product equals cosine similarity and
+# flat_ip returns the same matches as the original flat_l2 index.
+INDEX_TYPES = ["flat_l2", "flat_ip", "ivf", "hnsw"]
+
+# Files of a saved caption index
+INDEX_FILE = "captions.index"
+TEXTS_FILE = "captions.json"
+META_FILE = "meta.json"
+
+# Argument parser for CLI
+def parse_args():
+    parser = argparse.ArgumentParser(description="Encode the RICO captions once and save the FAISS index for clip_matching.py.")
+    parser.add_argument("--rico_captions", type=str, required=True, help="Path to RICO widget captions JSON file.")
+    parser.add_argument("--index_dir", type=str, required=True, help="Directory to save the caption index.")
+    parser.add_argument("--batch_size", type=int, default=256, help="Captions encoded per forward pass.")
+    add_index_args(parser)
+    from onnx_clip import add_backend_args
+    add_backend_args(parser)
+    return parser.parse_args()
+
+# Index backend options, shared by every script that builds or searches a caption index
+def add_index_args(parser):
+    parser.add_argument("--index_type", type=str, choices=INDEX_TYPES, default="flat_l2", help="Caption index backend: exact flat L2/inner product, or approximate IVF/HNSW.")
+    parser.add_argument("--pq", type=int, default=0, help="Store vectors product-quantized with this many sub-quantizers (0 = full vectors; must divide the embedding size).")
+    parser.add_argument("--nlist", type=int, default=None, help="Number of IVF clusters (default: about 4*sqrt(number of captions)).")
+    parser.add_argument("--hnsw_m", type=int, default=32, help="Neighbours per node of the HNSW graph.")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF clusters visited per query (higher = better recall, slower).")
+    parser.add_argument("--ef_search", type=int, default=64, help="HNSW search beam width (higher = better recall, slower).")
+
+# Build parameters of an index from parsed arguments; query-time parameters are not part of it
+def index_spec_from_args(args):
+    return {"index_type": args.index_type, "pq": args.pq, "nlist": args.nlist, "hnsw_m": args.hnsw_m}
+
+# Index spec with defaults filled in and only the settings that matter for its backend,
+# so equivalent specs compare equal when deciding whether a saved index can be reused
+def canonical_index_spec(spec):
+    spec = spec or {}
+    canonical = {"index_type": spec.get("index_type") or "flat_l2", "pq": spec.get("pq") or 0}
+    if canonical["index_type"] == "ivf":
+        canonical["nlist"] = spec.get("nlist")
+    if canonical["index_type"] == "hnsw":
+        canonical["hnsw_m"] = spec.get("hnsw_m") or 32
+    return canonical
+
+# Exact backends return the same matches as the original flat L2 index
+def is_exact_index(spec):
+    spec = canonical_index_spec(spec)
+    return spec["index_type"] in ("flat_l2", "flat_ip") and not spec["pq"]
+
+# FAISS index factory description and metric for an index spec
+def index_description(spec, count):
+    spec = canonical_index_spec(spec)
+    index_type, pq = spec["index_type"], spec["pq"]
+    storage = f"PQ{pq}" if pq else "Flat"
+    if index_type == "flat_l2":
+        return storage, faiss.METRIC_L2
+    if index_type == "flat_ip":
+        return storage, faiss.METRIC_INNER_PRODUCT
+    if index_type == "ivf":
+        # FAISS wants at least ~39 training points per cluster
+        nlist = spec.get("nlist") or max(1, min(int(4 * np.sqrt(count)), count // 39))
+        return f"IVF{nlist},{storage}", faiss.METRIC_INNER_PRODUCT
+    if index_type == "hnsw":
+        hnsw_m = spec["hnsw_m"]
+        return f"HNSW{hnsw_m}_PQ{pq}" if pq else f"HNSW{hnsw_m}", faiss.METRIC_INNER_PRODUCT
+    raise ValueError(f"Unknown index type: {index_type}")
+
+# Create, train and fill an index over normalized embeddings
+def create_index(embeddings, spec=None):
+    description, metric = index_description(spec, len(embeddings))
+    index = faiss.index_factory(embeddings.shape[1], description, metric)
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+# Query-time speed/recall settings of approximate indexes
+def set_search_params(index, nprobe=None, ef_search=None):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = nprobe
+    if hasattr(index, "hnsw") and ef_search:
+        index.hnsw.efSearch = ef_search
+
+# Load the CLIP model, its image preprocessing and its tokenizer
+def load_clip(device):
+    model, preprocess = open_clip.create_model_and_transforms(CLIP_MODEL_NAME, pretrained=CLIP_PRETRAINED)
+    tokenizer = open_clip.get_tokenizer(CLIP_MODEL_NAME)
+    return model.to(device), preprocess, tokenizer
+
+# Identifies the caption file contents and the CLIP model; a saved index is only reused if it matches.
+# encoder identifies other text encoders of the same model (e.g. the ONNX export of onnx_clip.py).
+def caption_fingerprint(rico_captions_path, encoder=None):
+    payload = [file_digest(rico_captions_path), CLIP_MODEL_NAME, CLIP_PRETRAINED, open_clip.__version__]
+    if encoder:
+        payload.append(encoder)
+    payload = json.dumps(payload)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# Encode captions in large batches; returns L2-normalized float32 embeddings
+def encode_captions(texts, model, tokenizer, device, batch_size=256):
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        text_tokenized = tokenizer(texts[start:start + batch_size]).to(device)
+        with torch.no_grad():
+            text_embedding = model.encode_text(text_tokenized)
+        text_embedding /= text_embedding.norm(dim=-1, keepdim=True)  # Normalize embeddings
+        embeddings.append(text_embedding.float().cpu().numpy())
+    return normalize(np.vstack(embeddings), axis=1).astype(np.float32)
+
+# Build the FAISS index over all RICO captions and, if index_dir is given, save it with the caption list
+def build_caption_index(rico_captions_path, model, tokenizer, device, index_dir=None, batch_size=256, index_spec=None,
+                        encoder=None):
+    with open(rico_captions_path, "r") as f:
+        rico_texts = [rico["caption"] for rico in json.load(f)]
+
+    rico_embeddings = encode_captions(rico_texts, model, tokenizer, device, batch_size)
+    index = create_index(rico_embeddings, index_spec)
+
+    if index_dir:
+        # The old metadata is removed before anything is overwritten and the new one is written last, each file
+        # through a temporary name: an interrupted rebuild leaves no metadata next to a partly written index
+        os.makedirs(index_dir, exist_ok=True)
+        meta_path = os.path.join(index_dir, META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        index_path = os.path.join(index_dir, INDEX_FILE)
+        faiss.write_index(index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+        texts_path = os.path.join(index_dir, TEXTS_FILE)
+        with open(texts_path + ".tmp", "w") as f:
+            json.dump(rico_texts, f)
+        os.replace(texts_path + ".tmp", texts_path)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"fingerprint": caption_fingerprint(rico_captions_path, encoder), "index_spec": canonical_index_spec(index_spec),
+                       "count": len(rico_texts), "dim": int(rico_embeddings.shape[1])}, f, indent=4)
+        os.replace(meta_path + ".tmp", meta_path)
+    return index, rico_texts
+
+# Load a saved index if it was built from the same captions, model and index settings;
+# the index is memory-mapped where FAISS supports it
+def load_caption_index(index_dir, fingerprint, index_spec=None):
+    meta_path = os.path.join(index_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    if meta.get("fingerprint") != fingerprint or meta.get("index_spec") != canonical_index_spec(index_spec):
+        return None
+
+    index_path = os.path.join(index_dir, INDEX_FILE)
+    try:
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(index_path)
+    with open(os.path.join(index_dir, TEXTS_FILE), "r") as f:
+        rico_texts = json.load(f)
+    return index, rico_texts
+
+# Reuse the saved index, or rebuild it when the caption file, the CLIP model or the index settings changed
+def load_or_build_caption_index(rico_captions_path, index_dir, model, tokenizer, device, batch_size=256, index_spec=None,
+                                encoder=None):
+    loaded = load_caption_index(index_dir, caption_fingerprint(rico_captions_path, encoder), index_spec)
+    if loaded is not None:
+        return loaded
+    print(f" Building caption index in {index_dir} ...")
+    return build_caption_index(rico_captions_path, model, tokenizer, device, index_dir, batch_size, index_spec, encoder)
+
+def main():
+    args = parse_args()
+    encoder = None
+    if args.backend == "onnx":
+        from onnx_clip import load_clip_onnx
+        device = "cpu"
+        model, _, tokenizer = load_clip_onnx(args.onnx_dir, args.int8)
+        encoder = model.fingerprint
+    else:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model, _, tokenizer = load_clip(device)
+    index, rico_texts = build_caption_index(args.rico_captions, model, tokenizer, device, args.index_dir, args.batch_size,
+                                            index_spec_from_args(args), encoder)
+    print(f" Indexed {len(rico_texts)} captions -> {args.index_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -1,102 +1,235 @@
-import torch
-from transformers import CLIPProcessor, CLIPModel
-import json
-import os
-from pathlib import Path
-from PIL import Image
-import argparse
-
-# Argument parser for CLI
-parser = argparse.ArgumentParser(description="Perform inference with the fine-tuned CLIP model to match UI screenshots with descriptions.")
-parser.add_argument("--image_dir", type=str, required=True, help="Path to the directory containing UI screenshots.")
-parser.add_argument("--ui_descriptions", type=str, required=True, help="Path to the UI descriptions JSON file.")
-parser.add_argument("--model_path", type=str, required=True, help="Path to the fine-tuned CLIP model.")
-parser.add_argument("--output_json", type=str, required=True, help="Path to save the output results.")
-args = parser.parse_args()
-
-# Load fine-tuned CLIP model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = CLIPModel.from_pretrained(args.model_path).to(device)
-processor = CLIPProcessor.from_pretrained(args.model_path)
-
-# Load UI descriptions
-with open(args.ui_descriptions, "r") as f:
-    ui_descriptions = json.load(f)
-
-# Normalize JSON keys (lowercase) for better matching
-ui_descriptions = {k.lower().strip(): v for k, v in ui_descriptions.items()}
-
-# Debug JSON keys
-print("📌 First 10 JSON keys:", list(ui_descriptions.keys())[:10])
-
-# Truncate descriptions to avoid CLIP token limit
-def truncate_text(text, max_tokens=512):
-    tokens = text.split()
-    return " ".join(tokens[:max_tokens])
-
-# Prepare text embeddings
-text_descriptions = [truncate_text(desc) for desc in ui_descriptions.values()]
-text_inputs = processor(text=text_descriptions, padding=True, truncation=True, return_tensors="pt").to(device)
-
-with torch.no_grad():
-    text_embeddings = model.get_text_features(**text_inputs)
-    text_embeddings /= text_embeddings.norm(dim=-1, keepdim=True)  # Normalize
-
-# Dictionary to store results
-results = {}
-
-# Process images
-for root, _, files in os.walk(args.image_dir):
-    print("📌 First 10 image filenames:", files[:10])  # Debug filenames
-
-    for file in files:
-        if file.endswith(".png") and not file.startswith("._"):
-            image_path = Path(root) / file
-
-            # Handle mismatched extensions
-            image_key_jpg = file.replace(".png", ".jpg").lower()
-            image_key_png = file.lower()
-
-            if image_key_jpg in ui_descriptions:
-                image_key = image_key_jpg
-            elif image_key_png in ui_descriptions:
-                image_key = image_key_png
-            else:
-                print(f"⚠️ No description found for {file} (Looking for: {image_key_jpg} or {image_key_png})")
-                continue  # Skip this image
-
-            description = truncate_text(ui_descriptions[image_key])
-
-            try:
-                # Process image
-                image = Image.open(image_path).convert("RGB")
-                image_inputs = processor(images=image, return_tensors="pt").to(device)
-
-                with torch.no_grad():
-                    image_embedding = model.get_image_features(**image_inputs)
-                    image_embedding /= image_embedding.norm(dim=-1, keepdim=True)  # Normalize
-
-                    # Compute similarity
-                    similarity = (image_embedding @ text_embeddings.T).squeeze(0)
-                    best_match_idx = similarity.argmax().item()
-                    best_match_score = similarity[best_match_idx].item()
-                    best_match_text = text_descriptions[best_match_idx]
-
-                # Print results
-                print(f"📸 Processed: {image_path}")
-                print(f"🔍 Best Matched UI Description (Score: {best_match_score:.2f}):\n{best_match_text}\n")
-
-                # Store results
-                results[file] = {
-                    "best_match_description": best_match_text,
-                    "similarity_score": round(best_match_score, 2)
-                }
-
-            except Exception as e:
-                print(f"❌ Error processing {file}: {e}")
-
-# Save results to JSON
-with open(args.output_json, "w") as f:
-    json.dump(results, f, indent=4)
-
-print(f"✅ Processing complete. Results saved to: {args.output_json}")
+import torch
+from transformers import CLIPProcessor, CLIPModel
+from torch.utils.data import Dataset, DataLoader
+import json
+import os
+from pathlib import Path
+from functools import partial
+from PIL import Image
+import argparse
+import sys
+
+from description_store import truncate_text, encode_descriptions, update_description_store, top_k_matches
+from onnx_clip import add_backend_args, OnnxHfClip
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from result_cache import ResultCache, file_digest, weights_fingerprint
+from model_client import ModelClient, chunks
+import instrumentation
+
+# Argument parser for CLI
+def parse_args():
+    parser = argparse.ArgumentParser(description="Perform inference with the fine-tuned CLIP model to match UI screenshots with descriptions.")
+    parser.add_argument("--image_dir", type=str, required=True, help="Path to the directory containing UI screenshots.")
+    parser.add_argument("--ui_descriptions", type=str, required=True, help="Path to the UI descriptions JSON file.")
+    parser.add_argument("--model_path", type=str, required=True, help="Path to the fine-tuned CLIP model.")
+    parser.add_argument("--output_json", type=str, required=True, help="Path to save the output results.")
+    parser.add_argument("--embedding_store", type=str, default=None, help="Directory of the persistent description embeddings; only new or edited descriptions are encoded.")
+    parser.add_argument("--batch_size", type=int, default=32, help="Screenshots encoded per forward pass.")
+    parser.add_argument("--text_batch_size", type=int, default=256, help="Descriptions encoded per forward pass.")
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader worker processes that load and preprocess screenshots.")
+    parser.add_argument("--top_k", type=int, default=5, help="Number of best matching descriptions stored per screenshot.")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of the shared result cache; image embeddings of unchanged screenshots are reused.")
+    parser.add_argument("--cache_size_mb", type=int, default=1024, help="Maximum size of the result cache before least recently used entries are evicted.")
+    parser.add_argument("--server", type=str, default=None, help="URL of a running Model_server/model_server.py (e.g. http://127.0.0.1:8765); the CLIP model is not loaded here.")
+    add_backend_args(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.backend == "onnx" and not args.onnx_dir:
+        parser.error("--backend onnx needs --onnx_dir (export it with onnx_clip.py --model hf)")
+    return args
+
+# Screenshots loaded and preprocessed by DataLoader workers; unreadable files yield None.
+# Spans recorded in worker processes are not collected; with workers the parent records the wait for each batch.
+class ScreenshotDataset(Dataset):
+    def __init__(self, image_paths, processor):
+        self.image_paths = image_paths
+        self.processor = processor
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx):
+        try:
+            with instrumentation.span("clip.decode"):
+                image = Image.open(self.image_paths[idx]).convert("RGB")
+            with instrumentation.span("clip.preprocess"):
+                return idx, self.processor(images=image, return_tensors="pt")["pixel_values"][0], None
+        except Exception as e:
+            return idx, None, str(e)
+
+# Stack the preprocessed screenshots of a batch, keeping the failed ones apart
+def collate_screenshots(batch):
+    loaded = [(idx, pixels) for idx, pixels, _ in batch if pixels is not None]
+    failed = [(idx, error) for idx, _, error in batch if error is not None]
+    indices = [idx for idx, _ in loaded]
+    pixel_values = torch.stack([pixels for _, pixels in loaded]) if loaded else None
+    return indices, pixel_values, failed
+
+# Screenshots with a description, as (file name, path), in directory walk order
+def find_described_images(image_dir, ui_descriptions):
+    images = []
+    for root, _, files in os.walk(image_dir):
+        instrumentation.log(f"📌 First 10 image filenames: {files[:10]}")  # Debug filenames
+
+        for file in files:
+            if file.endswith(".png") and not file.startswith("._"):
+                # Handle mismatched extensions
+                image_key_jpg = file.replace(".png", ".jpg").lower()
+                image_key_png = file.lower()
+
+                if image_key_jpg not in ui_descriptions and image_key_png not in ui_descriptions:
+                    print(f"⚠️ No description found for {file} (Looking for: {image_key_jpg} or {image_key_png})")
+                    continue  # Skip this image
+                images.append((file, Path(root) / file))
+    return images
+
+# Image embeddings of the screenshots from the model server, in batches of batch_size paths
+def remote_image_embeddings(client, model_path, image_paths, batch_size=32):
+    for batch in chunks(image_paths, batch_size):
+        yield from client.embed_images(model_path, batch)
+
+# Normalized image embeddings of the screenshots, by index; cached embeddings are reused and the rest
+# are encoded in batches loaded by the DataLoader workers, or by the model server when client is given
+def embed_images(image_paths, model, processor, device, batch_size=32, workers=2, cache=None, model_fingerprint=None,
+                 client=None, model_path=None):
+    embeddings = {}
+    keys = {}
+    pending = []
+    for idx, image_path in enumerate(image_paths):
+        if cache is not None:
+            keys[idx] = ResultCache.make_key(file_digest(image_path), "clip_image_embedding", model_fingerprint)
+            cached = cache.get(keys[idx])
+            if cached is not None:
+                embeddings[idx] = torch.tensor(cached, device=device)
+                instrumentation.count("clip.cache_hits")
+                continue
+        pending.append(idx)
+
+    if client is not None:
+        remote = remote_image_embeddings(client, model_path, [str(image_paths[idx]) for idx in pending], batch_size)
+        for idx, (image_embedding, error) in zip(pending, remote):
+            if error is not None:
+                print(f"❌ Error processing {image_paths[idx].name}: {error}")
+                continue
+            embeddings[idx] = torch.from_numpy(image_embedding.copy())
+            if cache is not None:
+                cache.put(keys[idx], "clip_image_embedding", image_embedding.tolist())
+        return embeddings
+
+    loader = DataLoader(ScreenshotDataset([image_paths[idx] for idx in pending], processor), batch_size=batch_size,
+                        num_workers=workers, collate_fn=collate_screenshots, pin_memory=device == "cuda")
+    batches = iter(loader)
+    while True:
+        with instrumentation.span("clip.load_wait"):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        batch_indices, pixel_values, failed = batch
+        for i, error in failed:
+            print(f"❌ Error processing {image_paths[pending[i]].name}: {error}")
+        if pixel_values is None:
+            continue
+        with instrumentation.span("clip.forward"), torch.no_grad():
+            image_embeddings = model.get_image_features(pixel_values=pixel_values.to(device))
+            image_embeddings /= image_embeddings.norm(dim=-1, keepdim=True)  # Normalize
+        instrumentation.count("clip.images", len(batch_indices))
+        for i, image_embedding in zip(batch_indices, image_embeddings):
+            embeddings[pending[i]] = image_embedding
+            if cache is not None:
+                cache.put(keys[pending[i]], "clip_image_embedding", image_embedding.tolist())
+    return embeddings
+
+def main():
+    args = parse_args()
+    instrumentation.configure_from_args(args)
+
+    # Load fine-tuned CLIP model, its ONNX export, or use the one kept loaded by the model server
+    if args.server:
+        client = ModelClient(args.server)
+        device, model, processor = "cpu", None, None
+        encode = partial(client.embed_texts, args.model_path, chunk_size=args.text_batch_size)
+    else:
+        client = None
+        if args.backend == "onnx":
+            # The processor and config still come from the model directory; the encoders run in ONNX Runtime
+            device = "cpu"
+            model = OnnxHfClip(args.onnx_dir, args.model_path, args.int8)
+        else:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            model = CLIPModel.from_pretrained(args.model_path).to(device)
+            model.eval()
+        processor = CLIPProcessor.from_pretrained(args.model_path)
+        encode = partial(encode_descriptions, model=model, processor=processor, device=device, batch_size=args.text_batch_size)
+
+    # Optional content-addressed cache of image embeddings, keyed on the screenshot and model weights
+    cache = ResultCache(args.cache_dir, max_bytes=args.cache_size_mb * 1024 * 1024) if args.cache_dir else None
+    model_fingerprint = None
+    if cache or args.embedding_store:
+        model_fingerprint = model.fingerprint if args.backend == "onnx" and not args.server else weights_fingerprint(args.model_path)
+
+    # Load UI descriptions
+    with instrumentation.span("clip.read"), open(args.ui_descriptions, "r") as f:
+        ui_descriptions = json.load(f)
+
+    # Normalize JSON keys (lowercase) for better matching
+    ui_descriptions = {k.lower().strip(): v for k, v in ui_descriptions.items()}
+    if not ui_descriptions:
+        print(f"❌ No UI descriptions in {args.ui_descriptions}, nothing to match.")
+        return
+
+    # Debug JSON keys
+    instrumentation.log(f"📌 First 10 JSON keys: {list(ui_descriptions.keys())[:10]}")
+
+    # Prepare text embeddings, from the persistent store when one is given
+    if args.embedding_store:
+        with instrumentation.span("clip.description_store"):
+            description_keys, text_descriptions, text_embeddings = update_description_store(
+                args.embedding_store, ui_descriptions, encode, model_fingerprint)
+    else:
+        description_keys = list(ui_descriptions)
+        text_descriptions = [truncate_text(desc) for desc in ui_descriptions.values()]
+        with instrumentation.span("clip.encode_text"):
+            text_embeddings = encode(text_descriptions)
+
+    images = find_described_images(args.image_dir, ui_descriptions)
+    image_embeddings = embed_images([path for _, path in images], model, processor, device, args.batch_size, args.workers,
+                                    cache, model_fingerprint, client, args.model_path)
+
+    # Dictionary to store results, scored in batches of screenshots
+    results = {}
+    scored = [idx for idx in range(len(images)) if idx in image_embeddings]
+    for start in range(0, len(scored), args.batch_size):
+        batch = scored[start:start + args.batch_size]
+        with instrumentation.span("clip.search"):
+            scores, indices = top_k_matches(torch.stack([image_embeddings[idx] for idx in batch]), text_embeddings, args.top_k)
+
+        for idx, image_scores, image_indices in zip(batch, scores.tolist(), indices.tolist()):
+            file, image_path = images[idx]
+            best_match_score, best_match_text = image_scores[0], text_descriptions[image_indices[0]]
+
+            # Print results
+            instrumentation.log(f"📸 Processed: {image_path}")
+            instrumentation.log(f"🔍 Best Matched UI Description (Score: {best_match_score:.2f}):\n{best_match_text}\n")
+
+            # Store results
+            results[file] = {
+                "best_match_description": best_match_text,
+                "similarity_score": round(best_match_score, 2),
+                "top_k": [{"key": description_keys[i], "description": text_descriptions[i], "similarity_score": round(score, 4)}
+                          for score, i in zip(image_scores, image_indices)]
+            }
+
+    # Save results to JSON
+    with instrumentation.span("clip.write"), open(args.output_json, "w") as f:
+        json.dump(results, f, indent=4)
+
+    print(f"✅ Processing complete. Results saved to: {args.output_json}")
+    if cache is not None:
+        print(f"🗄 {cache.summary()}")
+        cache.close()
+    instrumentation.report()
+
+if __name__ == "__main__":
+    main()
@@ -1,99 +1,252 @@
-import json
-import torch
-import open_clip
-import numpy as np
-from PIL import Image
-import faiss
-from sklearn.preprocessing import normalize
-import argparse
-
-# Argument parser for CLI
-parser = argparse.ArgumentParser(description="Match UI widgets with RICO captions using CLIP and FAISS.")
-parser.add_argument("--yolo_results", type=str, required=True, help="Path to YOLO results JSON file.")
-parser.add_argument("--rico_captions", type=str, required=True, help="Path to RICO widget captions JSON file.")
-parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the matched results.")
-args = parser.parse_args()
-
-# Load the RICO Widget Captioning dataset
-with open(args.rico_captions, "r") as f:
-    rico_captions = json.load(f)
-
-# Load CLIP Model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = open_clip.create_model_and_transforms("ViT-B/32", pretrained="openai")
-tokenizer = open_clip.get_tokenizer("ViT-B/32")
-
-# Load YOLO results (bounding boxes and OCR text)
-with open(args.yolo_results, "r") as f:
-    yolo_results = json.load(f)
-
-# Function to calculate cosine similarity
-def cosine_similarity(vec1, vec2):
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-
-# FAISS Setup: Create index for fast caption retrieval
-rico_texts = [rico["caption"] for rico in rico_captions]
-rico_embeddings = []
-
-# Create embeddings for RICO captions
-for caption in rico_texts:
-    text_tokenized = tokenizer([caption]).to(device)
-    with torch.no_grad():
-        text_embedding = model.encode_text(text_tokenized)
-    text_embedding /= text_embedding.norm(dim=-1, keepdim=True)  # Normalize embeddings
-    rico_embeddings.append(text_embedding.cpu().numpy())
-
-# Normalize the embeddings
-rico_embeddings = np.vstack(rico_embeddings)
-rico_embeddings = normalize(rico_embeddings, axis=1)
-
-
-index = faiss.IndexFlatL2(rico_embeddings.shape[1])  # L2 distance (Euclidean)
-index.add(rico_embeddings)  
-
-# Function to process each widget
-def process_widgets(yolo_results):
-    ui_analysis = []
-    for item in yolo_results:
-        image_name = item["image_name"]
-        img = Image.open(f"/path/to/images/{image_name}").convert("RGB")
-        
-        for widget in item["texts"]:
-            bbox = widget["bbox"]
-            text = widget["text"]
-            confidence = widget["confidence"]
-
-            # Crop the detected widget from the image
-            x_min, y_min = int(bbox[0][0]), int(bbox[0][1])
-            x_max, y_max = int(bbox[2][0]), int(bbox[2][1])
-            cropped_widget = img.crop((x_min, y_min, x_max, y_max))
-
-            # Preprocess & encode with CLIP
-            image_tensor = preprocess(cropped_widget).unsqueeze(0).to(device)
-            with torch.no_grad():
-                image_embedding = model.encode_image(image_tensor)
-            image_embedding /= image_embedding.norm(dim=-1, keepdim=True)  # Normalize embeddings
-
-            # Find the closest caption in the RICO dataset 
-            D, I = index.search(image_embedding.cpu().numpy(), k=1)  # Search for top 1 match
-            best_caption = rico_texts[I[0][0]]  # Get the best matched caption
-
-            # Add widget description to UI analysis
-            ui_analysis.append(f"- The screen contains a '{best_caption}' (Detected: {text}, Confidence: {confidence:.2f})")
-    
-    return ui_analysis
-
-# Run the analysis
-ui_analysis = process_widgets(yolo_results)
-
-# Print Final UI Analysis
-print("\n**UI Screenshot Analysis**")
-for line in ui_analysis:
-    print(line)
-
-# Save the results to the output directory
-output_file = f"{args.output_dir}/matched_results.json"
-with open(output_file, "w") as f:
-    json.dump(ui_analysis, f, indent=4)
-
-print(f"\n Results saved to {output_file}")
+import json
+import torch
+import numpy as np
+from PIL import Image
+import argparse
+import os
+import sys
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from jsonl_records import iter_records
+from result_cache import ResultCache, file_digest
+from model_client import ModelClient
+import instrumentation
+from caption_index import (load_clip, caption_fingerprint, build_caption_index, load_or_build_caption_index,
+                           add_index_args, index_spec_from_args, set_search_params, is_exact_index,
+                           canonical_index_spec)
+from onnx_clip import add_backend_args, load_clip_onnx
+
+# Argument parser for CLI
+def parse_args():
+    parser = argparse.ArgumentParser(description="Match UI widgets with RICO captions using CLIP and FAISS.")
+    parser.add_argument("--yolo_results", type=str, required=True, help="Path to YOLO results JSON file (.jsonl files are read lazily, one record at a time).")
+    parser.add_argument("--rico_captions", type=str, required=True, help="Path to RICO widget captions JSON file.")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the matched results.")
+    parser.add_argument("--index_dir", type=str, default=None, help="Directory of the saved caption index (see caption_index.py); built on first use and rebuilt when the captions or the CLIP model change.")
+    parser.add_argument("--image_dir", type=str, default="/path/to/images", help="Directory containing the screenshots named in the YOLO results.")
+    parser.add_argument("--batch_size", type=int, default=64, help="Widget crops encoded per forward pass (crops from several screenshots are batched together).")
+    parser.add_argument("--workers", type=int, default=4, help="Threads decoding screenshots and preprocessing crops ahead of the encoder.")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of the shared result cache; unchanged screenshots are not re-encoded.")
+    parser.add_argument("--cache_size_mb", type=int, default=1024, help="Maximum size of the result cache before least recently used entries are evicted.")
+    parser.add_argument("--server", type=str, default=None, help="URL of a running Model_server/model_server.py (e.g. http://127.0.0.1:8765); CLIP and the caption index are not loaded here.")
+    add_index_args(parser)
+    add_backend_args(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.backend == "onnx" and not args.onnx_dir:
+        parser.error("--backend onnx needs --onnx_dir")
+    return args
+
+# Function to calculate cosine similarity
+def cosine_similarity(vec1, vec2):
+    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+
+# Matches depend on the CLIP model (and how it is run), the caption set and the index backend
+def captioner_fingerprint(rico_captions_path, index_spec=None, nprobe=16, ef_search=64, encoder=None):
+    fingerprint = caption_fingerprint(rico_captions_path, encoder)
+    if not is_exact_index(index_spec):
+        # Approximate backends can return other captions, so their settings are part of cache keys
+        fingerprint += ":" + json.dumps([canonical_index_spec(index_spec), nprobe, ef_search], sort_keys=True)
+    return fingerprint
+
+# CLIP model plus a FAISS index over the RICO widget captions.
+# With backend "onnx", the encoders exported by onnx_clip.py run in ONNX Runtime on the CPU instead.
+class WidgetCaptioner:
+    def __init__(self, rico_captions_path, device=None, index_dir=None, batch_size=256, index_spec=None,
+                 nprobe=16, ef_search=64, backend="torch", onnx_dir=None, int8=False):
+        # Load CLIP Model
+        encoder = None
+        if backend == "onnx":
+            self.device = "cpu"
+            self.model, self.preprocess, self.tokenizer = load_clip_onnx(onnx_dir, int8)
+            encoder = self.model.fingerprint
+        else:
+            self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+            self.model, self.preprocess, self.tokenizer = load_clip(self.device)
+
+        self.fingerprint = captioner_fingerprint(rico_captions_path, index_spec, nprobe, ef_search, encoder)
+
+        # FAISS Setup: reuse the saved caption index, or encode the RICO captions in batches
+        if index_dir:
+            self.index, self.rico_texts = load_or_build_caption_index(rico_captions_path, index_dir, self.model,
+                                                                      self.tokenizer, self.device, batch_size, index_spec,
+                                                                      encoder)
+        else:
+            self.index, self.rico_texts = build_caption_index(rico_captions_path, self.model, self.tokenizer,
+                                                              self.device, batch_size=batch_size, index_spec=index_spec,
+                                                              encoder=encoder)
+        set_search_params(self.index, nprobe, ef_search)
+
+    # Encode a batch of preprocessed crops in one forward pass and search the index once for all of them
+    def caption_tensors(self, image_tensors):
+        with instrumentation.span("clip.forward"), torch.no_grad():
+            image_embedding = self.model.encode_image(image_tensors.to(self.device))
+            image_embedding /= image_embedding.norm(dim=-1, keepdim=True)  # Normalize embeddings
+            queries = image_embedding.float().cpu().numpy()
+
+        # Find the closest caption in the RICO dataset
+        with instrumentation.span("clip.faiss_search"):
+            D, I = self.index.search(queries, k=1)  # Search for top 1 match
+        return [self.rico_texts[i] for i in I[:, 0]]  # Get the best matched captions
+
+    # Best matching captions for a list of cropped widget images
+    def caption_batch(self, cropped_widgets):
+        if not cropped_widgets:
+            return []
+        with instrumentation.span("clip.preprocess"):
+            image_tensors = torch.stack([self.preprocess(crop) for crop in cropped_widgets])
+        return self.caption_tensors(image_tensors)
+
+    # Find the closest RICO caption for one cropped widget image
+    def caption(self, cropped_widget):
+        return self.caption_batch([cropped_widget])[0]
+
+    # Decode a screenshot and preprocess the crops of the given boxes
+    def prepare_crops(self, image_path, boxes):
+        with instrumentation.span("clip.decode"):
+            img = Image.open(image_path).convert("RGB")
+        with instrumentation.span("clip.preprocess"):
+            return [self.preprocess(img.crop(box)) for box in boxes]
+
+    # Captions of crops from prepare_crops, as one batch
+    def caption_prepared(self, crops):
+        with instrumentation.span("clip.stack"):
+            image_tensors = torch.stack(crops)
+        return self.caption_tensors(image_tensors)
+
+# Same interface for process_widgets, with the CLIP model and the caption index kept loaded by the
+# model server: crops are sent as (screenshot path, box) and decoded there
+class RemoteWidgetCaptioner:
+    def __init__(self, server, rico_captions_path, index_dir=None, index_spec=None, nprobe=16, ef_search=64):
+        self.client = ModelClient(server)
+        self.options = {"rico_captions": rico_captions_path, "index_dir": index_dir, "index_spec": index_spec,
+                        "nprobe": nprobe, "ef_search": ef_search}
+        self.fingerprint = captioner_fingerprint(rico_captions_path, index_spec, nprobe, ef_search)
+
+    def prepare_crops(self, image_path, boxes):
+        image_path = os.path.abspath(image_path)
+        return [(image_path, box) for box in boxes]
+
+    def caption_prepared(self, crops):
+        return self.client.caption(crops, **self.options)
+
+# One line of the UI analysis for a matched widget
+def describe_widget(best_caption, text, confidence):
+    return f"- The screen contains a '{best_caption}' (Detected: {text}, Confidence: {confidence:.2f})"
+
+# Crop box of an OCR/widget quad
+def quad_to_box(bbox):
+    x_min, y_min = int(bbox[0][0]), int(bbox[0][1])
+    x_max, y_max = int(bbox[2][0]), int(bbox[2][1])
+    return x_min, y_min, x_max, y_max
+
+# Runs in the worker pool: cache lookup, or decode the screenshot and preprocess all its widget crops
+def prepare_image(item, captioner, image_dir, cache):
+    image_path = f"{image_dir}/{item['image_name']}"
+    key = None
+    if cache is not None:
+        key = ResultCache.make_key(file_digest(image_path), "clip_matching", captioner.fingerprint,
+                                   {"bboxes": [widget["bbox"] for widget in item["texts"]]})
+        cached = cache.get(key)
+        if cached is not None:
+            return item, key, cached, None
+
+    crops = captioner.prepare_crops(image_path, [quad_to_box(widget["bbox"]) for widget in item["texts"]])
+    return item, key, None, crops
+
+# Prepare screenshots in a thread pool, keeping a bounded number in flight, and yield them in input order
+def iter_prepared(yolo_results, captioner, image_dir, cache, workers):
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = deque()
+        for item in yolo_results:
+            pending.append(pool.submit(prepare_image, item, captioner, image_dir, cache))
+            if len(pending) > 2 * max(1, workers):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# Function to process each widget.
+# Crops from many screenshots are collected into fixed-size batches; each batch is one encoder call
+# and one FAISS search, and the captions are mapped back to the widgets in their original order.
+def process_widgets(yolo_results, captioner, image_dir, cache=None, batch_size=64, workers=4):
+    # [caption, detected text, confidence] per widget, in output order; captions are filled in per batch
+    entries = []
+    uncached = []  # (cache key, first entry, widget count) of images whose captions are computed now
+    batch_crops, batch_slots = [], []
+
+    def run_batch():
+        captions = captioner.caption_prepared(batch_crops)
+        for slot, best_caption in zip(batch_slots, captions):
+            entries[slot][0] = best_caption
+        batch_crops.clear()
+        batch_slots.clear()
+
+    for item, key, cached, crops in iter_prepared(yolo_results, captioner, image_dir, cache, workers):
+        if cached is not None:
+            # Byte-identical screenshot with the same widget boxes: reuse the matched captions
+            instrumentation.count("clip.cache_hits")
+            for widget, best_caption in zip(item["texts"], cached):
+                entries.append([best_caption, widget["text"], widget["confidence"]])
+            continue
+
+        instrumentation.count("clip.widgets", len(crops))
+        uncached.append((key, len(entries), len(crops)))
+        for widget, crop in zip(item["texts"], crops):
+            batch_slots.append(len(entries))
+            batch_crops.append(crop)
+            entries.append([None, widget["text"], widget["confidence"]])
+            if len(batch_crops) == batch_size:
+                run_batch()
+
+    if batch_crops:
+        run_batch()
+
+    if cache is not None:
+        for key, start, count in uncached:
+            cache.put(key, "clip_matching", [entry[0] for entry in entries[start:start + count]])
+
+    # Add widget descriptions to UI analysis
+    return [describe_widget(best_caption, text, confidence) for best_caption, text, confidence in entries]
+
+def main():
+    args = parse_args()
+    instrumentation.configure_from_args(args)
+    if args.server:
+        captioner = RemoteWidgetCaptioner(args.server, args.rico_captions, args.index_dir, index_spec_from_args(args),
+                                          args.nprobe, args.ef_search)
+    else:
+        captioner = WidgetCaptioner(args.rico_captions, index_dir=args.index_dir, index_spec=index_spec_from_args(args),
+                                    nprobe=args.nprobe, ef_search=args.ef_search, backend=args.backend,
+                                    onnx_dir=args.onnx_dir, int8=args.int8)
+
+    # Optional content-addressed result cache shared with the other stages
+    cache = ResultCache(args.cache_dir, max_bytes=args.cache_size_mb * 1024 * 1024) if args.cache_dir else None
+
+    # Load YOLO results (bounding boxes and OCR text)
+    yolo_results = iter_records(args.yolo_results)
+
+    # Run the analysis
+    ui_analysis = process_widgets(yolo_results, captioner, args.image_dir, cache, args.batch_size, args.workers)
+
+    # Print Final UI Analysis
+    instrumentation.log("\n**UI Screenshot Analysis**")
+    for line in ui_analysis:
+        instrumentation.log(line)
+
+    # Save the results to the output directory
+    output_file = f"{args.output_dir}/matched_results.json"
+    with instrumentation.span("clip.write"), open(output_file, "w") as f:
+        json.dump(ui_analysis, f, indent=4)
+
+    print(f"\n Results saved to {output_file}")
+    if cache is not None:
+        print(f" {cache.summary()}")
+        cache.close()
+    instrumentation.report()
+
+if __name__ == "__main__":
+    main()
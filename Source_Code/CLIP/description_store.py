@@ -0,0 +1,116 @@
+import os
+import json
+import glob
+import hashlib
+import secrets
+import numpy as np
+import torch
+
+# Files of a saved description store. Every update writes its embeddings to a new file, named in the
+# entries, so the entries and the embeddings they describe are switched together by one os.replace.
+EMBEDDINGS_PATTERN = "embeddings_*.npy"
+ENTRIES_FILE = "entries.json"
+
+# Truncate descriptions to avoid CLIP token limit
+def truncate_text(text, max_tokens=512):
+    tokens = text.split()
+    return " ".join(tokens[:max_tokens])
+
+# Identifies a description text; only descriptions with a new digest are re-encoded
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Encode descriptions in batches, so the padded token tensor stays small; returns L2-normalized float32 embeddings
+def encode_descriptions(texts, model, processor, device, batch_size=256):
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        text_inputs = processor(text=texts[start:start + batch_size], padding=True, truncation=True, return_tensors="pt").to(device)
+        with torch.no_grad():
+            text_embeddings = model.get_text_features(**text_inputs)
+            text_embeddings /= text_embeddings.norm(dim=-1, keepdim=True)  # Normalize
+        embeddings.append(text_embeddings.float().cpu().numpy())
+    if not embeddings:
+        return np.zeros((0, model.config.projection_dim), dtype=np.float32)
+    return np.vstack(embeddings)
+
+# Saved digests and memory-mapped embeddings, if the store was written with the same model
+def load_description_store(store_dir, fingerprint):
+    entries_path = os.path.join(store_dir, ENTRIES_FILE)
+    if not os.path.exists(entries_path):
+        return None
+    with open(entries_path, "r") as f:
+        entries = json.load(f)
+    # Stores written before the embeddings file was named in the entries are rebuilt
+    if entries.get("fingerprint") != fingerprint or "embeddings_file" not in entries:
+        return None
+    embeddings = np.load(os.path.join(store_dir, entries["embeddings_file"]), mmap_mode="r")
+    if len(embeddings) != len(entries["digests"]):
+        return None
+    return entries, embeddings
+
+# Bring the store in line with the descriptions: embeddings of unchanged texts are copied over,
+# only new or edited descriptions are passed to encode (texts -> normalized embeddings). Returns the keys,
+# the truncated texts and the embeddings (memory-mapped from the store) in description order.
+def update_description_store(store_dir, ui_descriptions, encode, fingerprint):
+    keys = list(ui_descriptions)
+    texts = [truncate_text(ui_descriptions[key]) for key in keys]
+    digests = [text_digest(text) for text in texts]
+
+    saved = load_description_store(store_dir, fingerprint)
+    if saved is not None and saved[0]["keys"] == keys and saved[0]["digests"] == digests:
+        print(f"📦 Description store up to date: {len(keys)} descriptions")
+        return keys, texts, saved[1]
+
+    # Rows of the saved store by text, so renamed or reordered entries are reused as well
+    saved_rows = {digest: row for row, digest in enumerate(saved[0]["digests"])} if saved is not None else {}
+    stale = [i for i, digest in enumerate(digests) if digest not in saved_rows]
+    encoded = encode([texts[i] for i in stale])
+
+    dim = encoded.shape[1] if stale or saved is None else saved[1].shape[1]
+    embeddings = np.empty((len(keys), dim), dtype=np.float32)
+    encoded_rows = dict(zip(stale, encoded))
+    for i, digest in enumerate(digests):
+        embeddings[i] = encoded_rows[i] if i in encoded_rows else saved[1][saved_rows[digest]]
+
+    # The embeddings go to a new file that no entries point to yet, then the entries naming it replace the
+    # old ones in one step: an interrupted update leaves either the old store or the new one, never the old
+    # digest -> row map over rows in a new order. Embeddings files no longer named are deleted afterwards.
+    os.makedirs(store_dir, exist_ok=True)
+    embeddings_file = EMBEDDINGS_PATTERN.replace("*", secrets.token_hex(8))
+    embeddings_path = os.path.join(store_dir, embeddings_file)
+    entries_path = os.path.join(store_dir, ENTRIES_FILE)
+    with open(embeddings_path, "wb") as f:
+        np.save(f, embeddings)
+    with open(entries_path + ".tmp", "w") as f:
+        json.dump({"fingerprint": fingerprint, "keys": keys, "digests": digests, "embeddings_file": embeddings_file}, f)
+    del saved
+    os.replace(entries_path + ".tmp", entries_path)
+    for path in glob.glob(os.path.join(store_dir, EMBEDDINGS_PATTERN)):
+        if path != embeddings_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    print(f"📦 Description store updated: {len(stale)} encoded, {len(keys) - len(stale)} reused")
+    return keys, texts, np.load(embeddings_path, mmap_mode="r")
+
+# Top-k descriptions for a batch of normalized image embeddings. The description embeddings are
+# scored in chunks, so a large memory-mapped store is never copied into memory as a whole.
+# Without descriptions, every image gets an empty row.
+def top_k_matches(image_embeddings, text_embeddings, k=5, chunk_size=65536):
+    if len(text_embeddings) == 0:
+        empty = (len(image_embeddings), 0)
+        return (torch.zeros(empty, device=image_embeddings.device),
+                torch.zeros(empty, dtype=torch.long, device=image_embeddings.device))
+    best_scores, best_indices = None, None
+    for start in range(0, len(text_embeddings), chunk_size):
+        chunk = torch.from_numpy(np.array(text_embeddings[start:start + chunk_size], dtype=np.float32)).to(image_embeddings.device)
+        with torch.no_grad():
+            scores, indices = (image_embeddings @ chunk.T).topk(min(k, len(chunk)), dim=1)
+        indices += start
+        if best_scores is not None:
+            scores, order = torch.cat([best_scores, scores], dim=1).topk(min(k, best_scores.shape[1] + scores.shape[1]), dim=1)
+            indices = torch.cat([best_indices, indices], dim=1).gather(1, order)
+        best_scores, best_indices = scores, indices
+    return best_scores, best_indices
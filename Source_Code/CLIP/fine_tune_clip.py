@@ -1,71 +1,213 @@
-import torch
-from transformers import CLIPProcessor, CLIPModel
-import json
-from pathlib import Path
-from PIL import Image
-from torch.utils.data import Dataset, DataLoader
-import argparse
-
-# Argument parser for CLI
-parser = argparse.ArgumentParser(description="Fine-tune CLIP model on RICO Widget Captioning dataset.")
-parser.add_argument("--train_data", type=str, required=True, help="Path to RICO dataset (images and captions).")
-parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the fine-tuned CLIP model.")
-parser.add_argument("--batch_size", type=int, default=4, help="Batch size for training.")
-parser.add_argument("--epochs", type=int, default=3, help="Number of epochs for training.")
-args = parser.parse_args()
-
-# Define Dataset Class
-class RICODataset(Dataset):
-    def __init__(self, data_path):
-        with open(data_path, "r") as f:
-            self.data = json.load(f)
-        self.image_dir = Path(data_path).parent / "images"  # Assumes images are in 'images' subdirectory
-        self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-    
-    def __len__(self):
-        return len(self.data)
-
-    def __getitem__(self, idx):
-        item = self.data[idx]
-        image_path = self.image_dir / item["image_name"]
-        image = Image.open(image_path).convert("RGB")
-        caption = item["caption"]
-        inputs = self.processor(text=[caption], images=image, return_tensors="pt", padding=True)
-        return inputs
-
-# Load the Dataset
-dataset = RICODataset(args.train_data)
-dataloader = DataLoader(dataset, batch_size=args.batch_size, shuffle=True)
-
-# Load Pre-trained CLIP Model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
-
-# Set the optimizer and loss function
-optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
-
-# Fine-tuning Loop
-for epoch in range(args.epochs):
-    model.train()
-    total_loss = 0
-
-    for batch in dataloader:
-        input_ids = batch['input_ids'].squeeze(1).to(device)
-        pixel_values = batch['pixel_values'].to(device)
-        
-        # Forward pass
-        outputs = model(input_ids=input_ids, pixel_values=pixel_values, return_loss=True)
-        loss = outputs.loss
-        total_loss += loss.item()
-
-        # Backpropagation
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
-
-    avg_loss = total_loss / len(dataloader)
-    print(f"Epoch {epoch+1}/{args.epochs}, Loss: {avg_loss:.4f}")
-
-# Save the fine-tuned model
-model.save_pretrained(args.output_dir)
-print(f"Fine-tuned model saved at {args.output_dir}")
+import torch
+import torch.nn.functional as F
+from transformers import CLIPProcessor, CLIPModel
+import json
+import os
+import time
+from functools import partial
+from pathlib import Path
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader, Sampler
+import argparse
+
+from training_shards import ShardDataset
+
+# Pre-trained CLIP model that is fine-tuned
+BASE_MODEL = "openai/clip-vit-base-patch32"
+
+# Checkpoint file inside --checkpoint_dir
+CHECKPOINT_FILE = "checkpoint.pt"
+
+# Argument parser for CLI
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tune CLIP model on RICO Widget Captioning dataset.")
+    parser.add_argument("--train_data", type=str, default=None, help="Path to RICO dataset (images and captions).")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Preprocessed shards from training_shards.py, used instead of --train_data.")
+    parser.add_argument("--base_model", type=str, default=BASE_MODEL, help="Pre-trained CLIP model to start from.")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the fine-tuned CLIP model.")
+    parser.add_argument("--batch_size", type=int, default=4, help="Batch size of one forward pass.")
+    parser.add_argument("--accumulation_steps", type=int, default=1, help="Forward passes per optimizer step; the contrastive loss is computed over all of them (effective batch = batch_size * accumulation_steps).")
+    parser.add_argument("--epochs", type=int, default=3, help="Number of epochs for training.")
+    parser.add_argument("--lr", type=float, default=1e-5, help="AdamW learning rate.")
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader worker processes.")
+    parser.add_argument("--prefetch_factor", type=int, default=4, help="Batches loaded in advance by each worker.")
+    parser.add_argument("--bf16", action="store_true", help="Run forward passes under bfloat16 autocast (also on CPU).")
+    parser.add_argument("--checkpoint_dir", type=str, default=None, help="Directory for periodic training checkpoints.")
+    parser.add_argument("--checkpoint_every", type=int, default=100, help="Optimizer steps between checkpoints.")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint in --checkpoint_dir.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the data shuffling, so a resumed epoch sees the same order.")
+    args = parser.parse_args()
+    if not args.train_data and not args.shard_dir:
+        parser.error("one of --train_data or --shard_dir is required")
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume requires --checkpoint_dir")
+    return args
+
+# Define Dataset Class
+class RICODataset(Dataset):
+    def __init__(self, data_path, processor):
+        with open(data_path, "r") as f:
+            self.data = json.load(f)
+        self.image_dir = Path(data_path).parent / "images"  # Assumes images are in 'images' subdirectory
+        self.processor = processor
+
+    def __len__(self):
+        return len(self.data)
+
+    # One sample: pixel values and the unpadded token IDs of its caption
+    def __getitem__(self, idx):
+        item = self.data[idx]
+        image_path = self.image_dir / item["image_name"]
+        image = Image.open(image_path).convert("RGB")
+        caption = item["caption"]
+        pixel_values = self.processor(images=image, return_tensors="pt")["pixel_values"][0]
+        input_ids = self.processor.tokenizer(caption, truncation=True, return_tensors="pt")["input_ids"][0]
+        return {"pixel_values": pixel_values, "input_ids": input_ids}
+
+# Stack a batch, padding the captions to the longest one in the batch with a matching attention mask
+def pad_collate(batch, pad_token_id):
+    max_length = max(len(item["input_ids"]) for item in batch)
+    input_ids = torch.full((len(batch), max_length), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), max_length), dtype=torch.long)
+    for i, item in enumerate(batch):
+        input_ids[i, :len(item["input_ids"])] = item["input_ids"]
+        attention_mask[i, :len(item["input_ids"])] = 1
+    return {"pixel_values": torch.stack([item["pixel_values"] for item in batch]), "input_ids": input_ids, "attention_mask": attention_mask}
+
+# Shuffled order that depends only on the seed and the epoch, so a resumed run can skip the samples already seen
+class EpochSampler(Sampler):
+    def __init__(self, length, seed, epoch, start=0):
+        self.length, self.seed, self.epoch, self.start = length, seed, epoch, start
+
+    def __len__(self):
+        return self.length - self.start
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        return iter(torch.randperm(self.length, generator=generator)[self.start:].tolist())
+
+# Normalized image and text embeddings of a batch
+def embed(model, batch, device):
+    image_embeds = model.get_image_features(pixel_values=batch["pixel_values"].to(device, non_blocking=True))
+    text_embeds = model.get_text_features(input_ids=batch["input_ids"].to(device, non_blocking=True),
+                                          attention_mask=batch["attention_mask"].to(device, non_blocking=True))
+    return F.normalize(image_embeds.float(), dim=-1), F.normalize(text_embeds.float(), dim=-1)
+
+# Symmetric contrastive loss of CLIP over matching image/text pairs
+def clip_loss(image_embeds, text_embeds, logit_scale):
+    logits_per_text = logit_scale.exp() * text_embeds @ image_embeds.T
+    labels = torch.arange(len(logits_per_text), device=logits_per_text.device)
+    return (F.cross_entropy(logits_per_text, labels) + F.cross_entropy(logits_per_text.T, labels)) / 2
+
+# One optimizer step over several forward passes. Averaging per-pass losses would only contrast samples within
+# a pass, so the embeddings of all passes are computed first without gradients, the loss is taken over all of
+# them, and each pass is then recomputed with gradients and backpropagated with its share of the embedding
+# gradients. Memory stays that of one pass while the loss sees the full effective batch.
+def train_step(model, micro_batches, optimizer, device, autocast):
+    optimizer.zero_grad()
+    if len(micro_batches) == 1:
+        with autocast():
+            image_embeds, text_embeds = embed(model, micro_batches[0], device)
+        loss = clip_loss(image_embeds, text_embeds, model.logit_scale)
+        loss.backward()
+        optimizer.step()
+        return loss.item()
+
+    with torch.no_grad(), autocast():
+        cached = [embed(model, batch, device) for batch in micro_batches]
+    image_embeds = torch.cat([image for image, _ in cached]).requires_grad_()
+    text_embeds = torch.cat([text for _, text in cached]).requires_grad_()
+    loss = clip_loss(image_embeds, text_embeds, model.logit_scale)
+    loss.backward()
+
+    start = 0
+    for batch in micro_batches:
+        end = start + len(batch["input_ids"])
+        with autocast():
+            image, text = embed(model, batch, device)
+        surrogate = (image * image_embeds.grad[start:end]).sum() + (text * text_embeds.grad[start:end]).sum()
+        surrogate.backward()
+        start = end
+    optimizer.step()
+    return loss.item()
+
+# Save the training state; written to a temporary file first so a kill during saving keeps the previous checkpoint
+def save_checkpoint(checkpoint_dir, model, optimizer, epoch, samples_done, global_step, args):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    torch.save({"model": model.state_dict(), "optimizer": optimizer.state_dict(), "epoch": epoch,
+                "samples_done": samples_done, "global_step": global_step, "seed": args.seed}, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def main():
+    args = parse_args()
+
+    # Load Pre-trained CLIP Model
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = CLIPModel.from_pretrained(args.base_model).to(device)
+    processor = CLIPProcessor.from_pretrained(args.base_model)
+
+    # Load the Dataset: memory-mapped shards need no decoding or tokenizing during training
+    if args.shard_dir:
+        dataset = ShardDataset(args.shard_dir)
+        collate_fn = dataset.collate
+    else:
+        dataset = RICODataset(args.train_data, processor)
+        collate_fn = partial(pad_collate, pad_token_id=processor.tokenizer.pad_token_id)
+
+    # Set the optimizer
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
+    autocast = partial(torch.autocast, device_type=device, dtype=torch.bfloat16, enabled=args.bf16)
+
+    start_epoch, samples_done, global_step = 0, 0, 0
+    checkpoint_path = os.path.join(args.checkpoint_dir, CHECKPOINT_FILE) if args.checkpoint_dir else None
+    if args.resume and os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location=device)
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        start_epoch, samples_done, global_step = checkpoint["epoch"], checkpoint["samples_done"], checkpoint["global_step"]
+        args.seed = checkpoint["seed"]
+        print(f"🔄 Resuming from epoch {start_epoch + 1}, sample {samples_done}, step {global_step}")
+
+    # Fine-tuning Loop
+    for epoch in range(start_epoch, args.epochs):
+        model.train()
+        sampler = EpochSampler(len(dataset), args.seed, epoch, samples_done)
+        loader_options = {"prefetch_factor": args.prefetch_factor} if args.workers > 0 else {}
+        dataloader = DataLoader(dataset, batch_size=args.batch_size, sampler=sampler, num_workers=args.workers,
+                                collate_fn=collate_fn, pin_memory=device == "cuda", **loader_options)
+
+        total_loss, steps, epoch_samples = 0.0, 0, 0
+        start = time.perf_counter()
+        micro_batches = []
+        for i, batch in enumerate(dataloader):
+            micro_batches.append(batch)
+            if len(micro_batches) < args.accumulation_steps and i < len(dataloader) - 1:
+                continue
+
+            total_loss += train_step(model, micro_batches, optimizer, device, autocast)
+            steps += 1
+            global_step += 1
+            step_samples = sum(len(b["input_ids"]) for b in micro_batches)
+            epoch_samples += step_samples
+            samples_done += step_samples
+            micro_batches = []
+
+            if checkpoint_path and global_step % args.checkpoint_every == 0:
+                save_checkpoint(args.checkpoint_dir, model, optimizer, epoch, samples_done, global_step, args)
+
+        elapsed = time.perf_counter() - start
+        avg_loss = total_loss / max(1, steps)
+        print(f"Epoch {epoch+1}/{args.epochs}, Loss: {avg_loss:.4f}, {epoch_samples / elapsed:.1f} samples/sec")
+
+        samples_done = 0
+        if checkpoint_path:
+            save_checkpoint(args.checkpoint_dir, model, optimizer, epoch + 1, 0, global_step, args)
+
+    # Save the fine-tuned model, with its processor so clip_inference.py can load both from one directory
+    model.save_pretrained(args.output_dir)
+    processor.save_pretrained(args.output_dir)
+    print(f"Fine-tuned model saved at {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
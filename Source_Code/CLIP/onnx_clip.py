@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+import numpy as np
+import torch
+from PIL import Image
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from onnx_runtime import create_session, quantize_int8, int8_path, embedding_drift
+from result_cache import file_digest, weights_fingerprint
+
+# Files of an exported encoder pair
+IMAGE_ENCODER = "image_encoder.onnx"
+TEXT_ENCODER = "text_encoder.onnx"
+META_FILE = "meta.json"
+
+# Model kinds: the open_clip ViT-B/32 of clip_matching.py, or a fine-tuned transformers CLIPModel of clip_inference.py
+MODEL_KINDS = ["open_clip", "hf"]
+
+# Argument parser for CLI
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the CLIP image and text encoders to ONNX (optionally int8) and check them against PyTorch.")
+    parser.add_argument("--model", type=str, choices=MODEL_KINDS, default="open_clip", help="open_clip: the captioning model of clip_matching.py; hf: the fine-tuned model of clip_inference.py (needs --model_path).")
+    parser.add_argument("--model_path", type=str, default=None, help="Path to the fine-tuned CLIP model (with --model hf).")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the ONNX encoders in.")
+    parser.add_argument("--int8", action="store_true", help="Also save int8 copies of both encoders (dynamic quantization of the MatMul/Gemm weights; the patch-embedding convolution stays fp32).")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version.")
+    parser.add_argument("--skip_export", action="store_true", help="Only run the parity check on an existing export.")
+    parser.add_argument("--parity_images", type=str, default=None, help="Directory of screenshots to compare image embeddings on.")
+    parser.add_argument("--parity_texts", type=str, default=None, help="RICO captions or UI descriptions JSON to compare text embeddings on.")
+    parser.add_argument("--parity_count", type=int, default=32, help="Screenshots and texts used by the parity check.")
+    parser.add_argument("--report_json", type=str, default=None, help="Path to save the parity report (default: parity.json in --output_dir).")
+    args = parser.parse_args()
+    if args.model == "hf" and not args.model_path:
+        parser.error("--model hf needs --model_path")
+    return args
+
+# Backend options of the scripts that run a CLIP model
+def add_backend_args(parser):
+    parser.add_argument("--backend", type=str, choices=["torch", "onnx"], default="torch", help="Run the CLIP encoders in PyTorch, or through ONNX Runtime on the CPU (export them with onnx_clip.py first).")
+    parser.add_argument("--onnx_dir", type=str, default=None, help="Directory of the encoders exported by onnx_clip.py (with --backend onnx).")
+    parser.add_argument("--int8", action="store_true", help="Use the int8-quantized encoders (with --backend onnx).")
+
+# Modules traced by the export; each returns the unnormalized embeddings like the method it wraps
+class OpenClipImageEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.encode_image(pixel_values)
+
+class OpenClipTextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids):
+        return self.model.encode_text(input_ids)
+
+class HfImageEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+class HfTextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+# The PyTorch model with functions that turn PIL images and texts into its inputs
+def load_torch_model(kind, model_path=None):
+    if kind == "open_clip":
+        # Imported here: caption_index needs open_clip and faiss, which clip_inference.py does not
+        from caption_index import load_clip
+        model, preprocess, tokenizer = load_clip("cpu")
+        model.eval()
+        return model, lambda images: {"pixel_values": torch.stack([preprocess(image) for image in images])}, \
+            lambda texts: {"input_ids": tokenizer(texts)}
+
+    from transformers import CLIPModel, CLIPProcessor
+    model = CLIPModel.from_pretrained(model_path)
+    model.eval()
+    processor = CLIPProcessor.from_pretrained(model_path)
+    return model, lambda images: {"pixel_values": processor(images=images, return_tensors="pt")["pixel_values"]}, \
+        lambda texts: dict(processor(text=texts, padding=True, truncation=True, return_tensors="pt"))
+
+# The fused fast path nn.MultiheadAttention takes in inference (the open_clip transformer) has no ONNX
+# export, so it is switched off while tracing
+def export_module(module, inputs, path, opset, sequence_axis=False):
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} if sequence_axis else {0: "batch"} for name in inputs}
+    dynamic_axes["embeddings"] = {0: "batch"}
+    fastpath = torch.backends.mha.get_fastpath_enabled()
+    torch.backends.mha.set_fastpath_enabled(False)
+    try:
+        torch.onnx.export(module, tuple(inputs.values()), str(path), input_names=list(inputs), output_names=["embeddings"],
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True, dynamo=False)
+    finally:
+        torch.backends.mha.set_fastpath_enabled(fastpath)
+
+# Export both encoders with a dynamic batch size (and text length for transformers models), plus their
+# int8 copies; meta.json keeps the image preprocessing, so ONNX runs need no PyTorch weights
+def export_encoders(kind, output_dir, model_path=None, opset=17, int8=False):
+    os.makedirs(output_dir, exist_ok=True)
+    model, image_inputs, text_inputs = load_torch_model(kind, model_path)
+    if kind == "open_clip":
+        from caption_index import CLIP_MODEL_NAME, CLIP_PRETRAINED
+        image_module, text_module = OpenClipImageEncoder(model), OpenClipTextEncoder(model)
+        source = {"model": CLIP_MODEL_NAME, "pretrained": CLIP_PRETRAINED, "preprocess": dict(model.visual.preprocess_cfg)}
+    else:
+        image_module, text_module = HfImageEncoder(model), HfTextEncoder(model)
+        source = {"model": os.path.abspath(model_path), "weights": weights_fingerprint(model_path)}
+
+    blank = Image.new("RGB", (224, 224))
+    with torch.no_grad():
+        export_module(image_module, image_inputs([blank, blank]), os.path.join(output_dir, IMAGE_ENCODER), opset)
+        export_module(text_module, text_inputs(["a button", "a switch to turn on wi-fi"]), os.path.join(output_dir, TEXT_ENCODER),
+                      opset, sequence_axis=kind == "hf")
+
+    if int8:
+        for name in (IMAGE_ENCODER, TEXT_ENCODER):
+            quantize_int8(os.path.join(output_dir, name), int8_path(os.path.join(output_dir, name)))
+
+    with open(os.path.join(output_dir, META_FILE), "w") as f:
+        json.dump({"kind": kind, "opset": opset, "int8": int8, **source}, f, indent=4)
+    print(f" Exported {kind} encoders to {output_dir}{' (fp32 and int8)' if int8 else ''}")
+
+# Both exported encoders of onnx_dir in ONNX Runtime sessions; outputs come back as torch tensors,
+# so the code written for the PyTorch models runs unchanged
+class OnnxClipEncoders:
+    def __init__(self, onnx_dir, int8=False, threads=None):
+        with open(os.path.join(onnx_dir, META_FILE), "r") as f:
+            self.meta = json.load(f)
+        paths = [os.path.join(onnx_dir, name) for name in (IMAGE_ENCODER, TEXT_ENCODER)]
+        if int8:
+            if not self.meta.get("int8"):
+                raise FileNotFoundError(f"No int8 encoders in {onnx_dir}; export them with onnx_clip.py --int8")
+            paths = [int8_path(path) for path in paths]
+        self.image_session, self.text_session = [create_session(path, threads) for path in paths]
+        self.text_input_names = [i.name for i in self.text_session.get_inputs()]
+        # Cache keys and saved indexes built with these encoders are kept apart from the PyTorch ones
+        self.fingerprint = "onnx:" + ":".join(file_digest(path) for path in paths)
+
+    def run_image(self, pixel_values):
+        pixel_values = pixel_values.cpu().numpy().astype(np.float32)
+        return torch.from_numpy(self.image_session.run(None, {"pixel_values": pixel_values})[0])
+
+    def run_text(self, **inputs):
+        feed = {name: inputs[name].cpu().numpy().astype(np.int64) for name in self.text_input_names}
+        return torch.from_numpy(self.text_session.run(None, feed)[0])
+
+# open_clip interface (clip_matching.py, caption_index.py)
+class OnnxOpenClip(OnnxClipEncoders):
+    def encode_image(self, image):
+        return self.run_image(image)
+
+    def encode_text(self, text):
+        return self.run_text(input_ids=text)
+
+# transformers CLIPModel interface (clip_inference.py, description_store.py)
+class OnnxHfClip(OnnxClipEncoders):
+    def __init__(self, onnx_dir, model_path, int8=False, threads=None):
+        super().__init__(onnx_dir, int8, threads)
+        from transformers import CLIPConfig
+        self.config = CLIPConfig.from_pretrained(model_path)
+
+    def get_image_features(self, pixel_values):
+        return self.run_image(pixel_values)
+
+    def get_text_features(self, input_ids, attention_mask=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        return self.run_text(input_ids=input_ids, attention_mask=attention_mask)
+
+# Drop-in for caption_index.load_clip: the ONNX encoders with the preprocessing and tokenizer of the exported model
+def load_clip_onnx(onnx_dir, int8=False):
+    import open_clip
+    model = OnnxOpenClip(onnx_dir, int8)
+    cfg = model.meta["preprocess"]
+    preprocess = open_clip.image_transform(tuple(cfg["size"]), is_train=False, mean=tuple(cfg["mean"]), std=tuple(cfg["std"]),
+                                           resize_mode=cfg.get("resize_mode"), interpolation=cfg.get("interpolation"),
+                                           fill_color=cfg.get("fill_color", 0))
+    tokenizer = open_clip.get_tokenizer(model.meta["model"])
+    return model, preprocess, tokenizer
+
+# Texts for the parity check, from RICO captions ([{"caption": ...}]) or UI descriptions ({name: text})
+def load_texts(path, count):
+    with open(path, "r") as f:
+        data = json.load(f)
+    texts = [entry["caption"] for entry in data] if isinstance(data, list) else list(data.values())
+    return texts[:count]
+
+def load_images(image_dir, count):
+    paths = sorted(p for p in Path(image_dir).rglob("*") if p.suffix.lower() in (".png", ".jpg", ".jpeg"))
+    images = []
+    for path in paths:
+        try:
+            images.append(Image.open(path).convert("RGB"))
+        except OSError:
+            continue
+        if len(images) == count:
+            break
+    return images
+
+def normalized(embeddings):
+    embeddings = embeddings.float()
+    return (embeddings / embeddings.norm(dim=-1, keepdim=True)).numpy()
+
+# Embedding drift of the fp32 (and int8) ONNX encoders against PyTorch, plus how often the best matching
+# text of each screenshot stays the same
+def parity_check(kind, onnx_dir, model_path=None, images=None, texts=None):
+    model, image_inputs, text_inputs = load_torch_model(kind, model_path)
+    with open(os.path.join(onnx_dir, META_FILE), "r") as f:
+        variants = [False, True] if json.load(f).get("int8") else [False]
+
+    reference = {}
+    with torch.no_grad():
+        if images:
+            inputs = image_inputs(images)
+            reference["image"] = normalized(model.encode_image(inputs["pixel_values"]) if kind == "open_clip"
+                                            else model.get_image_features(**inputs))
+        if texts:
+            inputs = text_inputs(texts)
+            reference["text"] = normalized(model.encode_text(inputs["input_ids"]) if kind == "open_clip"
+                                           else model.get_text_features(**inputs))
+
+    report = {}
+    for int8 in variants:
+        encoders = OnnxOpenClip(onnx_dir, int8) if kind == "open_clip" else OnnxHfClip(onnx_dir, model_path, int8)
+        result = {}
+        if images:
+            candidate = normalized(encoders.run_image(image_inputs(images)["pixel_values"]))
+            result["image_embeddings"] = embedding_drift(reference["image"], candidate)
+        if texts:
+            text_candidate = normalized(encoders.run_text(**text_inputs(texts)))
+            result["text_embeddings"] = embedding_drift(reference["text"], text_candidate)
+        if images and texts:
+            same = np.argmax(reference["image"] @ reference["text"].T, axis=1) == np.argmax(candidate @ text_candidate.T, axis=1)
+            result["top1_agreement"] = round(float(same.mean()), 4)
+        report["int8" if int8 else "fp32"] = result
+    return report
+
+def main():
+    args = parse_args()
+    if not args.skip_export:
+        export_encoders(args.model, args.output_dir, args.model_path, args.opset, args.int8)
+
+    if args.parity_images or args.parity_texts:
+        images = load_images(args.parity_images, args.parity_count) if args.parity_images else None
+        texts = load_texts(args.parity_texts, args.parity_count) if args.parity_texts else None
+        report = parity_check(args.model, args.output_dir, args.model_path, images, texts)
+        for variant, result in report.items():
+            for name, drift in result.items():
+                print(f" {variant} {name}: {drift}")
+        report_json = args.report_json or os.path.join(args.output_dir, "parity.json")
+        with open(report_json, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f" Parity report saved to: {report_json}")
+
+if __name__ == "__main__":
+    main()
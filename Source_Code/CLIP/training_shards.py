@@ -0,0 +1,158 @@
+import os
+import json
+import argparse
+import multiprocessing
+from pathlib import Path
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from transformers import CLIPProcessor
+
+# Processor whose resizing, cropping and tokenizer the shards are made with
+DEFAULT_PROCESSOR = "openai/clip-vit-base-patch32"
+
+# Manifest of a shard directory, written after all shards
+MANIFEST_FILE = "manifest.json"
+
+# CLIPProcessor of this process, created once per preprocessing worker
+processor = None
+
+# Argument parser for CLI
+def parse_args():
+    parser = argparse.ArgumentParser(description="Preprocess the RICO training data once into memory-mapped shards for fine_tune_clip.py.")
+    parser.add_argument("--train_data", type=str, required=True, help="Path to RICO dataset (images and captions).")
+    parser.add_argument("--shard_dir", type=str, required=True, help="Directory to write the shards to.")
+    parser.add_argument("--shard_size", type=int, default=1024, help="Samples per shard.")
+    parser.add_argument("--processor", type=str, default=DEFAULT_PROCESSOR, help="CLIP processor used for resizing, cropping and tokenizing.")
+    parser.add_argument("--workers", type=int, default=0, help="Processes that decode and resize the images (0 = run in this process).")
+    return parser.parse_args()
+
+def init_worker(processor_name):
+    global processor
+    processor = CLIPProcessor.from_pretrained(processor_name)
+
+# Resized and center-cropped pixels (uint8, channels first) and padded token IDs of one sample.
+# Rescaling and normalization are left to training time, so the shards stay uint8.
+def preprocess_sample(task):
+    image_path, caption = task
+    try:
+        image = Image.open(image_path).convert("RGB")
+    except Exception as e:
+        return None, f"{image_path}: {e}"
+    pixels = processor.image_processor(images=image, do_rescale=False, do_normalize=False, return_tensors="np")["pixel_values"][0]
+    tokens = processor.tokenizer([caption], padding="max_length", truncation=True, return_tensors="np")
+    return (np.clip(np.rint(pixels), 0, 255).astype(np.uint8), tokens["input_ids"][0].astype(np.int32),
+            int(tokens["attention_mask"][0].sum())), None
+
+# Write one shard: fixed-shape arrays, row i of each file belongs to sample i
+def write_shard(shard_dir, shard_index, pixels, input_ids, lengths):
+    name = f"shard_{shard_index:05d}"
+    np.save(os.path.join(shard_dir, f"{name}.pixels.npy"), pixels)
+    np.save(os.path.join(shard_dir, f"{name}.input_ids.npy"), input_ids)
+    np.save(os.path.join(shard_dir, f"{name}.lengths.npy"), lengths)
+    return {"name": name, "count": len(lengths)}
+
+# Decode, resize and tokenize the whole training set once; fine-tuning then reads the shards without decoding
+def build_shards(train_data, shard_dir, shard_size=1024, processor_name=DEFAULT_PROCESSOR, workers=0):
+    with open(train_data, "r") as f:
+        data = json.load(f)
+    image_dir = Path(train_data).parent / "images"  # Assumes images are in 'images' subdirectory
+    tasks = [(str(image_dir / item["image_name"]), item["caption"]) for item in data]
+    os.makedirs(shard_dir, exist_ok=True)
+
+    init_worker(processor_name)
+    crop = processor.image_processor.crop_size
+    max_length = processor.tokenizer.model_max_length
+    pixels = np.empty((shard_size, 3, crop["height"], crop["width"]), dtype=np.uint8)
+    input_ids = np.empty((shard_size, max_length), dtype=np.int32)
+    lengths = np.empty(shard_size, dtype=np.int16)
+
+    if workers > 0:
+        pool = multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(processor_name,))
+        samples = pool.imap(preprocess_sample, tasks, chunksize=16)
+    else:
+        pool = None
+        samples = map(preprocess_sample, tasks)
+
+    shards, filled, skipped = [], 0, 0
+    for sample, error in samples:
+        if sample is None:
+            print(f"⚠️ Skipping {error}")
+            skipped += 1
+            continue
+        pixels[filled], input_ids[filled], lengths[filled] = sample
+        filled += 1
+        if filled == shard_size:
+            shards.append(write_shard(shard_dir, len(shards), pixels, input_ids, lengths))
+            print(f"📦 Wrote {shards[-1]['name']} ({sum(s['count'] for s in shards)}/{len(tasks)} samples)")
+            filled = 0
+    if filled:
+        shards.append(write_shard(shard_dir, len(shards), pixels[:filled], input_ids[:filled], lengths[:filled]))
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    # Written last: a directory without a manifest is an unfinished build
+    manifest = {
+        "train_data": os.path.abspath(train_data),
+        "processor": processor_name,
+        "image_mean": list(processor.image_processor.image_mean),
+        "image_std": list(processor.image_processor.image_std),
+        "pad_token_id": processor.tokenizer.pad_token_id,
+        "max_length": max_length,
+        "count": sum(shard["count"] for shard in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(shard_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=4)
+    print(f"✅ {manifest['count']} samples in {len(shards)} shards saved to {shard_dir} ({skipped} skipped)")
+    return manifest
+
+# Training samples read straight from the memory-mapped shards: no image decoding, no tokenizing.
+# Items are views into the page cache (copy-on-write maps, so torch gets writable arrays without a copy);
+# normalization to float happens per batch in collate.
+class ShardDataset(Dataset):
+    def __init__(self, shard_dir):
+        with open(os.path.join(shard_dir, MANIFEST_FILE), "r") as f:
+            self.manifest = json.load(f)
+        self.shard_dir = shard_dir
+        self.offsets = np.cumsum([0] + [shard["count"] for shard in self.manifest["shards"]])
+        self.shards = [None] * len(self.manifest["shards"])
+        self.image_mean = torch.tensor(self.manifest["image_mean"]).view(1, 3, 1, 1)
+        self.image_std = torch.tensor(self.manifest["image_std"]).view(1, 3, 1, 1)
+        self.pad_token_id = self.manifest["pad_token_id"]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    # Shards are mapped on first use, so every DataLoader worker maps them itself
+    def shard(self, index):
+        if self.shards[index] is None:
+            name = self.manifest["shards"][index]["name"]
+            self.shards[index] = tuple(np.load(os.path.join(self.shard_dir, f"{name}.{part}.npy"), mmap_mode="c")
+                                       for part in ("pixels", "input_ids", "lengths"))
+        return self.shards[index]
+
+    def __getitem__(self, idx):
+        shard_index = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        pixels, input_ids, lengths = self.shard(shard_index)
+        row = idx - self.offsets[shard_index]
+        return {"pixels": torch.from_numpy(pixels[row]), "input_ids": torch.from_numpy(input_ids[row]), "length": int(lengths[row])}
+
+    # Batch of shard items as model inputs: pixels normalized like CLIPProcessor does, token IDs cut to the
+    # longest caption of the batch with a matching attention mask
+    def collate(self, batch):
+        pixel_values = torch.stack([item["pixels"] for item in batch]).float().div_(255)
+        pixel_values = (pixel_values - self.image_mean) / self.image_std
+        max_length = max(item["length"] for item in batch)
+        input_ids = torch.stack([item["input_ids"][:max_length] for item in batch]).long()
+        attention_mask = (torch.arange(max_length)[None, :] < torch.tensor([item["length"] for item in batch])[:, None]).long()
+        return {"pixel_values": pixel_values, "input_ids": input_ids, "attention_mask": attention_mask}
+
+def main():
+    args = parse_args()
+    build_shards(args.train_data, args.shard_dir, args.shard_size, args.processor, args.workers)
+
+if __name__ == "__main__":
+    main()
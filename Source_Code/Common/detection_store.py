@@ -0,0 +1,346 @@
+import os
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+
+from jsonl_records import JsonlWriter, iter_records
+from image_header import read_image_size
+
+# One row per box: YOLO detections, or OCR texts with their text in the string table (text_id -1: no text;
+# class_id -1: no widget class). OCR quads are kept as the box of their first and third corner, which is
+# what proximity matching and the CLIP crops use.
+BOX_DTYPE = np.dtype([("x_min", "<f4"), ("y_min", "<f4"), ("x_max", "<f4"), ("y_max", "<f4"),
+                      ("confidence", "<f4"), ("class_id", "<i2"), ("text_id", "<i4")])
+
+# One row per image: its name in the string table, its size, and its rows in the box table
+IMAGE_DTYPE = np.dtype([("name_id", "<i4"), ("width", "<i4"), ("height", "<i4"), ("start", "<i8"), ("count", "<i4")])
+
+# Files of a store; the .bin files are raw arrays, meta.json holds the row counts that are complete
+IMAGES_FILE = "images.bin"
+BOXES_FILE = "boxes.bin"
+STRINGS_FILE = "strings.bin"
+OFFSETS_FILE = "string_offsets.bin"
+META_FILE = "meta.json"
+STORE_VERSION = 1
+
+def read_meta(store_dir):
+    with open(os.path.join(store_dir, META_FILE), "r") as f:
+        meta = json.load(f)
+    if meta.get("version") != STORE_VERSION:
+        raise ValueError(f"Unsupported detection store version in {store_dir}: {meta.get('version')}")
+    return meta
+
+# Memory-map the first count rows of a raw array file
+def map_array(path, dtype, count):
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+# Append-only writer of a columnar detection store. Rows are appended to the raw array files as images
+# are added, and meta.json, which holds the complete row counts, is rewritten every flush_every images.
+# With append, rows past the counts of the last flush (from an interrupted run) are cut off first.
+class DetectionStoreWriter:
+    def __init__(self, store_dir, append=False, flush_every=256):
+        self.store_dir = str(store_dir)
+        self.flush_every = flush_every
+        self.pending = 0
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        self.counts = {"images": 0, "boxes": 0, "strings": 0, "string_bytes": 0}
+        self.strings = {}
+        if append and os.path.exists(os.path.join(self.store_dir, META_FILE)):
+            self.counts = read_meta(self.store_dir)["counts"]
+            store = DetectionStore(self.store_dir)
+            self.strings = {store.string(i): i for i in range(self.counts["strings"])}
+            del store
+        else:
+            append = False
+
+        sizes = {IMAGES_FILE: self.counts["images"] * IMAGE_DTYPE.itemsize,
+                 BOXES_FILE: self.counts["boxes"] * BOX_DTYPE.itemsize,
+                 STRINGS_FILE: self.counts["string_bytes"],
+                 OFFSETS_FILE: self.counts["strings"] * 8}
+        self.files = {}
+        for name, size in sizes.items():
+            f = open(os.path.join(self.store_dir, name), "r+b" if append else "wb")
+            f.truncate(size)
+            f.seek(size)
+            self.files[name] = f
+        if not append:
+            self.flush()
+
+    # Interned id of a string; each distinct text is stored once
+    def intern(self, text):
+        string_id = self.strings.get(text)
+        if string_id is None:
+            string_id = self.strings[text] = self.counts["strings"]
+            data = text.encode("utf-8")
+            self.files[OFFSETS_FILE].write(np.int64(self.counts["string_bytes"]).tobytes())
+            self.files[STRINGS_FILE].write(data)
+            self.counts["strings"] += 1
+            self.counts["string_bytes"] += len(data)
+        return string_id
+
+    # Add one image and its boxes: dicts with "bbox" [x_min, y_min, x_max, y_max] and optionally
+    # "class_id", "confidence" and "text"
+    def add(self, image_name, width, height, entries):
+        rows = np.array([(*entry["bbox"], entry.get("confidence", 1.0), entry.get("class_id", -1),
+                          self.intern(entry["text"]) if entry.get("text") is not None else -1)
+                         for entry in entries], dtype=BOX_DTYPE)
+        image = np.array([(self.intern(image_name), width or 0, height or 0, self.counts["boxes"], len(rows))], dtype=IMAGE_DTYPE)
+
+        self.files[BOXES_FILE].write(rows.tobytes())
+        self.files[IMAGES_FILE].write(image.tobytes())
+        self.counts["boxes"] += len(rows)
+        self.counts["images"] += 1
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    # Make the rows written so far durable, then record their counts
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        meta_path = os.path.join(self.store_dir, META_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"version": STORE_VERSION, "counts": self.counts}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        self.pending = 0
+
+    def close(self):
+        if self.files:
+            self.flush()
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Memory-mapped reader of a detection store. The image table gives each image's rows in the box table,
+# so the boxes of an image are one slice; names are looked up through a dict built on first use.
+class DetectionStore:
+    def __init__(self, store_dir):
+        self.store_dir = str(store_dir)
+        counts = read_meta(self.store_dir)["counts"]
+        self.images = map_array(os.path.join(self.store_dir, IMAGES_FILE), IMAGE_DTYPE, counts["images"])
+        self.boxes = map_array(os.path.join(self.store_dir, BOXES_FILE), BOX_DTYPE, counts["boxes"])
+        self.string_data = map_array(os.path.join(self.store_dir, STRINGS_FILE), np.uint8, counts["string_bytes"])
+        self.string_offsets = np.append(map_array(os.path.join(self.store_dir, OFFSETS_FILE), np.int64, counts["strings"]),
+                                        np.int64(counts["string_bytes"]))
+        self.by_name = None
+
+    def __len__(self):
+        return len(self.images)
+
+    def string(self, string_id):
+        return bytes(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id + 1]]).decode("utf-8")
+
+    def name(self, i):
+        return self.string(self.images[i]["name_id"])
+
+    def names(self):
+        return [self.name(i) for i in range(len(self))]
+
+    # Position of an image by name, or None
+    def index(self, image_name):
+        if self.by_name is None:
+            self.by_name = {name: i for i, name in enumerate(self.names())}
+        return self.by_name.get(image_name)
+
+    def __contains__(self, image_name):
+        return self.index(image_name) is not None
+
+    def size(self, i):
+        return int(self.images[i]["width"]), int(self.images[i]["height"])
+
+    # Box rows of image i, as a structured array slice
+    def image_boxes(self, i):
+        image = self.images[i]
+        return self.boxes[image["start"]:image["start"] + image["count"]]
+
+    # [x_min, y_min, x_max, y_max] array of image i
+    def xyxy(self, i):
+        rows = self.image_boxes(i)
+        return np.stack([rows["x_min"], rows["y_min"], rows["x_max"], rows["y_max"]], axis=1)
+
+    # Image i's boxes in the detections.jsonl form of infer.py
+    def detections(self, i):
+        return [{"class_id": int(row["class_id"]), "confidence": round(float(row["confidence"]), 4),
+                 "bbox_xyxy": [round(float(row[key]), 2) for key in ("x_min", "y_min", "x_max", "y_max")]}
+                for row in self.image_boxes(i)]
+
+    # Image i's texts in the JSON form of ocr_script.py, with the boxes as axis-aligned quads. Values are rounded
+    # as in detections(), so the float32 columns read back as the pixel coordinates that were stored
+    def texts(self, i):
+        texts = []
+        for row in self.image_boxes(i):
+            x_min, y_min, x_max, y_max = (round(float(row[key]), 2) for key in ("x_min", "y_min", "x_max", "y_max"))
+            entry = {"text": self.string(row["text_id"]) if row["text_id"] >= 0 else "",
+                     "bbox": [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]],
+                     "confidence": round(float(row["confidence"]), 4)}
+            if row["class_id"] >= 0:
+                entry["class_id"] = int(row["class_id"])
+            texts.append(entry)
+        return texts
+
+# Converters from the legacy formats
+
+# Image files looked up in an image directory
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# Name of an image in a store: its path relative to the image directory (just the file name for screenshots
+# directly in it), as infer.py names its entries; the file name when there is no image directory
+def image_key(image_path, image_dir=None):
+    if image_dir:
+        try:
+            return Path(image_path).relative_to(image_dir).as_posix()
+        except ValueError:
+            pass
+    return os.path.basename(image_path)
+
+# Store names of the screenshots under image_dir by file name without extension, the name of their label files
+def images_by_stem(image_dir):
+    names = {}
+    for root, dirs, files in os.walk(image_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                names.setdefault(os.path.splitext(name)[0], image_key(os.path.join(root, name), image_dir))
+    return names
+
+# Image size from its file header, or 0 x 0 when the image is not available
+def image_size_or_zero(image_dir, image_name):
+    if image_dir:
+        try:
+            return read_image_size(os.path.join(image_dir, image_name))
+        except (OSError, ValueError):
+            pass
+    return 0, 0
+
+# detections.json (one record per box) or detections.jsonl (one record per image) of infer.py
+def from_detections(detections_path, store_dir, image_dir=None):
+    images = {}
+    for record in iter_records(detections_path):
+        image_name = image_key(record["image"], image_dir)
+        if "detections" in record:
+            images[image_name] = (record["width"], record["height"], record["detections"])
+        else:
+            images.setdefault(image_name, (None, None, []))[2].append(record)
+    with DetectionStoreWriter(store_dir) as writer:
+        for image_name, (width, height, detections) in images.items():
+            if width is None:
+                width, height = image_size_or_zero(image_dir, image_name)
+            writer.add(image_name, width, height, [{"bbox": d["bbox_xyxy"], "class_id": d["class_id"],
+                                                    "confidence": d["confidence"]} for d in detections])
+    return len(images)
+
+# Directory of YOLO .txt labels. Each label is stored under the name of its screenshot in image_dir, whatever
+# its extension; without an image directory (or without the screenshot) as <label name><extension>.
+# Sizes come from the image headers (default_size when an image is missing).
+def from_yolo_labels(labels_dir, store_dir, image_dir=None, default_size=(1080, 1920), extension=".jpg"):
+    count = 0
+    image_names = images_by_stem(image_dir) if image_dir else {}
+    with DetectionStoreWriter(store_dir) as writer:
+        for label_name in sorted(os.listdir(labels_dir)):
+            if not label_name.endswith(".txt"):
+                continue
+            image_name = image_names.get(label_name[:-4], label_name[:-4] + extension)
+            width, height = image_size_or_zero(image_dir, image_name)
+            if not width:
+                width, height = default_size
+            entries = []
+            with open(os.path.join(labels_dir, label_name), "r") as f:
+                for line in f:
+                    data = line.split()
+                    if not data:
+                        continue
+                    x_center, y_center, box_w, box_h = map(float, data[1:5])
+                    entries.append({"class_id": int(data[0]), "bbox": [
+                        (x_center - box_w / 2) * width, (y_center - box_h / 2) * height,
+                        (x_center + box_w / 2) * width, (y_center + box_h / 2) * height]})
+            writer.add(image_name, width, height, entries)
+            count += 1
+    return count
+
+# OCR results of ocr_script.py ([{"image_name", "texts": [{"text", "bbox" quad, "confidence"}]}])
+def from_ocr_results(ocr_results, store_dir, image_dir=None):
+    with DetectionStoreWriter(store_dir) as writer:
+        for entry in ocr_results:
+            width, height = image_size_or_zero(image_dir, entry["image_name"])
+            writer.add(entry["image_name"], width, height, ocr_entries(entry["texts"]))
+    return len(ocr_results)
+
+# Store rows of OCR texts
+def ocr_entries(texts):
+    return [{"bbox": [*text["bbox"][0], *text["bbox"][2]], "text": text["text"], "confidence": text["confidence"],
+             "class_id": text.get("class_id", -1)} for text in texts]
+
+# Converters back to the legacy formats
+
+# With image_dir, records get the image path infer.py writes (image_dir joined with the store name), so
+# infer.py --output_format jsonl --resume recognizes the converted images as done
+def to_detections_jsonl(store_dir, output_path, image_dir=None):
+    store = DetectionStore(store_dir)
+    with JsonlWriter(output_path) as writer:
+        for i in range(len(store)):
+            width, height = store.size(i)
+            image = str(Path(image_dir) / store.name(i)) if image_dir else store.name(i)
+            writer.write({"image": image, "width": width, "height": height, "detections": store.detections(i)})
+    return len(store)
+
+def to_yolo_labels(store_dir, labels_dir):
+    store = DetectionStore(store_dir)
+    os.makedirs(labels_dir, exist_ok=True)
+    count = 0
+    for i in range(len(store)):
+        width, height = store.size(i)
+        if not width or not height:
+            print(f" Skipping {store.name(i)}, image size unknown")
+            continue
+        rows = store.image_boxes(i)
+        with open(os.path.join(labels_dir, os.path.splitext(store.name(i))[0] + ".txt"), "w") as f:
+            f.write("\n".join(
+                f"{row['class_id']} {(row['x_min'] + row['x_max']) / 2 / width:.6f} {(row['y_min'] + row['y_max']) / 2 / height:.6f} "
+                f"{(row['x_max'] - row['x_min']) / width:.6f} {(row['y_max'] - row['y_min']) / height:.6f}" for row in rows))
+        count += 1
+    return count
+
+def to_ocr_json(store_dir, output_path):
+    store = DetectionStore(store_dir)
+    results = [{"image_name": store.name(i), "texts": store.texts(i)} for i in range(len(store))]
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=4)
+    return len(results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert detections and OCR results between the legacy formats and the columnar detection store.")
+    parser.add_argument("command", choices=["from_detections", "from_yolo_labels", "from_ocr_json",
+                                            "to_detections_jsonl", "to_yolo_labels", "to_ocr_json"])
+    parser.add_argument("--input", type=str, required=True, help="Legacy file or label directory (from_*), or store directory (to_*).")
+    parser.add_argument("--output", type=str, required=True, help="Store directory (from_*), or legacy file or label directory (to_*).")
+    parser.add_argument("--image_dir", type=str, default=None, help="Screenshots: image sizes are read from their headers, label files are matched to their image files, and to_detections_jsonl writes the image paths infer.py writes.")
+    args = parser.parse_args()
+
+    if args.command == "from_detections":
+        count = from_detections(args.input, args.output, args.image_dir)
+    elif args.command == "from_yolo_labels":
+        count = from_yolo_labels(args.input, args.output, args.image_dir)
+    elif args.command == "from_ocr_json":
+        with open(args.input, "r") as f:
+            count = from_ocr_results(json.load(f), args.output, args.image_dir)
+    elif args.command == "to_detections_jsonl":
+        count = to_detections_jsonl(args.input, args.output, args.image_dir)
+    elif args.command == "to_yolo_labels":
+        count = to_yolo_labels(args.input, args.output)
+    else:
+        count = to_ocr_json(args.input, args.output)
+    print(f" Converted {count} images: {args.input} -> {args.output}")
+
+if __name__ == "__main__":
+    main()
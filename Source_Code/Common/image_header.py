@@ -0,0 +1,63 @@
+import struct
+
+# JPEG start-of-frame markers that carry the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Read (width, height) of a PNG, JPEG, GIF, BMP or WebP image from its file header, without decoding pixels
+def read_image_size(path):
+    with open(path, "rb") as f:
+        head = f.read(32)
+
+        # PNG: IHDR is always the first chunk
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return struct.unpack(">II", head[16:24])
+
+        # GIF: logical screen size
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", head[6:10])
+
+        # BMP: BITMAPINFOHEADER (height is negative for top-down bitmaps)
+        if head.startswith(b"BM"):
+            width, height = struct.unpack("<ii", head[18:26])
+            return width, abs(height)
+
+        # WebP: lossy (VP8), lossless (VP8L) or extended (VP8X)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            chunk = head[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", head[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                b = head[21:25]
+                width = 1 + (((b[1] & 0x3F) << 8) | b[0])
+                height = 1 + (((b[3] & 0x0F) << 10) | (b[2] << 2) | ((b[1] & 0xC0) >> 6))
+                return width, height
+            if chunk == b"VP8X":
+                width = 1 + int.from_bytes(head[24:27], "little")
+                height = 1 + int.from_bytes(head[27:30], "little")
+                return width, height
+
+        # JPEG: walk the segments until a start-of-frame marker
+        if head.startswith(b"\xff\xd8"):
+            f.seek(2)
+            while True:
+                byte = f.read(1)
+                while byte and byte != b"\xff":
+                    byte = f.read(1)
+                while byte == b"\xff":
+                    byte = f.read(1)
+                if not byte:
+                    break
+                marker = byte[0]
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    continue
+                length_bytes = f.read(2)
+                if len(length_bytes) < 2:
+                    break
+                length = struct.unpack(">H", length_bytes)[0]
+                if marker in JPEG_SOF_MARKERS:
+                    height, width = struct.unpack(">xHH", f.read(5))
+                    return width, height
+                f.seek(length - 2, 1)
+
+    raise ValueError(f"Unsupported or truncated image header: {path}")
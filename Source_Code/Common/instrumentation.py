@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import threading
+from collections import Counter
+
+# Timers and counters around the hot paths of the stage scripts.
+# Disabled by default: span() then returns one shared no-op context manager and count() returns at once,
+# so the instrumented code pays a function call and nothing else. State is per process; spans recorded in
+# pool workers are sent back with collect() and merged in the parent with merge().
+
+enabled = False
+quiet = False
+trace_path = None
+
+lock = threading.Lock()
+stats = {}  # span name -> [calls, total ns, max ns]
+counters = Counter()
+events = []  # Chrome trace events, only kept when a trace is exported
+started_ns = time.perf_counter_ns()
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    __slots__ = ("name", "track", "start")
+
+    def __init__(self, name, track=None):
+        self.name = name
+        self.track = track
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        elapsed = end - self.start
+        with lock:
+            entry = stats.get(self.name)
+            if entry is None:
+                stats[self.name] = [1, elapsed, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] = max(entry[2], elapsed)
+            if trace_path:
+                events.append({"name": self.name, "cat": self.name.split(".")[0], "ph": "X", "ts": self.start / 1000,
+                               "dur": elapsed / 1000, "pid": os.getpid(),
+                               "tid": self.track if self.track is not None else threading.get_ident()})
+        return False
+
+# Time the enclosed block under name, e.g. "yolo.forward". Overlapping spans of concurrent coroutines on one
+# thread should pass a track (any int, e.g. a request number) so they get their own row in the trace.
+def span(name, track=None):
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, track)
+
+# Add n to a counter, e.g. "ocr.texts"
+def count(name, n=1):
+    if not enabled:
+        return
+    with lock:
+        counters[name] += n
+
+# Per-item progress line, dropped in quiet mode
+def log(message):
+    if not quiet:
+        print(message)
+
+def configure(profile=False, quiet_mode=False, trace_json=None):
+    global enabled, quiet, trace_path, started_ns
+    enabled = bool(profile or trace_json)
+    quiet = quiet_mode
+    trace_path = trace_json
+    started_ns = time.perf_counter_ns()
+    reset()
+
+def reset():
+    with lock:
+        stats.clear()
+        counters.clear()
+        events.clear()
+
+# Command-line options shared by the stage scripts
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true", help="Time decode, model, postprocess and I/O steps and print a summary table at the end.")
+    parser.add_argument("--trace_json", type=str, default=None, help="Also save the timings as a Chrome trace (chrome://tracing or ui.perfetto.dev); implies --profile.")
+    parser.add_argument("--quiet", action="store_true", help="No per-image progress lines; only warnings and the final summary.")
+
+def configure_from_args(args):
+    configure(args.profile, args.quiet, args.trace_json)
+
+# Settings to pass to pool workers, so they record spans too
+def settings():
+    return {"profile": enabled, "quiet_mode": quiet, "trace_json": trace_path}
+
+# Everything recorded in this process since the last collect; None when disabled
+def collect():
+    if not enabled:
+        return None
+    with lock:
+        recorded = {"stats": {name: list(entry) for name, entry in stats.items()}, "counters": dict(counters),
+                    "events": list(events)}
+    reset()
+    return recorded
+
+# Add what a worker process recorded
+def merge(recorded):
+    if not recorded:
+        return
+    with lock:
+        for name, (calls, total, longest) in recorded["stats"].items():
+            entry = stats.setdefault(name, [0, 0, 0])
+            entry[0] += calls
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+        counters.update(recorded["counters"])
+        events.extend(recorded["events"])
+
+# Summary rows: per span, calls, total/mean/max time and share of the wall time since configure()
+def summary():
+    wall_s = (time.perf_counter_ns() - started_ns) / 1e9
+    with lock:
+        rows = [{"name": name, "calls": calls, "total_s": round(total / 1e9, 4), "mean_ms": round(total / calls / 1e6, 3),
+                 "max_ms": round(longest / 1e6, 3), "wall_pct": round(100 * total / 1e9 / wall_s, 1) if wall_s else 0.0}
+                for name, (calls, total, longest) in sorted(stats.items(), key=lambda item: -item[1][1])]
+        return {"wall_s": round(wall_s, 3), "spans": rows, "counters": dict(sorted(counters.items()))}
+
+def format_summary(result):
+    lines = [f"{'step':<24} {'calls':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9} {'% wall':>7}"]
+    for row in result["spans"]:
+        lines.append(f"{row['name']:<24} {row['calls']:>7} {row['total_s']:>9.3f} {row['mean_ms']:>9.2f} "
+                     f"{row['max_ms']:>9.2f} {row['wall_pct']:>7.1f}")
+    for name, value in result["counters"].items():
+        lines.append(f"{name:<24} {value:>7}")
+    lines.append(f"Wall time: {result['wall_s']:.2f}s (steps run in threads or workers can add up to more than 100%)")
+    return "\n".join(lines)
+
+# Print the summary table and save the trace; does nothing when disabled
+def report():
+    if not enabled:
+        return
+    result = summary()
+    print("\n" + format_summary(result))
+    if trace_path:
+        with lock:
+            trace = {"traceEvents": list(events), "displayTimeUnit": "ms", "otherData": result}
+        with open(trace_path, "w") as f:
+            json.dump(trace, f)
+        print(f"Trace saved to: {trace_path}")
@@ -0,0 +1,82 @@
+import os
+import json
+
+# Append-only JSON Lines writer: one record per line, flushed to disk every `flush_every` records
+class JsonlWriter:
+    def __init__(self, path, append=False, flush_every=50):
+        self.path = str(path)
+        self.flush_every = flush_every
+        self.pending = 0
+        if append:
+            drop_partial_line(self.path)
+        self.f = open(self.path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, record):
+        self.f.write(json.dumps(record) + "\n")
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.pending = 0
+
+    def close(self):
+        if not self.f.closed:
+            self.flush()
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Cut off a half-written last line left behind by a crash so appended records start on a fresh line
+def drop_partial_line(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Scan backwards for the last complete line
+        pos = size - 1
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            idx = chunk.rfind(b"\n")
+            if idx != -1:
+                f.truncate(pos + idx + 1)
+                return
+        f.truncate(0)
+
+# Lazily iterate records from a .jsonl file; plain .json files (a list of records) are loaded as before
+def iter_records(path):
+    if not str(path).endswith(".jsonl"):
+        with open(path, "r") as f:
+            yield from json.load(f)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A truncated trailing line from an interrupted run
+                continue
+
+# Collect the value of `key` from every complete record, used to skip finished work on --resume
+def completed_keys(path, key):
+    if not os.path.exists(path):
+        return set()
+    return {record[key] for record in iter_records(path) if key in record}
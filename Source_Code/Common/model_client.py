@@ -0,0 +1,107 @@
+import os
+import json
+import base64
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+import instrumentation
+
+# Address Model_server/model_server.py listens on by default
+DEFAULT_SERVER = "http://127.0.0.1:8765"
+
+# Every request carries the server's token in this header. The server writes a fresh random token to
+# token_path(port) at startup, readable by the current user only; DEEPUI_MODEL_SERVER_TOKEN overrides it.
+TOKEN_HEADER = "X-Model-Server-Token"
+TOKEN_ENV = "DEEPUI_MODEL_SERVER_TOKEN"
+
+def token_path(port):
+    return os.path.join(os.path.expanduser("~"), ".deepui", f"model_server_{port}.token")
+
+# Token of the server at a URL, or None if it cannot be found
+def read_token(server):
+    if os.environ.get(TOKEN_ENV):
+        return os.environ[TOKEN_ENV]
+    try:
+        with open(token_path(urllib.parse.urlsplit(server).port)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+# Embeddings travel as base64 float32 bytes rather than JSON number lists
+def encode_array(array):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+def decode_array(payload):
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+
+# Split a list into lists of at most size items
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# Client of the resident model server. The server runs on the same machine and reads the images itself,
+# so only absolute file paths are sent, never pixels.
+class ModelClient:
+    def __init__(self, server=DEFAULT_SERVER, timeout=600, token=None):
+        self.server = server.rstrip("/")
+        self.timeout = timeout
+        self.token = token or read_token(self.server)
+
+    def headers(self):
+        return {"Content-Type": "application/json", TOKEN_HEADER: self.token or ""}
+
+    def post(self, endpoint, payload):
+        request = urllib.request.Request(f"{self.server}/{endpoint}", data=json.dumps(payload).encode("utf-8"),
+                                         headers=self.headers())
+        try:
+            with instrumentation.span(f"server.{endpoint}"), urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"Model server error on /{endpoint}: {e.read().decode('utf-8', 'replace')}") from e
+        except urllib.error.URLError as e:
+            raise ConnectionError(f"Model server not reachable at {self.server} (start Model_server/model_server.py): {e.reason}") from e
+
+    def health(self):
+        request = urllib.request.Request(f"{self.server}/health", headers=self.headers())
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    # YOLO detections per image: {"width", "height", "labels", "detections"} or {"error"}.
+    # With annotated_paths, the server also saves the annotated images there.
+    def detect(self, image_paths, weights, annotated_paths=None):
+        images = [{"path": os.path.abspath(path), "annotated_path": os.path.abspath(annotated) if annotated else None}
+                  for path, annotated in zip(image_paths, annotated_paths or [None] * len(image_paths))]
+        return self.post("detect", {"weights": os.path.abspath(weights), "images": images})["results"]
+
+    # OCR texts per (image path, annotated image path, widgets) task, as ocr_script.recognize_task returns them.
+    # Tasks are sent in chunks, so results stream back while the server works on the next chunk.
+    def ocr(self, tasks, chunk_size=16):
+        for chunk in chunks(list(tasks), chunk_size):
+            images = [{"path": os.path.abspath(path), "annotated_path": os.path.abspath(annotated) if annotated else None,
+                       "widgets": widgets} for path, annotated, widgets in chunk]
+            yield from self.post("ocr", {"images": images})["results"]
+
+    # Best RICO caption for each (image path, crop box) with the server's CLIP model and caption index
+    def caption(self, crops, rico_captions, index_dir=None, index_spec=None, nprobe=16, ef_search=64):
+        return self.post("caption", {
+            "rico_captions": os.path.abspath(rico_captions),
+            "index_dir": os.path.abspath(index_dir) if index_dir else None,
+            "index_spec": index_spec,
+            "nprobe": nprobe,
+            "ef_search": ef_search,
+            "crops": [{"path": os.path.abspath(path), "box": list(box)} for path, box in crops],
+        })["captions"]
+
+    # Normalized image embeddings of a fine-tuned CLIP model; None (with the error) for unreadable images
+    def embed_images(self, model_path, image_paths):
+        results = self.post("embed", {"model": os.path.abspath(model_path),
+                                      "images": [os.path.abspath(path) for path in image_paths]})["results"]
+        return [(decode_array(r["embedding"]), None) if "embedding" in r else (None, r["error"]) for r in results]
+
+    # Normalized text embeddings of a fine-tuned CLIP model, as one float32 array, requested chunk_size texts at a time
+    def embed_texts(self, model_path, texts, chunk_size=256):
+        embeddings = [decode_array(self.post("embed", {"model": os.path.abspath(model_path), "texts": chunk})["embeddings"])
+                      for chunk in chunks(list(texts), chunk_size)]
+        return np.vstack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
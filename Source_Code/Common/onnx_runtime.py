@@ -0,0 +1,68 @@
+import os
+import numpy as np
+
+# ONNX Runtime helpers shared by YOLO/export_onnx.py and CLIP/onnx_clip.py.
+# onnxruntime is only imported when an ONNX model is actually exported or run.
+
+def require_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("The ONNX backend needs ONNX Runtime: pip install onnx onnxruntime") from e
+    return onnxruntime
+
+# Inference session on the CPU with all graph optimizations; threads=None lets ONNX Runtime use every core
+def create_session(model_path, threads=None):
+    ort = require_onnxruntime()
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(str(model_path), sess_options=options, providers=["CPUExecutionProvider"])
+
+# Operators quantized dynamically. Dynamic quantization of Conv emits ConvInteger nodes, which the CPU provider
+# runs slowly or not at all with int8 weights, so convolutions stay fp32 unless calibration data is given.
+DYNAMIC_OP_TYPES = ["MatMul", "Gemm"]
+
+# Operators quantized statically. The element-wise ops stay fp32: a detection head concatenates pixel box
+# coordinates with 0-1 class scores, and one int8 scale for both rounds every score to zero.
+STATIC_OP_TYPES = ["Conv", "MatMul", "Gemm"]
+
+# Calibration inputs for static quantization: a list of {input name: array} feeds, handed out one at a time
+class CalibrationFeeds:
+    def __init__(self, feeds):
+        self.feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self.feeds, None)
+
+# int8 copy of an exported model.
+# Without calibration (transformer encoders): dynamic quantization of the MatMul/Gemm weights, activations are
+# quantized on the fly per batch, so no calibration images are needed.
+# With calibration feeds (conv models such as YOLO): static QDQ quantization, per-channel int8 weights and uint8
+# activations with ranges measured on the feeds; the CPU provider fuses the QDQ pairs into QLinearConv.
+def quantize_int8(model_path, output_path, calibration=None):
+    require_onnxruntime()
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    if calibration is None:
+        quantize_dynamic(str(model_path), str(output_path), weight_type=QuantType.QInt8, op_types_to_quantize=DYNAMIC_OP_TYPES)
+    else:
+        quantize_static(str(model_path), str(output_path), CalibrationFeeds(calibration), quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True,
+                        op_types_to_quantize=STATIC_OP_TYPES)
+    return output_path
+
+# Path of the int8 copy of an exported model: image_encoder.onnx -> image_encoder.int8.onnx
+def int8_path(model_path):
+    root, ext = os.path.splitext(str(model_path))
+    return f"{root}.int8{ext}"
+
+# Drift of embeddings from the ONNX path against the PyTorch ones, row by row
+def embedding_drift(reference, candidate):
+    if len(reference) == 0:
+        return {"count": 0}
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    cosine = np.sum(reference * candidate, axis=1) / (np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1))
+    return {"count": len(reference), "min_cosine": round(float(cosine.min()), 6), "mean_cosine": round(float(cosine.mean()), 6),
+            "max_abs_diff": round(float(np.abs(reference - candidate).max()), 6)}
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Eviction frees space down to this share of max_bytes, so it runs once per many writes, not on every one
+LOW_WATER = 0.9
+
+# A hit only moves an entry's last access when it is older than this; the new times are written in batches
+# with the next write, so lookups do not take the SQLite write lock
+ACCESS_RESOLUTION_S = 60
+TOUCH_BATCH = 256
+
+# Entries deleted per query during eviction
+EVICT_BATCH = 256
+
+# SHA-256 of a file's bytes, read in chunks
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Fingerprint of the model used by a stage: the content hash of a weights file or of every file in a
+# model directory; anything else (e.g. a hub model name) is used as-is
+def weights_fingerprint(model):
+    model = str(model)
+    if os.path.isfile(model):
+        return file_digest(model)
+    if os.path.isdir(model):
+        h = hashlib.sha256()
+        for root, _, files in sorted(os.walk(model)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, model).encode())
+                h.update(file_digest(path).encode())
+        return h.hexdigest()
+    return model
+
+# On-disk, content-addressed cache of per-image stage results with size-bounded LRU eviction.
+# Entries are keyed on (image content hash, stage, model fingerprint, stage parameters), so a rerun
+# only recomputes frames whose bytes, model or settings changed. With max_age_s, entries older than
+# that are dropped as well.
+class ResultCache:
+    def __init__(self, cache_dir, max_bytes=1 << 30, max_age_s=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Stages may look up entries from decode worker threads
+        self.lock = threading.Lock()
+        self.touched = {}  # key -> last access not written yet
+        self.db = sqlite3.connect(os.path.join(cache_dir, "results.sqlite"), timeout=60, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                        "key TEXT PRIMARY KEY, stage TEXT, value BLOB, size INTEGER, last_access REAL, created REAL)")
+        # Caches written before entries had a creation time
+        if "created" not in [row[1] for row in self.db.execute("PRAGMA table_info(entries)")]:
+            self.db.execute("ALTER TABLE entries ADD COLUMN created REAL")
+            self.db.execute("UPDATE entries SET created = last_access")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if max_age_s is not None:
+            self.evict()
+
+    @staticmethod
+    def make_key(image_hash, stage, model_fingerprint, params=None):
+        payload = json.dumps([image_hash, stage, model_fingerprint, params or {}], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value, created, last_access FROM entries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and self.max_age_s is not None and row[1] < now - self.max_age_s:
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.db.commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if now - row[2] > ACCESS_RESOLUTION_S:
+                self.touched[key] = now
+                if len(self.touched) >= TOUCH_BATCH:
+                    self.write_touched()
+                    self.db.commit()
+        return json.loads(row[0])
+
+    # Write the pending last access times (called with the lock held; committed by the caller)
+    def write_touched(self):
+        if self.touched:
+            self.db.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                [(last_access, key) for key, last_access in self.touched.items()])
+            self.touched.clear()
+
+    def put(self, key, stage, value):
+        blob = json.dumps(value).encode()
+        with self.lock:
+            now = time.time()
+            self.write_touched()
+            replaced = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO entries (key, stage, value, size, last_access, created) VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, stage, blob, len(blob), now, now))
+            self.db.commit()
+            self.total_bytes += len(blob) - (replaced[0] if replaced else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    # Drop expired entries, then least recently used entries until the cache is down to LOW_WATER of max_bytes
+    # (called with the lock held). Victims are fetched EVICT_BATCH at a time from the last_access index.
+    def evict(self):
+        self.write_touched()
+        if self.max_age_s is not None:
+            self.evictions += self.db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.max_age_s,)).rowcount
+        # Recount, since other processes sharing the cache change the total; eviction runs rarely thanks to the low-water mark
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        target = self.max_bytes * LOW_WATER
+        while total > target:
+            victims = []
+            for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT ?", (EVICT_BATCH,)):
+                if total <= target:
+                    break
+                victims.append((key,))
+                total -= size
+            if not victims:
+                break
+            self.db.executemany("DELETE FROM entries WHERE key = ?", victims)
+            self.evictions += len(victims)
+        self.db.commit()
+        self.total_bytes = total
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": size
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"Cache: {s['hits']} hits, {s['misses']} misses ({s['hit_rate']:.1%} hit rate), "
+                f"{s['evictions']} evicted, {s['entries']} entries / {s['size_bytes'] / 1e6:.1f} MB")
+
+    def close(self):
+        with self.lock:
+            self.write_touched()
+            self.db.commit()
+        self.db.close()
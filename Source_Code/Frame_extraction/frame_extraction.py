@@ -0,0 +1,119 @@
+import os
+import json
+import argparse
+from pathlib import Path
+import cv2
+import numpy as np
+
+# Supported video extensions
+VIDEO_EXTENSIONS = ['.webm', '.mp4', '.mkv', '.mov', '.avi', '.3gp']
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract distinct UI states from bug reproduction videos")
+    parser.add_argument('--video', type=str, required=True, help="Video file, or directory containing video files")
+    parser.add_argument('--output_dir', type=str, required=True, help="Directory to save extracted frames and the manifest")
+    parser.add_argument('--hash_threshold', type=int, default=8, help="Hamming distance (out of 64 bits) between perceptual hashes from which a frame counts as a new UI state")
+    parser.add_argument('--pixel_threshold', type=float, default=0.0005, help="Fraction of changed pixels from which a frame counts as a new UI state (catches small changes such as a toggle; negative to disable)")
+    parser.add_argument('--sample_fps', type=float, default=5.0, help="How many frames per second of video are compared (0 = every frame)")
+    parser.add_argument('--ignore_top', type=float, default=0.0, help="Fraction of the frame height (status bar) ignored when comparing frames, e.g. 0.04")
+    return parser.parse_args()
+
+# Grayscale thumbnail of the part of the frame that is compared
+def comparison_view(frame, ignore_top, size=(180, 320)):
+    top = int(frame.shape[0] * ignore_top)
+    gray = cv2.cvtColor(frame[top:], cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+# Fraction of thumbnail pixels that changed noticeably (small differences are compression noise)
+def changed_pixel_fraction(view1, view2, noise_level=32):
+    return float(np.mean(cv2.absdiff(view1, view2) > noise_level))
+
+# 64-bit difference hash (dHash): compares neighbouring pixels of a 9x8 thumbnail
+def dhash(view):
+    small = cv2.resize(view, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+def hamming_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count("1")
+
+# Stream a video and yield (frame_index, timestamp_ms, frame) for the sampled frames.
+# Frames between samples are only grabbed, not converted.
+def iter_sampled_frames(video_path, sample_fps):
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    step = max(1, int(round(fps / sample_fps))) if sample_fps > 0 else 1
+    frame_index = 0
+    try:
+        while cap.grab():
+            if frame_index % step == 0:
+                ok, frame = cap.retrieve()
+                if not ok:
+                    break
+                timestamp_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+                yield frame_index, timestamp_ms, frame
+            frame_index += 1
+    finally:
+        cap.release()
+
+# Keep only frames whose UI differs from the last kept frame, by perceptual hash or by pixel difference
+def extract_frames(video_path, output_dir, hash_threshold=8, pixel_threshold=0.0005, sample_fps=5.0, ignore_top=0.0):
+    video_path = Path(video_path)
+    frame_dir = Path(output_dir) / video_path.stem
+    frame_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = []
+    last_hash, last_view = None, None
+    sampled = 0
+    for frame_index, timestamp_ms, frame in iter_sampled_frames(video_path, sample_fps):
+        sampled += 1
+        view = comparison_view(frame, ignore_top)
+        frame_hash = dhash(view)
+
+        distance, pixel_change = None, None
+        if last_hash is not None:
+            distance = hamming_distance(frame_hash, last_hash)
+            changed = distance >= hash_threshold
+            if not changed and pixel_threshold >= 0:
+                pixel_change = changed_pixel_fraction(view, last_view)
+                changed = pixel_change > pixel_threshold
+            if not changed:
+                continue
+
+        frame_name = f"{video_path.stem}_{frame_index:06d}.png"
+        cv2.imwrite(str(frame_dir / frame_name), frame)
+        manifest.append({
+            "frame": frame_name,
+            "frame_index": frame_index,
+            "timestamp_ms": round(timestamp_ms, 1),
+            "dhash": f"{frame_hash:016x}",
+            "hash_distance": distance,
+            "changed_pixels": None if pixel_change is None else round(pixel_change, 5)
+        })
+        last_hash, last_view = frame_hash, view
+
+    with open(frame_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    print(f" {video_path.name}: kept {len(manifest)} of {sampled} sampled frames -> {frame_dir}")
+    return manifest
+
+def main():
+    args = parse_args()
+    if os.path.isdir(args.video):
+        videos = sorted(p for p in Path(args.video).iterdir() if p.suffix.lower() in VIDEO_EXTENSIONS)
+    else:
+        videos = [Path(args.video)]
+
+    for video_path in videos:
+        try:
+            extract_frames(video_path, args.output_dir, args.hash_threshold, args.pixel_threshold,
+                           args.sample_fps, args.ignore_top)
+        except IOError as e:
+            print(f" Skipping {video_path}: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import os
+import sys
+import hmac
+import json
+import time
+import queue
+import secrets
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+
+# The stage scripts live next to this folder
+SOURCE_DIR = Path(__file__).resolve().parents[1]
+for stage_dir in ("Common", "YOLO", "OCR", "CLIP"):
+    sys.path.append(str(SOURCE_DIR / stage_dir))
+
+from model_client import encode_array, token_path, TOKEN_HEADER, TOKEN_ENV
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Keep the YOLO, OCR and CLIP models loaded and serve detect/ocr/caption/embed requests on localhost")
+    parser.add_argument('--host', type=str, default="127.0.0.1", help="Address to listen on (keep it local: clients send file paths)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on")
+    parser.add_argument('--weights', type=str, default=None, help="YOLO weights to load at startup (others are loaded on first request)")
+    parser.add_argument('--ocr', action='store_true', help="Load PaddleOCR at startup")
+    parser.add_argument('--rico_captions', type=str, default=None, help="RICO captions to load the CLIP captioner for at startup")
+    parser.add_argument('--index_dir', type=str, default=None, help="Caption index directory of the captioner loaded at startup")
+    parser.add_argument('--clip_model_path', type=str, default=None, help="Fine-tuned CLIP model to load at startup")
+    parser.add_argument('--max_batch', type=int, default=32, help="Most items (images, crops or texts) run through a model at once")
+    parser.add_argument('--max_wait_ms', type=float, default=5, help="How long a batch waits for items of other requests before running")
+    parser.add_argument('--output_root', type=str, default=".", help="Directory annotated images may be written to (and below); requests for other paths are refused")
+    parser.add_argument('--token_file', type=str, default=None, help="Where to write the access token clients send (default: ~/.deepui/model_server_<port>.token)")
+    return parser.parse_args()
+
+# Items of all requests for one model, run in batches by a single thread that owns the model.
+# A batch starts with the oldest waiting item and takes whatever else arrives within max_wait_s,
+# so concurrent clients share forward passes.
+class BatchQueue:
+    def __init__(self, name, run_batch, max_batch=32, max_wait_s=0.005):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self.items = queue.Queue()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.processed = 0
+        self.busy_s = 0.0
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    # Results of the given items, in order, once their batches have run
+    def submit(self, items):
+        futures = []
+        for item in items:
+            future = Future()
+            self.items.put((item, future))
+            futures.append(future)
+        with self.lock:
+            self.requests += 1
+        return [future.result() for future in futures]
+
+    def serve(self):
+        while True:
+            batch = [self.items.get()]
+            deadline = time.monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.items.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            start = time.perf_counter()
+            try:
+                results = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                results = None
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+            if results is not None and len(results) != len(batch):
+                # A result per item or none: without this, the items left over would wait forever
+                error = RuntimeError(f"{self.name}: {len(results)} results for a batch of {len(batch)} items")
+                for _, future in batch:
+                    future.set_exception(error)
+            elif results is not None:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            elif len(batch) > 1:
+                # Rerun item by item, so a bad input only fails the request it came from
+                for item, future in batch:
+                    try:
+                        future.set_result(self.run_batch([item])[0])
+                    except Exception as e:
+                        future.set_exception(e)
+            self.busy_s += time.perf_counter() - start
+            self.batches += 1
+            self.processed += len(batch)
+
+    def stats(self):
+        return {"model": self.name, "requests": self.requests, "batches": self.batches, "items": self.processed,
+                "mean_batch": round(self.processed / self.batches, 2) if self.batches else 0.0,
+                "busy_s": round(self.busy_s, 2)}
+
+# YOLO detection of image paths; each item is {"path", "annotated_path"}
+def make_detector(weights):
+    import cv2
+    from ultralytics import YOLO
+    from infer import result_to_outputs
+    model = YOLO(weights)
+
+    def run_batch(items):
+        images = [cv2.imread(item["path"]) for item in items]
+        ready = [img for img in images if img is not None]
+        results = iter(model(ready) if ready else [])
+        outputs = []
+        for item, img in zip(items, images):
+            if img is None:
+                outputs.append({"error": f"unreadable image: {item['path']}"})
+                continue
+            r = next(results)
+            if item.get("annotated_path"):
+                r.save(filename=item["annotated_path"])
+            img_h, img_w = img.shape[:2]
+            labels, records = result_to_outputs(r, item["path"], img_h, img_w)
+            outputs.append({"width": img_w, "height": img_h, "labels": labels,
+                            "detections": [{k: v for k, v in rec.items() if k != "image"} for rec in records]})
+        return outputs
+    return run_batch
+
+# PaddleOCR on whole images or inside widget boxes; each item is {"path", "annotated_path", "widgets"}
+def make_recognizer():
+    from ocr_script import get_ocr, recognize_task
+    get_ocr()
+
+    # PaddleOCR takes one image per call, so a batch only saves the queueing between requests
+    def run_batch(items):
+        return [recognize_task((item["path"], item.get("annotated_path"), item.get("widgets"))) for item in items]
+    return run_batch
+
+# open_clip captioner with its caption index; each item is {"path", "box"}. The crops of every
+# request in the batch go through the encoder and the index search together.
+def make_captioner(rico_captions, index_dir=None, index_spec=None, nprobe=16, ef_search=64):
+    import torch
+    from PIL import Image
+    from clip_matching import WidgetCaptioner
+    captioner = WidgetCaptioner(rico_captions, index_dir=index_dir, index_spec=index_spec, nprobe=nprobe, ef_search=ef_search)
+
+    def run_batch(items):
+        images = {}
+        tensors = []
+        for item in items:
+            if item["path"] not in images:
+                images[item["path"]] = Image.open(item["path"]).convert("RGB")
+            tensors.append(captioner.preprocess(images[item["path"]].crop(tuple(item["box"]))))
+        return captioner.caption_tensors(torch.stack(tensors))
+    return run_batch
+
+# Fine-tuned CLIP (transformers) embeddings; each item is ("image", path) or ("text", text)
+def make_embedder(model_path):
+    import torch
+    from PIL import Image
+    from transformers import CLIPModel, CLIPProcessor
+    from description_store import encode_descriptions
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = CLIPModel.from_pretrained(model_path).to(device)
+    model.eval()
+    processor = CLIPProcessor.from_pretrained(model_path)
+
+    def run_batch(items):
+        outputs = [None] * len(items)
+        images, image_slots = [], []
+        for slot, (kind, value) in enumerate(items):
+            if kind != "image":
+                continue
+            try:
+                images.append(Image.open(value).convert("RGB"))
+                image_slots.append(slot)
+            except Exception as e:
+                outputs[slot] = {"error": str(e)}
+        if images:
+            pixel_values = processor(images=images, return_tensors="pt")["pixel_values"].to(device)
+            with torch.no_grad():
+                image_embeddings = model.get_image_features(pixel_values=pixel_values)
+                image_embeddings /= image_embeddings.norm(dim=-1, keepdim=True)  # Normalize
+            for slot, embedding in zip(image_slots, image_embeddings.float().cpu().numpy()):
+                outputs[slot] = {"embedding": embedding}
+
+        text_slots = [slot for slot, (kind, _) in enumerate(items) if kind == "text"]
+        if text_slots:
+            text_embeddings = encode_descriptions([items[slot][1] for slot in text_slots], model, processor, device, len(text_slots))
+            for slot, embedding in zip(text_slots, text_embeddings):
+                outputs[slot] = embedding
+        return outputs
+    return run_batch
+
+# Loaded models by (kind, settings), each with its batch queue
+class ModelRegistry:
+    def __init__(self, max_batch=32, max_wait_s=0.005):
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.queues = {}
+
+    # Batch queue of a model, loading it on first use; concurrent first requests wait for a single load
+    def get(self, kind, settings, factory):
+        key = json.dumps([kind, settings], sort_keys=True)
+        with self.lock:
+            if key in self.queues:
+                return self.queues[key]
+            future = self.loading.get(key)
+            leader = future is None
+            if leader:
+                future = self.loading[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            print(f" Loading {kind} model: {settings}")
+            start = time.perf_counter()
+            batch_queue = BatchQueue(f"{kind}: {settings}", factory(**settings), self.max_batch, self.max_wait_s)
+            print(f" Loaded {kind} model in {time.perf_counter() - start:.1f}s")
+            with self.lock:
+                self.queues[key] = batch_queue
+            future.set_result(batch_queue)
+            return batch_queue
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.loading[key]
+
+    def detector(self, weights):
+        return self.get("detect", {"weights": weights}, make_detector)
+
+    def recognizer(self):
+        return self.get("ocr", {}, make_recognizer)
+
+    def captioner(self, rico_captions, index_dir=None, index_spec=None, nprobe=16, ef_search=64):
+        # Equivalent index specs share one captioner
+        from caption_index import canonical_index_spec
+        index_spec = canonical_index_spec(index_spec)
+        return self.get("caption", {"rico_captions": rico_captions, "index_dir": index_dir, "index_spec": index_spec,
+                                    "nprobe": nprobe, "ef_search": ef_search}, make_captioner)
+
+    def embedder(self, model_path):
+        return self.get("embed", {"model_path": model_path}, make_embedder)
+
+    def stats(self):
+        with self.lock:
+            return [batch_queue.stats() for batch_queue in self.queues.values()]
+
+# Request handlers by endpoint: request body -> response body
+def handle_detect(registry, body):
+    return {"results": registry.detector(body["weights"]).submit(body["images"])}
+
+def handle_ocr(registry, body):
+    return {"results": registry.recognizer().submit(body["images"])}
+
+def handle_caption(registry, body):
+    batch_queue = registry.captioner(body["rico_captions"], body.get("index_dir"), body.get("index_spec"),
+                                     body.get("nprobe", 16), body.get("ef_search", 64))
+    return {"captions": batch_queue.submit(body["crops"])}
+
+def handle_embed(registry, body):
+    batch_queue = registry.embedder(body["model"])
+    if "texts" in body:
+        embeddings = batch_queue.submit([("text", text) for text in body["texts"]])
+        return {"embeddings": encode_array(np.stack(embeddings)) if embeddings else {"shape": [0, 0], "data": ""}}
+    results = batch_queue.submit([("image", path) for path in body["images"]])
+    return {"results": [{"embedding": encode_array(r["embedding"])} if "embedding" in r else r for r in results]}
+
+ENDPOINTS = {"/detect": handle_detect, "/ocr": handle_ocr, "/caption": handle_caption, "/embed": handle_embed}
+
+# Annotated images may only be written inside the output root
+def check_output_paths(items, output_root):
+    for item in items:
+        path = item.get("annotated_path") if isinstance(item, dict) else None
+        if path and os.path.commonpath([os.path.realpath(path), output_root]) != output_root:
+            raise PermissionError(f"annotated_path {path} is outside the server's --output_root {output_root}")
+
+# Fresh random token, written to a file only the current user can read
+def write_token(path):
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+# Every request needs the token, and POST bodies must be declared as JSON. Browsers cannot send either in a
+# cross-site "simple" request, so web pages cannot reach the server, and other users cannot read the token.
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    registry = None
+    token = None
+    output_root = None
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def authorized(self):
+        if hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), self.token):
+            return True
+        self.send_json(401, {"error": f"missing or wrong {TOKEN_HEADER} header"})
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path != "/health":
+            self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+            return
+        self.send_json(200, {"status": "ok", "models": self.registry.stats()})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if self.headers.get_content_type() != "application/json":
+            self.send_json(415, {"error": "requests must be sent as Content-Type: application/json"})
+            return
+        handler = ENDPOINTS.get(self.path)
+        if handler is None:
+            self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            check_output_paths(body.get("images", []), self.output_root)
+            self.send_json(200, handler(self.registry, body))
+        except PermissionError as e:
+            self.send_json(403, {"error": str(e)})
+        except Exception as e:
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    # One line per request would drown the load messages
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    args = parse_args()
+    registry = ModelRegistry(args.max_batch, args.max_wait_ms / 1000)
+
+    # Optional preloading, so the first client does not pay for the model load either
+    if args.weights:
+        registry.detector(os.path.abspath(args.weights))
+    if args.ocr:
+        registry.recognizer()
+    if args.rico_captions:
+        registry.captioner(os.path.abspath(args.rico_captions),
+                           os.path.abspath(args.index_dir) if args.index_dir else None)
+    if args.clip_model_path:
+        registry.embedder(os.path.abspath(args.clip_model_path))
+
+    handler = type("Handler", (ModelRequestHandler,), {"registry": registry, "output_root": os.path.realpath(args.output_root)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    if os.environ.get(TOKEN_ENV):
+        handler.token = os.environ[TOKEN_ENV]
+    else:
+        token_file = args.token_file or token_path(server.server_address[1])
+        handler.token = write_token(token_file)
+        print(f" Access token written to: {token_file}")
+    print(f" Model server listening on http://{args.host}:{server.server_address[1]}")
+    print(f" Annotated images may be written below: {handler.output_root}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for stats in registry.stats():
+            print(f" {stats['model']}: {stats['requests']} requests, {stats['items']} items in {stats['batches']} batches")
+
+if __name__ == "__main__":
+    main()
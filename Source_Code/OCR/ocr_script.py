@@ -1,82 +1,333 @@
-import os
-import json
-import cv2
-from paddleocr import PaddleOCR
-import argparse
-
-# Initialize PaddleOCR with English language and angle classification
-ocr = PaddleOCR(use_angle_cls=True, lang="en")
-
-# Set up command-line arguments
-def parse_args():
-    parser = argparse.ArgumentParser(description="OCR Text Extraction from Images")
-    parser.add_argument('--input_dir', type=str, required=True, help="Directory containing images to process")
-    parser.add_argument('--output_image_dir', type=str, required=True, help="Directory to save annotated images")
-    parser.add_argument('--output_json', type=str, required=True, help="Path to save JSON output with OCR results")
-    return parser.parse_args()
-
-# Main OCR processing function
-def ocr_processing(input_dir, output_image_dir, output_json):
-    # Ensure output directory exists
-    os.makedirs(output_image_dir, exist_ok=True)
-
-    # Initialize list to store OCR results
-    ocr_results = []
-
-    # Process each image in the input directory
-    for image_name in os.listdir(input_dir):
-        if image_name.lower().endswith((".jpg", ".png", ".jpeg")):
-            image_path = os.path.join(input_dir, image_name)
-            image = cv2.imread(image_path)
-
-            # Run OCR on the image
-            results = ocr.ocr(image_path, cls=True)
-
-            if not results or not results[0]:  # Skip if no text detected
-                print(f"❌ No text detected in {image_name}, skipping.")
-                continue
-
-            extracted_data = {"image_name": image_name, "texts": []}
-
-            # Process and visualize results
-            for res in results[0]:  # Iterate over detected text regions
-                bbox, (text, confidence) = res
-                if confidence > 0.80:  # Apply confidence threshold
-                    print(f"✅ Detected text: {text} (Confidence: {confidence:.2f})")
-
-                    # Extract bounding box coordinates
-                    x_min, y_min = map(int, bbox[0])
-                    x_max, y_max = map(int, bbox[2])
-
-                    # Draw bounding boxes on the image
-                    cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
-                    cv2.putText(image, text, (x_min, y_min - 5), cv2.FONT_HERSHEY_SIMPLEX, 
-                                0.5, (0, 255, 0), 1, cv2.LINE_AA)
-
-                    # Save extracted text and bounding box
-                    extracted_data["texts"].append({
-                        "text": text,
-                        "bbox": bbox,
-                        "confidence": confidence
-                    })
-
-            # Save annotated image only if text was detected
-            if extracted_data["texts"]:
-                output_image_path = os.path.join(output_image_dir, image_name)
-                cv2.imwrite(output_image_path, image)
-                ocr_results.append(extracted_data)
-            else:
-                print(f"⚠️ No high-confidence text found in {image_name}, skipping.")
-
-    # Save results in JSON format
-    with open(output_json, "w") as f:
-        json.dump(ocr_results, f, indent=4)
-
-    print(f"\n🎯 OCR processing completed.")
-    print(f"📄 JSON results saved: {output_json}")
-    print(f"🖼 Annotated images saved in: {output_image_dir}")
-
-# Run the OCR process with the command-line arguments
-if __name__ == "__main__":
-    args = parse_args()
-    ocr_processing(args.input_dir, args.output_image_dir, args.output_json)
+import os
+import json
+import sys
+import cv2
+import numpy as np
+import argparse
+import multiprocessing
+from pathlib import Path
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from result_cache import ResultCache, file_digest
+from jsonl_records import iter_records
+from image_header import read_image_size
+from model_client import ModelClient
+from detection_store import DetectionStore, DetectionStoreWriter, ocr_entries
+import instrumentation
+
+# PaddleOCR instance of this process, created on first use (once per worker process with --workers)
+ocr = None
+
+# Minimum recognition confidence for a text to be kept
+CONFIDENCE_THRESHOLD = 0.80
+
+# Model fingerprint used in result cache keys
+OCR_FINGERPRINT = "PaddleOCR:lang=en:use_angle_cls=True"
+
+# YOLO classes (class_map in YOLO/processing.py) whose widgets carry readable text:
+# CheckedTextView, EditText, Text, Text Button, Spinner, Multi-tab, Toolbar, Bottom-Navigation, TextButton
+TEXT_CLASS_IDS = {1, 3, 5, 6, 12, 14, 15, 16, 18}
+
+# Pixels added around a widget before recognition, so glyphs touching the box edge are not cut
+CROP_PADDING = 4
+
+# Initialize PaddleOCR with English language and angle classification.
+# Imported here, so runs against the model server never load Paddle.
+def get_ocr(cpu_threads=None):
+    global ocr
+    if ocr is None:
+        from paddleocr import PaddleOCR
+        if cpu_threads:
+            ocr = PaddleOCR(use_angle_cls=True, lang="en", cpu_threads=cpu_threads)
+        else:
+            ocr = PaddleOCR(use_angle_cls=True, lang="en")
+    return ocr
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="OCR Text Extraction from Images")
+    parser.add_argument('--input_dir', type=str, required=True, help="Directory containing images to process")
+    parser.add_argument('--output_image_dir', type=str, default=None, help="Directory to save annotated images (omit to skip drawing them; Annotation_rendering/render_annotations.py draws them on demand)")
+    parser.add_argument('--output_json', type=str, default=None, help="Path to save JSON output with OCR results")
+    parser.add_argument('--output_store', type=str, default=None, help="Directory to save the OCR results as a columnar detection store (see Common/detection_store.py)")
+    parser.add_argument('--yolo_detections', type=str, default=None, help="detections.json/.jsonl from infer.py: recognize text only inside text-bearing widgets")
+    parser.add_argument('--yolo_labels_dir', type=str, default=None, help="YOLO label directory, used like --yolo_detections")
+    parser.add_argument('--yolo_store', type=str, default=None, help="detections_store/ from infer.py --output_format store, used like --yolo_detections")
+    parser.add_argument('--workers', type=int, default=0, help="Number of OCR processes, each loading its own PaddleOCR model (0 = run in this process)")
+    parser.add_argument('--cache_dir', type=str, default=None, help="Directory of the shared result cache; unchanged images are not re-recognized")
+    parser.add_argument('--cache_size_mb', type=int, default=1024, help="Maximum size of the result cache before least recently used entries are evicted")
+    parser.add_argument('--server', type=str, default=None, help="URL of a running Model_server/model_server.py (e.g. http://127.0.0.1:8765); PaddleOCR is not loaded here")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if not args.output_json and not args.output_store:
+        parser.error("one of --output_json or --output_store is required")
+    return args
+
+# Draw one text bounding box and its text on the image
+def draw_text_box(image, bbox, text):
+    # Extract bounding box coordinates
+    x_min, y_min = map(int, bbox[0])
+    x_max, y_max = map(int, bbox[2])
+
+    cv2.rectangle(image, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
+    cv2.putText(image, text, (x_min, y_min - 5), cv2.FONT_HERSHEY_SIMPLEX,
+                0.5, (0, 255, 0), 1, cv2.LINE_AA)
+
+# Draw all kept texts on the image and save it
+def save_annotated_image(image_path, texts, output_image_path):
+    with instrumentation.span("ocr.save_annotated"):
+        image = cv2.imread(image_path)
+        for entry in texts:
+            draw_text_box(image, entry["bbox"], entry["text"])
+        cv2.imwrite(output_image_path, image)
+
+# Run OCR on one image (a path or an already decoded BGR array) and keep the texts above the
+# confidence threshold. Returns None if no text was detected at all.
+def recognize_image(image_path, output_image_path=None):
+    # Given a path, PaddleOCR decodes the image itself, so the forward time includes decoding
+    with instrumentation.span("ocr.forward"):
+        results = get_ocr().ocr(image_path, cls=True)
+    if not results or not results[0]:
+        return None
+
+    texts = []
+    for res in results[0]:  # Iterate over detected text regions
+        bbox, (text, confidence) = res
+        if confidence > CONFIDENCE_THRESHOLD:  # Apply confidence threshold
+            # Save extracted text and bounding box
+            texts.append({
+                "text": text,
+                "bbox": [[float(x), float(y)] for x, y in bbox],
+                "confidence": float(confidence)
+            })
+
+    # Save annotated image only if text was detected
+    if texts and output_image_path:
+        save_annotated_image(image_path, texts, output_image_path)
+    return texts
+
+# Widget-restricted OCR: skip full-screen text detection and only recognize the text inside the
+# given widget boxes, all crops of an image in one batched recognition call.
+# Each text gets its widget's box (as a quad), so proximity matching pairs it with that widget.
+def recognize_widgets(image_path, widgets, output_image_path=None):
+    with instrumentation.span("ocr.decode"):
+        image = cv2.imread(image_path)
+    if image is None:
+        return None
+
+    with instrumentation.span("ocr.crop"):
+        crops, kept = crop_widgets(image, widgets)
+    if not crops:
+        return None
+
+    # PaddleOCR treats every element of a list as one page and recognizes the pages one by one, so the crops
+    # are passed as a single page: its text recognizer then batches them and returns one result per crop
+    with instrumentation.span("ocr.forward"):
+        results = get_ocr().ocr([crops], det=False, cls=True)
+    if not results or not results[0]:
+        return None
+
+    texts = []
+    for (widget, (x_min, y_min, x_max, y_max)), (text, confidence) in zip(kept, results[0]):
+        if text and confidence > CONFIDENCE_THRESHOLD:
+            texts.append({
+                "text": text,
+                "bbox": [[float(x_min), float(y_min)], [float(x_max), float(y_min)],
+                         [float(x_max), float(y_max)], [float(x_min), float(y_max)]],
+                "confidence": float(confidence),
+                "class_id": widget["class_id"]
+            })
+
+    if texts and output_image_path:
+        save_annotated_image(image_path, texts, output_image_path)
+    return texts
+
+# Padded crops of the widgets big enough to hold text, with the widget and its clipped box
+def crop_widgets(image, widgets):
+    img_h, img_w = image.shape[:2]
+    crops, kept = [], []
+    for widget in widgets:
+        x_min, y_min, x_max, y_max = [int(v) for v in widget["bbox"]]
+        x_min, y_min = max(0, x_min), max(0, y_min)
+        x_max, y_max = min(img_w, x_max), min(img_h, y_max)
+        if x_max - x_min < 4 or y_max - y_min < 4:
+            continue
+        crops.append(image[max(0, y_min - CROP_PADDING):min(img_h, y_max + CROP_PADDING),
+                           max(0, x_min - CROP_PADDING):min(img_w, x_max + CROP_PADDING)])
+        kept.append((widget, [x_min, y_min, x_max, y_max]))
+    return crops, kept
+
+# Text-bearing widget boxes per image name, in pixels, from infer.py detections, a detection store or a label directory
+def load_text_widgets(input_dir, yolo_detections=None, yolo_labels_dir=None, yolo_store=None):
+    widgets = {}
+    if yolo_store:
+        store = DetectionStore(yolo_store)
+        for i in range(len(store)):
+            rows = store.image_boxes(i)
+            keep = np.isin(rows["class_id"], list(TEXT_CLASS_IDS))
+            widgets[store.name(i)] = [{"class_id": int(class_id), "bbox": [round(float(v), 2) for v in box]}
+                                      for class_id, box in zip(rows["class_id"][keep], store.xyxy(i)[keep])]
+        return widgets
+    if yolo_detections:
+        for record in iter_records(yolo_detections):
+            image_name = os.path.basename(record["image"])
+            # detections.jsonl has one record per image, detections.json one record per box
+            detections = record["detections"] if "detections" in record else [record]
+            widgets.setdefault(image_name, [])
+            for det in detections:
+                if det["class_id"] in TEXT_CLASS_IDS:
+                    widgets[image_name].append({"class_id": det["class_id"], "bbox": det["bbox_xyxy"]})
+        return widgets
+
+    for image_name in os.listdir(input_dir):
+        label_path = os.path.join(yolo_labels_dir, os.path.splitext(image_name)[0] + ".txt")
+        if not os.path.exists(label_path):
+            continue
+        try:
+            img_w, img_h = read_image_size(os.path.join(input_dir, image_name))
+        except (OSError, ValueError) as e:
+            instrumentation.log(f"⚠️ Cannot read the size of {image_name}, its labels are skipped: {e}")
+            continue
+        widgets[image_name] = []
+        with open(label_path) as f:
+            for line in f:
+                data = line.split()
+                if not data or int(data[0]) not in TEXT_CLASS_IDS:
+                    continue
+                x_center, y_center, width, height = map(float, data[1:5])
+                widgets[image_name].append({"class_id": int(data[0]), "bbox": [
+                    (x_center - width / 2) * img_w, (y_center - height / 2) * img_h,
+                    (x_center + width / 2) * img_w, (y_center + height / 2) * img_h]})
+    return widgets
+
+# Worker process setup: every worker loads its own model once, sharing the CPU cores with the others,
+# and records spans with the settings of the parent
+def init_worker(cpu_threads, instrumentation_settings=None):
+    if instrumentation_settings:
+        instrumentation.configure(**instrumentation_settings)
+    get_ocr(cpu_threads)
+
+def recognize_task(task):
+    image_path, output_image_path, widgets = task
+    if widgets is not None:
+        return recognize_widgets(image_path, widgets, output_image_path)
+    return recognize_image(image_path, output_image_path)
+
+# Pool variant: also hands back the spans the worker recorded, for the parent's summary
+def recognize_task_traced(task):
+    return recognize_task(task), instrumentation.collect()
+
+# Main OCR processing function
+def ocr_processing(input_dir, output_image_dir, output_json, cache_dir=None, cache_size_mb=1024, workers=0,
+                   yolo_detections=None, yolo_labels_dir=None, server=None, yolo_store=None, output_store=None):
+    # Ensure output directory exists
+    if output_image_dir:
+        os.makedirs(output_image_dir, exist_ok=True)
+
+    # Optional content-addressed result cache shared with the other stages
+    cache = ResultCache(cache_dir, max_bytes=cache_size_mb * 1024 * 1024) if cache_dir else None
+
+    # Sorted, so results come out in the same order whatever the number of workers
+    image_names = sorted(name for name in os.listdir(input_dir) if name.lower().endswith((".jpg", ".png", ".jpeg")))
+
+    # Widget-restricted mode: only images with YOLO results, only their text-bearing widgets
+    widgets_by_image = None
+    if yolo_detections or yolo_labels_dir or yolo_store:
+        with instrumentation.span("ocr.read_detections"):
+            widgets_by_image = load_text_widgets(input_dir, yolo_detections, yolo_labels_dir, yolo_store)
+        image_names = [name for name in image_names if name in widgets_by_image]
+
+    # Texts per image: cache hits are filled in now, the rest after OCR
+    texts_by_image = {}
+    keys = {}
+    tasks = []
+    for image_name in image_names:
+        image_path = os.path.join(input_dir, image_name)
+        output_image_path = os.path.join(output_image_dir, image_name) if output_image_dir else None
+        widgets = widgets_by_image[image_name] if widgets_by_image is not None else None
+
+        if cache is not None:
+            params = {"confidence_threshold": CONFIDENCE_THRESHOLD}
+            if widgets is not None:
+                params["widgets"] = widgets
+            keys[image_name] = ResultCache.make_key(file_digest(image_path), "ocr", OCR_FINGERPRINT, params)
+            cached = cache.get(keys[image_name])
+            if cached is not None:
+                # Byte-identical image already recognized with the same settings
+                instrumentation.count("ocr.cache_hits")
+                texts_by_image[image_name] = cached
+                if cached and output_image_path and not os.path.exists(output_image_path):
+                    save_annotated_image(image_path, cached, output_image_path)
+                continue
+
+        tasks.append((image_path, output_image_path, widgets))
+
+    if server:
+        # Recognized by the PaddleOCR model kept loaded in the model server
+        texts_by_task = zip(tasks, ModelClient(server).ocr(tasks))
+    elif workers > 0:
+        cpu_threads = max(1, (os.cpu_count() or 1) // workers)
+        with multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker,
+                                                        initargs=(cpu_threads, instrumentation.settings())) as pool:
+            outputs = []
+            for texts, recorded in pool.imap(recognize_task_traced, tasks, chunksize=4):
+                instrumentation.merge(recorded)
+                outputs.append(texts)
+            texts_by_task = list(zip(tasks, outputs))
+    else:
+        texts_by_task = ((task, recognize_task(task)) for task in tasks)
+
+    for (image_path, _, _), texts in texts_by_task:
+        image_name = os.path.basename(image_path)
+        instrumentation.count("ocr.images")
+        instrumentation.count("ocr.texts", len(texts or []))
+        if texts is None:  # Skip if no text detected
+            instrumentation.log(f"❌ No text detected in {image_name}, skipping.")
+        for entry in texts or []:
+            instrumentation.log(f"✅ Detected text: {entry['text']} (Confidence: {entry['confidence']:.2f})")
+        texts_by_image[image_name] = texts
+        if cache is not None:
+            cache.put(keys[image_name], "ocr", texts or [])
+
+    # Initialize list to store OCR results
+    ocr_results = []
+    for image_name in image_names:
+        texts = texts_by_image[image_name]
+        if texts:
+            ocr_results.append({"image_name": image_name, "texts": texts})
+        elif texts is not None:
+            instrumentation.log(f"⚠️ No high-confidence text found in {image_name}, skipping.")
+
+    # Save results in JSON format and/or as a detection store
+    if output_json:
+        with instrumentation.span("ocr.write"), open(output_json, "w") as f:
+            json.dump(ocr_results, f, indent=4)
+    if output_store:
+        with instrumentation.span("ocr.write"), DetectionStoreWriter(output_store) as writer:
+            for entry in ocr_results:
+                try:
+                    img_w, img_h = read_image_size(os.path.join(input_dir, entry["image_name"]))
+                except (OSError, ValueError) as e:
+                    instrumentation.log(f"⚠️ Cannot read the size of {entry['image_name']}, not stored: {e}")
+                    continue
+                writer.add(entry["image_name"], img_w, img_h, ocr_entries(entry["texts"]))
+
+    print(f"\n🎯 OCR processing completed.")
+    if output_json:
+        print(f"📄 JSON results saved: {output_json}")
+    if output_store:
+        print(f"📦 Detection store saved: {output_store}")
+    if output_image_dir:
+        print(f"🖼 Annotated images saved in: {output_image_dir}")
+    if cache is not None:
+        print(f"🗄 {cache.summary()}")
+        cache.close()
+    instrumentation.report()
+
+# Run the OCR process with the command-line arguments
+if __name__ == "__main__":
+    args = parse_args()
+    instrumentation.configure_from_args(args)
+    ocr_processing(args.input_dir, args.output_image_dir, args.output_json, args.cache_dir, args.cache_size_mb, args.workers,
+                   args.yolo_detections, args.yolo_labels_dir, args.server, args.yolo_store, args.output_store)
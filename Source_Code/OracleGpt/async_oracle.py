@@ -0,0 +1,114 @@
+import asyncio
+import random
+import time
+import openai
+
+# HTTP statuses worth retrying: rate limited, or a transient server error
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Rough prompt size plus the completion budget, which the OpenAI limiter also counts against tokens per minute
+def estimate_tokens(prompt, max_tokens):
+    return len(prompt) // 4 + max_tokens
+
+def is_retryable(error):
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.Timeout,
+                          openai.error.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    return getattr(error, "http_status", None) in RETRYABLE_STATUS
+
+# Wait before the next attempt: the server's Retry-After if it sent one, otherwise exponential backoff with full jitter
+def retry_delay(error, attempt, base_delay, max_delay):
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(max_delay, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+# Token buckets for requests and tokens per minute; a limit of None is not enforced
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.limits = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.levels = {name: limit for name, limit in self.limits.items() if limit}
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        for name in self.levels:
+            self.levels[name] = min(self.limits[name], self.levels[name] + (now - self.updated) * self.limits[name] / 60)
+        self.updated = now
+
+    # Seconds to wait until the cost fits, or 0 after taking it from the buckets
+    def reserve(self, costs):
+        self.refill()
+        wait = 0.0
+        for name, level in self.levels.items():
+            cost = min(costs[name], self.limits[name])
+            if level < cost:
+                wait = max(wait, (cost - level) * 60 / self.limits[name])
+        if wait:
+            return wait
+        for name in self.levels:
+            self.levels[name] -= min(costs[name], self.limits[name])
+        return 0.0
+
+    async def acquire(self, tokens):
+        while True:
+            wait = self.reserve({"requests": 1, "tokens": tokens})
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+# Runs many prompts against GPT concurrently, within concurrency and rate limits, retrying transient errors
+class AsyncOracleClient:
+    def __init__(self, chatgpt4_config, max_concurrency=8, requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.chatgpt4_config = chatgpt4_config
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.semaphore = None
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+
+    # Response text of one prompt. With a response cache on the configuration, cached prompts return at once
+    # and concurrent identical prompts share one request, without taking rate limit budget.
+    async def complete(self, prompt):
+        cache = self.chatgpt4_config.cache
+        if cache is None:
+            return await self.complete_uncached(prompt)
+        return await cache.aget_or_create(self.chatgpt4_config.cache_key(prompt), lambda: self.complete_uncached(prompt))
+
+    # Raises the last error once retries are exhausted or the error is not transient
+    async def complete_uncached(self, prompt):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        tokens = estimate_tokens(prompt, self.chatgpt4_config.max_tokens)
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire(tokens)
+            async with self.semaphore:
+                self.stats["requests"] += 1
+                try:
+                    return await self.chatgpt4_config.arequest(prompt)
+                except Exception as e:
+                    if not is_retryable(e) or attempt == self.max_retries:
+                        self.stats["failures"] += 1
+                        raise
+                    delay = retry_delay(e, attempt, self.base_delay, self.max_delay)
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def run_one(self, prompt):
+        start = time.perf_counter()
+        try:
+            response, error = await self.complete(prompt), None
+        except Exception as e:
+            response, error = None, f"{type(e).__name__}: {e}"
+        return {"response": response, "error": error, "latency_s": round(time.perf_counter() - start, 3)}
+
+    # One result per prompt, in prompt order; a failed prompt has its error set instead of failing the batch
+    async def run_batch(self, prompts):
+        return await asyncio.gather(*(self.run_one(prompt) for prompt in prompts))
@@ -1,20 +1,72 @@
 
 
+import sys
+import itertools
+from pathlib import Path
 import openai
 
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+import instrumentation
+
+# Trace rows of concurrent requests, so overlapping requests are not drawn on top of each other
+REQUEST_TRACKS = itertools.count(1)
+
 class ChatGPT4Configuration:
-    def __init__(self, api_key):
+    def __init__(self, api_key, model="gpt-4", max_tokens=500, temperature=0.2, api_base=None, request_timeout=120, cache=None):
         self.api_key = api_key
         openai.api_key = self.api_key
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        # Another OpenAI-compatible endpoint, e.g. fake_openai_server.py for offline runs
+        self.api_base = api_base
+        self.request_timeout = request_timeout
+        # Optional ResponseCache: identical requests are answered from disk
+        self.cache = cache
+
+    def request_arguments(self, prompt):
+        arguments = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "api_key": self.api_key,
+            "request_timeout": self.request_timeout,
+        }
+        if self.api_base:
+            arguments["api_base"] = self.api_base
+        return arguments
+
+    # Everything that changes the answer to a prompt
+    def cache_key(self, prompt):
+        return self.cache.make_key(self.model, {"max_tokens": self.max_tokens, "temperature": self.temperature}, prompt)
+
+    # Uncached requests; they raise the OpenAI error instead of returning it, so callers can retry
+    def request(self, prompt):
+        instrumentation.count("gpt.requests")
+        with instrumentation.span("gpt.request"):
+            response = openai.ChatCompletion.create(**self.request_arguments(prompt))
+        return response.choices[0].message["content"].strip()
+
+    async def arequest(self, prompt):
+        instrumentation.count("gpt.requests")
+        with instrumentation.span("gpt.request", track=next(REQUEST_TRACKS)):
+            response = await openai.ChatCompletion.acreate(**self.request_arguments(prompt))
+        return response.choices[0].message["content"].strip()
+
+    def create_chat_completion(self, prompt):
+        if self.cache is None:
+            return self.request(prompt)
+        return self.cache.get_or_create(self.cache_key(prompt), lambda: self.request(prompt))
+
+    async def acreate_chat_completion(self, prompt):
+        if self.cache is None:
+            return await self.arequest(prompt)
+        return await self.cache.aget_or_create(self.cache_key(prompt), lambda: self.arequest(prompt))
 
     def get_chatgpt4_response(self, prompt):
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=500,
-                temperature=0.2
-            )
-            return response.choices[0].message["content"].strip()
+            return self.create_chat_completion(prompt)
         except Exception as e:
             return f"Error: {str(e)}"
@@ -0,0 +1,153 @@
+import re
+import argparse
+import tiktoken
+
+# "Screenshot 3 (frame_0007.png):" block headers written by Pipeline/run_pipeline.py
+SCREEN_HEADER = re.compile(r"^Screenshot\s+(\d+)\s*(?:\((.*)\))?:\s*$")
+
+# Widget lines written by CLIP/clip_matching.py describe_widget
+WIDGET_LINE = re.compile(r"^- The screen contains a '(.*)' \(Detected: (.*), Confidence: ([0-9.]+)\)\s*$")
+
+# Priority lost by an element for appearing on every screen (toolbars, navigation bars), relative to
+# one that only appears on a single screen
+REPEAT_PENALTY = 0.5
+
+# Token counter of the GPT model the prompt is sent to
+def token_counter(model="gpt-4"):
+    encoding = tiktoken.encoding_for_model(model)
+    return lambda text: len(encoding.encode(text))
+
+# Screens of a semantic description: pipeline blocks, or one screen for the flat clip_matching.py output
+def parse_description(text):
+    screens = []
+    screen = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        header = SCREEN_HEADER.match(line)
+        if header:
+            screen = {"title": line.rstrip(":"), "elements": [], "notes": []}
+            screens.append(screen)
+            continue
+        if screen is None:
+            screen = {"title": None, "elements": [], "notes": []}
+            screens.append(screen)
+        widget = WIDGET_LINE.match(line)
+        if widget:
+            screen["elements"].append({"caption": widget.group(1), "text": widget.group(2), "confidence": float(widget.group(3))})
+        elif line != "- No widgets detected":
+            screen["notes"].append(line)
+    return screens
+
+# Merge widgets with the same caption and text on a screen, keeping their count and highest confidence
+def merge_duplicates(elements):
+    merged = {}
+    for element in elements:
+        key = (element["caption"].strip().lower(), " ".join(element["text"].split()).lower())
+        if key in merged:
+            merged[key]["count"] += 1
+            merged[key]["confidence"] = max(merged[key]["confidence"], element["confidence"])
+        else:
+            merged[key] = {**element, "count": 1, "key": key}
+    return list(merged.values())
+
+def render_element(element):
+    text = f"{element['caption']} \"{element['text']}\""
+    return f"{text} x{element['count']}" if element["count"] > 1 else text
+
+# One line per screen: its title, then its elements; omitted elements are announced so GPT knows the list is partial
+def render_screen(screen, elements, omitted):
+    parts = [render_element(element) for element in elements]
+    if omitted:
+        parts.append(f"+{omitted} more")
+    body = "; ".join(parts) if parts else "no widgets"
+    lines = [f"{screen['title']}: {body}" if screen["title"] else f"- {body}"]
+    lines.extend(screen["notes"])
+    return "\n".join(lines)
+
+def render(screens, kept):
+    return "\n".join(render_screen(screen, [e for e in screen["elements"] if id(e) in kept],
+                                   sum(id(e) not in kept for e in screen["elements"]))
+                     for screen in screens)
+
+# Compact a semantic description and fit it into a token budget.
+# Widgets below min_confidence are dropped (none by default, the detector already applied its own threshold) and
+# duplicates merged; if the result is still over budget, elements are kept in priority order: confident elements
+# first, and elements that appear on many screens (status bars, toolbars) after those specific to one screen.
+# Screen titles are always kept.
+# Returns the compact text and a report of the token counts.
+def compact_description(text, count_tokens, token_budget=None, min_confidence=0.0):
+    screens = parse_description(text)
+    dropped_low_confidence = 0
+    for screen in screens:
+        confident = [element for element in screen["elements"] if element["confidence"] >= min_confidence]
+        dropped_low_confidence += len(screen["elements"]) - len(confident)
+        screen["elements"] = merge_duplicates(confident)
+
+    # Share of screens each element appears on
+    screens_with = {}
+    for screen in screens:
+        for element in screen["elements"]:
+            screens_with[element["key"]] = screens_with.get(element["key"], 0) + 1
+    ranked = []
+    for screen_index, screen in enumerate(screens):
+        for position, element in enumerate(screen["elements"]):
+            priority = element["confidence"] - REPEAT_PENALTY * (screens_with[element["key"]] - 1) / max(1, len(screens) - 1)
+            ranked.append((-priority, screen_index, position, element))
+    ranked.sort(key=lambda entry: entry[:3])
+
+    kept = {id(entry[3]) for entry in ranked}
+    compact = render(screens, kept)
+    if token_budget is not None and count_tokens(compact) > token_budget:
+        # Add elements by priority while an estimate from their own token counts fits, then check the real count
+        kept = set()
+        used = count_tokens(render(screens, kept))
+        for entry in ranked:
+            cost = count_tokens("; " + render_element(entry[3]))
+            if used + cost <= token_budget:
+                kept.add(id(entry[3]))
+                used += cost
+        compact = render(screens, kept)
+        for entry in reversed(ranked):
+            if count_tokens(compact) <= token_budget:
+                break
+            if id(entry[3]) in kept:
+                kept.discard(id(entry[3]))
+                compact = render(screens, kept)
+
+    original_tokens = count_tokens(text)
+    compact_tokens = count_tokens(compact)
+    report = {
+        "screens": len(screens),
+        "original_tokens": original_tokens,
+        "compact_tokens": compact_tokens,
+        "tokens_saved": original_tokens - compact_tokens,
+        "dropped_low_confidence": dropped_low_confidence,
+        "dropped_for_budget": len(ranked) - len(kept),
+        "over_budget": token_budget is not None and compact_tokens > token_budget,
+    }
+    return compact, report
+
+def format_report(report):
+    return (f"Description: {report['original_tokens']} -> {report['compact_tokens']} tokens "
+            f"({report['tokens_saved']} saved; {report['dropped_low_confidence']} low-confidence and "
+            f"{report['dropped_for_budget']} over-budget elements dropped)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact a semantic description to fit a token budget.")
+    parser.add_argument("--input", type=str, default="semantic_description.txt", help="Semantic description to compact.")
+    parser.add_argument("--output", type=str, default=None, help="Where to save the compact description (default: print it).")
+    parser.add_argument("--token_budget", type=int, default=None, help="Maximum number of tokens of the compact description.")
+    parser.add_argument("--min_confidence", type=float, default=0.0, help="Widgets below this confidence are dropped (default: keep all).")
+    parser.add_argument("--model", type=str, default="gpt-4", help="Model whose tokenizer counts the tokens.")
+    args = parser.parse_args()
+
+    with open(args.input, "r") as f:
+        compact, report = compact_description(f.read(), token_counter(args.model), args.token_budget, args.min_confidence)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(compact)
+    else:
+        print(compact)
+    print(format_report(report))
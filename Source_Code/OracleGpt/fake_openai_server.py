@@ -0,0 +1,133 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI chat completions endpoint, to run the oracle offline.
+# It answers every prompt after a fixed latency and can inject rate limits and server errors:
+#   with FakeOpenAIServer(latency=0.2, fail_first=3, error_rate=0.1) as server:
+#       gpt4 = ChatGPT4Configuration("test-key", api_base=server.api_base)
+class FakeOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, fail_first=0, error_rate=0.0, error_status=500,
+                 retry_after=None, respond=None, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.fail_first = fail_first
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.respond = respond or (lambda prompt: "No error")
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.prompts = []
+
+    @property
+    def api_base(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        handler = type("Handler", (FakeOpenAIHandler,), {"fake": self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    # Status, JSON body and extra headers for one chat completion request
+    def handle(self, body):
+        prompt = body["messages"][-1]["content"]
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            if self.requests <= self.fail_first:
+                status = 429
+            elif self.random.random() < self.error_rate:
+                status = self.error_status
+            else:
+                status = 200
+                self.prompts.append(prompt)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        if status != 200:
+            with self.lock:
+                self.failures += 1
+            headers = {"Retry-After": str(self.retry_after)} if status == 429 and self.retry_after is not None else {}
+            message = "Rate limit reached" if status == 429 else "The server had an error while processing your request"
+            return status, {"error": {"message": message, "type": "fake_error", "code": status}}, headers
+
+        content = self.respond(prompt)
+        return 200, {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }, {}
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    fake = None
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        status, payload, headers = self.fake.handle(body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI chat completions server for offline oracle runs.")
+    parser.add_argument("--port", type=int, default=8001, help="Port to listen on.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before every response.")
+    parser.add_argument("--fail_first", type=int, default=0, help="Answer the first N requests with 429.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with --error_status.")
+    parser.add_argument("--error_status", type=int, default=500, help="Status of injected errors.")
+    parser.add_argument("--retry_after", type=float, default=None, help="Retry-After header sent with 429 responses.")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(port=args.port, latency=args.latency, fail_first=args.fail_first, error_rate=args.error_rate,
+                              error_status=args.error_status, retry_after=args.retry_after).start()
+    print(f"Fake OpenAI server listening on {server.api_base}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
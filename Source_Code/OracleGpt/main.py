@@ -1,28 +1,105 @@
 
 from chatgpt4_config import ChatGPT4Configuration
-from text_processing import TextProcessing
-from deepui_prompt_template import create_deepui_prompt
+from textprocessing import TextProcessing
+from prompt_template import create_deepui_prompt
+from response_cache import ResponseCache
+from description_compaction import compact_description, token_counter, format_report
+import instrumentation
+import argparse
 import csv
+import time
+
+# Sample prompt values
+ROLE = "You are an expert in mobile app UI and functionality."
+RULES = "Ignore irrelevant system signals such as time, battery, Wi-Fi, notifications, or mobile data. Focus strictly on the actions and interface flow."
+ACTIONS = "Open the app. Adjust the size of the pop-out mode. Select a configurable minimum size in the settings menus."
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ask GPT-4 to find bugs in one scenario, or in a batch of prompts.")
+    parser.add_argument("--api_key", type=str, default="YOUR_OPENAI_API_KEY_HERE", help="OpenAI API key.")
+    parser.add_argument("--api_base", type=str, default=None, help="Other OpenAI-compatible endpoint, e.g. fake_openai_server.py.")
+    parser.add_argument("--prompts_csv", type=str, default=None, help="CSV with a 'prompt' column, or 'actions' and 'semantic_description' (file path) columns: run all prompts concurrently.")
+    parser.add_argument("--output_csv", type=str, default="oracle_results.csv", help="Where the batch results are written.")
+    parser.add_argument("--max_concurrency", type=int, default=8, help="Requests in flight at once.")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute limit.")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens per minute limit.")
+    parser.add_argument("--max_retries", type=int, default=6, help="Retries of a prompt on 429/5xx responses.")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of the response cache; identical prompts are not sent again.")
+    parser.add_argument("--cache_size_mb", type=int, default=256, help="Maximum size of the response cache.")
+    parser.add_argument("--cache_max_age_days", type=float, default=7, help="Responses older than this are requested again.")
+    parser.add_argument("--compact", action="store_true", help="Compact the semantic descriptions before building the prompts.")
+    parser.add_argument("--token_budget", type=int, default=None, help="Maximum tokens of a compacted semantic description (implies --compact).")
+    parser.add_argument("--min_confidence", type=float, default=0.0, help="Widgets below this confidence are dropped when compacting (default: keep all).")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    args.compact = args.compact or args.token_budget is not None
+    return args
+
+# Prompt of one scenario; the semantic description is compacted first if requested, and the token report returned
+def build_prompt(actions, semantic_descriptions, args, count_tokens):
+    report = None
+    if args.compact:
+        with instrumentation.span("gpt.compact"):
+            semantic_descriptions, report = compact_description(semantic_descriptions, count_tokens, args.token_budget, args.min_confidence)
+    return create_deepui_prompt(ROLE, RULES, actions, semantic_descriptions), report
 
 if __name__ == "__main__":
-    api_key = "YOUR_OPENAI_API_KEY_HERE"
+    args = parse_args()
+    instrumentation.configure_from_args(args)
 
     # Initialize GPT-4
-    gpt4 = ChatGPT4Configuration(api_key)
+    cache = ResponseCache(args.cache_dir, args.cache_size_mb * 1024 * 1024, args.cache_max_age_days * 24 * 3600) if args.cache_dir else None
+    gpt4 = ChatGPT4Configuration(args.api_key, api_base=args.api_base, cache=cache)
     processor = TextProcessing(gpt4)
+    count_tokens = token_counter(gpt4.model) if args.compact else None
+
+    if args.prompts_csv:
+        with open(args.prompts_csv, newline="") as f:
+            rows = list(csv.DictReader(f))
+        prompts, reports = [], []
+        for row in rows:
+            if row.get("prompt"):
+                prompts.append(row["prompt"])
+                reports.append(None)
+                continue
+            with open(row["semantic_description"], "r") as f:
+                prompt, report = build_prompt(row.get("actions") or ACTIONS, f.read(), args, count_tokens)
+            prompts.append(prompt)
+            reports.append(report)
+            if report:
+                instrumentation.log(f"{row['semantic_description']}: {format_report(report)}")
+
+        start = time.perf_counter()
+        results, stats = processor.generate_outputs_for_prompts(
+            prompts, max_concurrency=args.max_concurrency, requests_per_minute=args.rpm,
+            tokens_per_minute=args.tpm, max_retries=args.max_retries)
+        with open(args.output_csv, "w", newline="") as f:
+            extra = ["response", "error", "latency_s"] + (["description_tokens", "tokens_saved"] if args.compact else [])
+            writer = csv.DictWriter(f, fieldnames=(list(rows[0].keys()) if rows else ["prompt"]) + extra)
+            writer.writeheader()
+            for row, result, report in zip(rows, results, reports):
+                if report:
+                    result = {**result, "description_tokens": report["compact_tokens"], "tokens_saved": report["tokens_saved"]}
+                writer.writerow({**row, **result})
+        failed = sum(result["error"] is not None for result in results)
+        print(f"{len(results)} prompts in {time.perf_counter() - start:.1f}s, {failed} failed, "
+              f"{stats['requests']} requests, {stats['retries']} retries -> {args.output_csv}")
+    else:
+        semantic_descriptions = open("semantic_description.txt", "r").read()  # Optional external file
 
-    # Sample prompt values
-    role = "You are an expert in mobile app UI and functionality."
-    rules = "Ignore irrelevant system signals such as time, battery, Wi-Fi, notifications, or mobile data. Focus strictly on the actions and interface flow."
-    actions = "Open the app. Adjust the size of the pop-out mode. Select a configurable minimum size in the settings menus."
-    semantic_descriptions = open("semantic_description.txt", "r").read()  # Optional external file
+        # Compose prompt
+        full_prompt, report = build_prompt(ACTIONS, semantic_descriptions, args, count_tokens)
+        if report:
+            print(format_report(report))
 
-    # Compose prompt
-    full_prompt = create_deepui_prompt(role, rules, actions, semantic_descriptions)
+        # Get GPT-4 result
+        result = processor.generate_output_for_prompt(full_prompt)
 
-    # Get GPT-4 result
-    result = processor.generate_output_for_prompt(full_prompt)
+        # Output
+        print("===== GPT-4 Bug Analysis =====")
+        print(result)
 
-    # Output
-    print("===== GPT-4 Bug Analysis =====")
-    print(result)
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
+    instrumentation.report()
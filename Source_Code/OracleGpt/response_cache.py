@@ -0,0 +1,93 @@
+import sys
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from result_cache import ResultCache
+
+# Disk-backed cache of GPT responses keyed on model, request parameters and prompt, bounded in size and age.
+# Identical prompts that are requested while the first one is still in flight wait for that request
+# instead of sending their own. Only successful responses are stored.
+class ResponseCache:
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, max_age_s=7 * 24 * 3600):
+        self.store = ResultCache(cache_dir, max_bytes=max_bytes, max_age_s=max_age_s)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.apending = {}
+        self.deduplicated = 0
+
+    @staticmethod
+    def make_key(model, params, prompt):
+        return ResultCache.make_key(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), "gpt", model, params)
+
+    # Cached response, or the result of create() shared with every thread asking for the same key meanwhile.
+    # The store and the pending map are checked under the same lock: a leader stores its response before it
+    # leaves the pending map, so a request that just finished is always found in one of the two.
+    def get_or_create(self, key, create):
+        with self.lock:
+            cached = self.store.get(key)
+            if cached is not None:
+                return cached
+            future = self.pending.get(key)
+            leader = future is None
+            if leader:
+                future = self.pending[key] = Future()
+            else:
+                self.deduplicated += 1
+        if not leader:
+            return future.result()
+
+        try:
+            response = create()
+            self.store.put(key, "gpt", response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    # Same for coroutines: concurrent tasks of one event loop share a single request per key. There is no await
+    # between the store lookup and the pending check, so no task can finish in between.
+    async def aget_or_create(self, key, acreate):
+        cached = self.store.get(key)
+        if cached is not None:
+            return cached
+        future = self.apending.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(future)
+
+        future = self.apending[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await acreate()
+            self.store.put(key, "gpt", response)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here, so an exception nobody else waited for is not reported as unhandled
+            future.exception()
+            raise
+        finally:
+            del self.apending[key]
+
+    def stats(self):
+        stats = self.store.stats()
+        # Joined duplicates were misses of the store but still saved a request
+        return {**stats, "deduplicated": self.deduplicated, "requests_saved": stats["hits"] + self.deduplicated}
+
+    def summary(self):
+        return f"{self.store.summary()}, {self.deduplicated} in-flight duplicates joined"
+
+    def close(self):
+        self.store.close()
@@ -1,8 +1,23 @@
 
 
+import asyncio
+
+from async_oracle import AsyncOracleClient
+
 class TextProcessing:
     def __init__(self, chatgpt4_config):
         self.chatgpt4_config = chatgpt4_config
 
     def generate_output_for_prompt(self, prompt):
         return self.chatgpt4_config.get_chatgpt4_response(prompt)
+
+    # Many prompts concurrently; client_options are passed to AsyncOracleClient
+    # (max_concurrency, requests_per_minute, tokens_per_minute, max_retries, ...)
+    async def agenerate_outputs_for_prompts(self, prompts, **client_options):
+        client = AsyncOracleClient(self.chatgpt4_config, **client_options)
+        results = await client.run_batch(prompts)
+        return results, client.stats
+
+    # Blocking entry point: one result dict per prompt, in order, with "response", "error" and "latency_s"
+    def generate_outputs_for_prompts(self, prompts, **client_options):
+        return asyncio.run(self.agenerate_outputs_for_prompts(prompts, **client_options))
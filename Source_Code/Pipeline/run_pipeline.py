@@ -0,0 +1,168 @@
+import sys
+import queue
+import argparse
+import threading
+from pathlib import Path
+from PIL import Image
+from ultralytics import YOLO
+
+# The stage scripts live next to this folder
+SOURCE_DIR = Path(__file__).resolve().parents[1]
+for stage_dir in ("Common", "YOLO", "OCR", "Proximity_matching", "Screen_diff", "CLIP"):
+    sys.path.append(str(SOURCE_DIR / stage_dir))
+
+from infer import find_images, iter_decoded_batches, result_to_outputs
+from ocr_script import recognize_image
+from proximity_matching import match_texts_to_boxes
+from screen_diff import diff_screens, describe_changes
+from clip_matching import WidgetCaptioner, describe_widget
+import instrumentation
+
+# Marks the end of the frame stream between stages
+STOP = object()
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run YOLO, OCR, proximity matching and CLIP on each screenshot, decoding it only once")
+    parser.add_argument('--weights', type=str, required=True, help="Path to the trained YOLO model weights file")
+    parser.add_argument('--image_dir', type=str, required=True, help="Directory containing the screenshots of one scenario")
+    parser.add_argument('--rico_captions', type=str, required=True, help="Path to RICO widget captions JSON file")
+    parser.add_argument('--index_dir', type=str, default=None, help="Directory of the saved caption index (see CLIP/caption_index.py)")
+    parser.add_argument('--output', type=str, default="semantic_description.txt", help="Path to save the semantic description")
+    parser.add_argument('--decode_workers', type=int, default=2, help="Threads decoding screenshots ahead of the detector")
+    parser.add_argument('--queue_size', type=int, default=4, help="Frames buffered between consecutive stages")
+    parser.add_argument('--diff', action='store_true', help="Describe only the widgets added, removed or changed since the previous screenshot")
+    parser.add_argument('--iou_threshold', type=float, default=0.5, help="Minimum box IoU for widgets of consecutive screenshots to be the same element (with --diff)")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+# YOLO widget detection on the decoded frame
+def make_detect_stage(weights_path):
+    model = YOLO(weights_path)
+
+    def detect(frame):
+        img = frame["image"]
+        with instrumentation.span("yolo.forward"):
+            r = model(img)[0]
+        img_h, img_w = img.shape[:2]
+        with instrumentation.span("yolo.postprocess"):
+            _, records = result_to_outputs(r, frame["path"], img_h, img_w)
+        frame["widgets"] = [{"class_id": rec["class_id"], "confidence": rec["confidence"],
+                             "bbox": [int(v) for v in rec["bbox_xyxy"]]} for rec in records]
+    return detect
+
+# PaddleOCR text recognition on the same decoded frame
+def recognize(frame):
+    frame["texts"] = recognize_image(frame["image"]) or []
+
+# Proximity matching followed by CLIP captioning of each widget crop.
+# With diff, widgets are matched against the previous screenshot and only added or changed ones are captioned
+# (changed text, or changed pixels such as a toggled switch); unchanged widgets keep their caption and the
+# screenshot is described by its changes.
+def make_describe_stage(rico_captions_path, index_dir=None, diff=False, iou_threshold=0.5):
+    captioner = WidgetCaptioner(rico_captions_path, index_dir=index_dir)
+    # Elements, captions and pixels of the previous screenshot; the describe stage sees frames in order
+    previous = {"elements": None, "captions": [], "image": None}
+
+    def describe(frame):
+        matched = match_texts_to_boxes(frame["path"].name, frame["widgets"], frame["texts"])
+        elements = matched["ui_elements"]
+        changes = None
+        if diff and previous["elements"] is not None:
+            with instrumentation.span("screen_diff.diff"):
+                changes = diff_screens(previous["elements"], elements, iou_threshold, previous["image"], frame["image"])
+            to_caption = changes["added"] + [j for _, j in changes["changed"]]
+        else:
+            to_caption = list(range(len(elements)))
+
+        # OpenCV decodes to BGR; CLIP expects RGB
+        with instrumentation.span("clip.crop"):
+            img = Image.fromarray(frame["image"][:, :, ::-1])
+            crops = [img.crop(tuple(elements[j]["bbox"])) for j in to_caption]
+        # All widgets to caption go through the CLIP encoder in one batch
+        captions = [None] * len(elements)
+        for j, best_caption in zip(to_caption, captioner.caption_batch(crops)):
+            captions[j] = best_caption
+
+        if changes is None:
+            frame["lines"] = [describe_widget(best_caption, element["matched_text"], widget["confidence"])
+                              for best_caption, element, widget in zip(captions, elements, frame["widgets"])]
+        else:
+            for i, j in changes["unchanged"]:
+                captions[j] = previous["captions"][i]
+            frame["lines"] = describe_changes(
+                [(captions[j], elements[j]) for j in changes["added"]],
+                [(previous["captions"][i], previous["elements"][i]) for i in changes["removed"]],
+                [(captions[j], previous["elements"][i], elements[j]) for i, j in changes["changed"]],
+                len(changes["unchanged"]))
+            frame["lines"] = frame["lines"] or ["- No changes"]
+        previous["elements"], previous["captions"] = elements, captions
+        # The pixel buffer is kept for the next screenshot's diff only, and no longer travels with the frame
+        image = frame.pop("image")
+        previous["image"] = image if diff else None
+    return describe
+
+# Run one stage on every frame from inbox and pass it on; a failing frame is passed on with its error
+def run_stage(fn, inbox, outbox):
+    while True:
+        frame = inbox.get()
+        if frame is STOP:
+            outbox.put(STOP)
+            return
+        if "error" not in frame:
+            try:
+                fn(frame)
+            except Exception as e:
+                frame["error"] = str(e)
+        outbox.put(frame)
+
+# Decode every screenshot once and feed it into the first stage
+def feed_frames(image_paths, decode_workers, outbox):
+    index = 0
+    for batch in iter_decoded_batches(image_paths, 1, decode_workers):
+        for image_path, img, _, _ in batch:
+            if img is None:
+                print(f" Skipping unreadable image: {image_path}")
+                continue
+            index += 1
+            outbox.put({"index": index, "path": image_path, "image": img})
+    outbox.put(STOP)
+
+def run_pipeline(weights_path, image_dir, rico_captions_path, output_path, decode_workers=2, queue_size=4, index_dir=None,
+                 diff=False, iou_threshold=0.5):
+    stages = [make_detect_stage(weights_path), recognize, make_describe_stage(rico_captions_path, index_dir, diff, iou_threshold)]
+
+    # One thread per stage, so different frames are in different stages at the same time
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = [threading.Thread(target=feed_frames, args=(sorted(find_images(image_dir)), decode_workers, queues[0]), daemon=True)]
+    for i, fn in enumerate(stages):
+        threads.append(threading.Thread(target=run_stage, args=(fn, queues[i], queues[i + 1]), daemon=True))
+    for t in threads:
+        t.start()
+
+    # Frames leave the last stage in input order
+    with open(output_path, "w") as f:
+        while True:
+            frame = queues[-1].get()
+            if frame is STOP:
+                break
+            if "error" in frame:
+                print(f" Failed on {frame['path']}: {frame['error']}")
+                continue
+            with instrumentation.span("pipeline.write"):
+                f.write(f"Screenshot {frame['index']} ({frame['path'].name}):\n")
+                f.write("\n".join(frame["lines"]) if frame["lines"] else "- No widgets detected")
+                f.write("\n\n")
+            instrumentation.count("pipeline.images")
+            instrumentation.log(f" Processed: {frame['path']}")
+
+    for t in threads:
+        t.join()
+    print(f"\n Semantic description saved to: {output_path}")
+    instrumentation.report()
+
+if __name__ == "__main__":
+    args = parse_args()
+    instrumentation.configure_from_args(args)
+    run_pipeline(args.weights, args.image_dir, args.rico_captions, args.output, args.decode_workers, args.queue_size,
+                 args.index_dir, args.diff, args.iou_threshold)
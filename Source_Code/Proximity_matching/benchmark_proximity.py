@@ -0,0 +1,84 @@
+import time
+import argparse
+import numpy as np
+
+from proximity_matching import calculate_distance, match_texts_to_boxes
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark proximity matching on synthetic dense screens")
+    parser.add_argument('--screens', type=int, default=20, help="Number of synthetic screens per density")
+    parser.add_argument('--densities', type=str, default="20x40,80x200,200x600", help="Comma-separated widgets x texts per screen")
+    parser.add_argument('--width', type=int, default=1440, help="Synthetic screen width")
+    parser.add_argument('--height', type=int, default=3120, help="Synthetic screen height")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    return parser.parse_args()
+
+# The original per-pair loop, kept as the reference for timing and correctness
+def legacy_match(image_name, yolo_boxes, texts):
+    matched_entries = {"image_name": image_name, "ui_elements": []}
+    for yolo_box in yolo_boxes:
+        closest_text = None
+        min_distance = float("inf")
+        for text_entry in texts:
+            ocr_bbox = [
+                int(text_entry["bbox"][0][0]), int(text_entry["bbox"][0][1]),
+                int(text_entry["bbox"][2][0]), int(text_entry["bbox"][2][1])
+            ]
+            distance = calculate_distance(yolo_box["bbox"], ocr_bbox)
+            if distance < min_distance:
+                min_distance = distance
+                closest_text = text_entry["text"]
+        matched_entries["ui_elements"].append({
+            "class_id": yolo_box["class_id"],
+            "bbox": yolo_box["bbox"],
+            "matched_text": closest_text if closest_text else "No text nearby"
+        })
+    return matched_entries
+
+# Random widget boxes and OCR quads in the same format as the YOLO and OCR stages produce
+def synthetic_screen(rng, n_widgets, n_texts, width, height):
+    yolo_boxes = []
+    for _ in range(n_widgets):
+        x, y = rng.uniform(0, width - 200), rng.uniform(0, height - 120)
+        w, h = rng.uniform(40, 200), rng.uniform(30, 120)
+        yolo_boxes.append({"class_id": int(rng.integers(0, 19)), "bbox": [int(x), int(y), int(x + w), int(y + h)]})
+    texts = []
+    for i in range(n_texts):
+        x, y = rng.uniform(0, width - 150), rng.uniform(0, height - 40)
+        w, h = rng.uniform(20, 150), rng.uniform(15, 40)
+        quad = [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]
+        texts.append({"text": f"text {i}", "bbox": quad, "confidence": 0.9})
+    return yolo_boxes, texts
+
+def time_method(fn, screens):
+    start = time.perf_counter()
+    results = [fn(f"screen_{i}.png", boxes, texts) for i, (boxes, texts) in enumerate(screens)]
+    return time.perf_counter() - start, results
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'widgets x texts':>16} {'loop (ms/img)':>14} {'matrix (ms/img)':>16} {'kdtree (ms/img)':>16} {'speedup':>8} {'containment (ms/img)':>21}")
+    for density in args.densities.split(","):
+        n_widgets, n_texts = map(int, density.split("x"))
+        screens = [synthetic_screen(rng, n_widgets, n_texts, args.width, args.height) for _ in range(args.screens)]
+
+        t_loop, expected = time_method(legacy_match, screens)
+        t_matrix, matrix_results = time_method(lambda n, b, t: match_texts_to_boxes(n, b, t, "matrix"), screens)
+        t_kdtree, kdtree_results = time_method(lambda n, b, t: match_texts_to_boxes(n, b, t, "kdtree"), screens)
+        t_contain, _ = time_method(lambda n, b, t: match_texts_to_boxes(n, b, t, match="containment"), screens)
+
+        if matrix_results != expected:
+            print(f"  Warning: matrix results differ from the loop for {density}")
+        if kdtree_results != expected:
+            # Only possible when two texts are exactly equally close to a widget
+            print(f"  Note: KD-tree picked a different equally-near text for some widgets in {density}")
+
+        per_img = lambda t: 1000 * t / args.screens
+        print(f"{density:>16} {per_img(t_loop):>14.2f} {per_img(t_matrix):>16.2f} {per_img(t_kdtree):>16.2f} "
+              f"{t_loop / min(t_matrix, t_kdtree):>7.1f}x {per_img(t_contain):>21.2f}")
+
+if __name__ == "__main__":
+    main()
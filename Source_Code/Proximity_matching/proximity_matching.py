@@ -1,95 +1,237 @@
-import os
-import json
-import numpy as np
-import argparse
-
-# Set up command-line arguments
-def parse_args():
-    parser = argparse.ArgumentParser(description="Proximity Matching of OCR Text and YOLO Widgets")
-    parser.add_argument('--yolo_labels_dir', type=str, required=True, help="Directory containing YOLO label files")
-    parser.add_argument('--ocr_json_path', type=str, required=True, help="Path to the OCR JSON file")
-    parser.add_argument('--output_json_path', type=str, required=True, help="Path to save the proximity-matched results JSON file")
-    return parser.parse_args()
-
-# Function to calculate the Euclidean distance between two bounding boxes
-def calculate_distance(box1, box2):
-    center1 = ((box1[0] + box1[2]) / 2, (box1[1] + box1[3]) / 2)
-    center2 = ((box2[0] + box2[2]) / 2, (box2[1] + box2[3]) / 2)
-    return np.linalg.norm(np.array(center1) - np.array(center2))
-
-# Function to parse YOLO labels
-def parse_yolo_labels(label_path, img_width, img_height):
-    yolo_boxes = []
-    with open(label_path, "r") as f:
-        for line in f:
-            data = line.strip().split()
-            class_id = int(data[0])
-            x_center, y_center, width, height = map(float, data[1:])
-            
-            # Convert YOLO format to absolute pixel coordinates
-            x_min = int((x_center - width / 2) * img_width)
-            y_min = int((y_center - height / 2) * img_height)
-            x_max = int((x_center + width / 2) * img_width)
-            y_max = int((y_center + height / 2) * img_height)
-
-            yolo_boxes.append({"class_id": class_id, "bbox": [x_min, y_min, x_max, y_max]})
-    return yolo_boxes
-
-# Main function for proximity matching
-def proximity_matching(yolo_labels_dir, ocr_json_path, output_json_path):
-    # Load OCR results
-    with open(ocr_json_path, "r") as f:
-        ocr_data = json.load(f)
-
-    proximity_results = []
-    
-    # Process each OCR entry
-    for ocr_entry in ocr_data:
-        image_name = ocr_entry["image_name"]
-        label_file = os.path.join(yolo_labels_dir, image_name.replace(".jpg", ".txt"))
-
-        if not os.path.exists(label_file):
-            print(f"Skipping {image_name}, no YOLO label found.")
-            continue
-
-        # Assuming all images have the same resolution (modify if needed)
-        IMAGE_WIDTH, IMAGE_HEIGHT = 1080, 1920  # Adjust if different
-
-        yolo_boxes = parse_yolo_labels(label_file, IMAGE_WIDTH, IMAGE_HEIGHT)
-        matched_entries = {"image_name": image_name, "ui_elements": []}
-
-        # Match OCR text to the nearest YOLO bounding box
-        for yolo_box in yolo_boxes:
-            closest_text = None
-            min_distance = float("inf")
-
-            for text_entry in ocr_entry["texts"]:
-                ocr_bbox = [
-                    int(text_entry["bbox"][0][0]), int(text_entry["bbox"][0][1]),
-                    int(text_entry["bbox"][2][0]), int(text_entry["bbox"][2][1])
-                ]
-
-                distance = calculate_distance(yolo_box["bbox"], ocr_bbox)
-                if distance < min_distance:
-                    min_distance = distance
-                    closest_text = text_entry["text"]
-
-            matched_entries["ui_elements"].append({
-                "class_id": yolo_box["class_id"],
-                "bbox": yolo_box["bbox"],
-                "matched_text": closest_text if closest_text else "No text nearby"
-            })
-
-        proximity_results.append(matched_entries)
-
-    # Save results
-    with open(output_json_path, "w") as f:
-        json.dump(proximity_results, f, indent=4)
-
-    print(f" Proximity matching completed!")
-    print(f" JSON results saved: {output_json_path}")
-
-# Run the proximity matching process
-if __name__ == "__main__":
-    args = parse_args()
-    proximity_matching(args.yolo_labels_dir, args.ocr_json_path, args.output_json_path)
+import os
+import json
+import sys
+import numpy as np
+import argparse
+from pathlib import Path
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from jsonl_records import iter_records
+from image_header import read_image_size
+from detection_store import DetectionStore
+import instrumentation
+
+# Image size assumed for label files when no --image_dir is given (the original fixed resolution)
+DEFAULT_IMAGE_SIZE = (1080, 1920)
+
+# Above this many widget x text pairs, nearest texts are found with a KD-tree instead of a full distance matrix
+KDTREE_MIN_PAIRS = 250000
+
+# Containment is computed for this many widget x text pairs at a time, so dense screens never build a huge matrix
+CONTAINMENT_CHUNK_PAIRS = 250000
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Proximity Matching of OCR Text and YOLO Widgets")
+    parser.add_argument('--yolo_labels_dir', type=str, help="Directory containing YOLO label files")
+    parser.add_argument('--yolo_jsonl', type=str, help="Streaming detections.jsonl from infer.py (used instead of --yolo_labels_dir)")
+    parser.add_argument('--yolo_store', type=str, help="detections_store/ from infer.py --output_format store (used instead of --yolo_labels_dir)")
+    parser.add_argument('--ocr_json_path', type=str, help="Path to the OCR JSON file")
+    parser.add_argument('--ocr_store', type=str, help="OCR detection store from ocr_script.py --output_store (used instead of --ocr_json_path)")
+    parser.add_argument('--output_json_path', type=str, required=True, help="Path to save the proximity-matched results JSON file")
+    parser.add_argument('--image_dir', type=str, default=None, help="Directory containing the screenshots; each image's size is read from its file header (default: assume 1080x1920)")
+    parser.add_argument('--search', type=str, choices=['auto', 'matrix', 'kdtree'], default='auto', help="Nearest-text search: full distance matrix, KD-tree, or chosen by screen density")
+    parser.add_argument('--match', type=str, choices=['nearest', 'containment'], default='nearest', help="nearest: the text with the closest center; containment: the text lying most inside the widget, falling back to the nearest one")
+    parser.add_argument('--min_containment', type=float, default=0.5, help="With --match containment, share of a text's area that must lie inside the widget")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if not args.yolo_labels_dir and not args.yolo_jsonl and not args.yolo_store:
+        parser.error("one of --yolo_labels_dir, --yolo_jsonl or --yolo_store is required")
+    if not args.ocr_json_path and not args.ocr_store:
+        parser.error("one of --ocr_json_path or --ocr_store is required")
+    return args
+
+# Function to calculate the Euclidean distance between two bounding boxes
+def calculate_distance(box1, box2):
+    center1 = ((box1[0] + box1[2]) / 2, (box1[1] + box1[3]) / 2)
+    center2 = ((box2[0] + box2[2]) / 2, (box2[1] + box2[3]) / 2)
+    return np.linalg.norm(np.array(center1) - np.array(center2))
+
+# Function to parse YOLO labels
+def parse_yolo_labels(label_path, img_width, img_height):
+    yolo_boxes = []
+    with open(label_path, "r") as f:
+        for line in f:
+            data = line.strip().split()
+            class_id = int(data[0])
+            x_center, y_center, width, height = map(float, data[1:])
+            
+            # Convert YOLO format to absolute pixel coordinates
+            x_min = int((x_center - width / 2) * img_width)
+            y_min = int((y_center - height / 2) * img_height)
+            x_max = int((x_center + width / 2) * img_width)
+            y_max = int((y_center + height / 2) * img_height)
+
+            yolo_boxes.append({"class_id": class_id, "bbox": [x_min, y_min, x_max, y_max]})
+    return yolo_boxes
+
+# Centers of an (N, 4) array of [x_min, y_min, x_max, y_max] boxes
+def box_centers(boxes):
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+# OCR quads ([[x, y], ...] x4) to integer [x_min, y_min, x_max, y_max] boxes, as the per-pair loop did
+def ocr_boxes(texts):
+    quads = np.asarray([text_entry["bbox"] for text_entry in texts], dtype=np.float64)
+    return np.concatenate([quads[:, 0, :], quads[:, 2, :]], axis=1).astype(np.int64)
+
+# Index of the nearest text center for every widget center, over whole per-image arrays
+def nearest_text_indices(widget_boxes, text_boxes, search="auto"):
+    widget_centers = box_centers(widget_boxes.astype(np.float64))
+    text_centers = box_centers(text_boxes.astype(np.float64))
+    if search == "auto":
+        search = "kdtree" if len(widget_centers) * len(text_centers) > KDTREE_MIN_PAIRS else "matrix"
+
+    if search == "kdtree":
+        from sklearn.neighbors import KDTree
+        _, idx = KDTree(text_centers).query(widget_centers, k=1)
+        return idx[:, 0]
+
+    # (N, M) matrix of squared center distances; argmin keeps the first of equally close texts like the loop did
+    diff = widget_centers[:, None, :] - text_centers[None, :, :]
+    return np.argmin(np.einsum("nmk,nmk->nm", diff, diff), axis=1)
+
+# Share of each text box's area that lies inside each widget box, as an (N, M) matrix
+def containment_matrix(widget_boxes, text_boxes):
+    widgets = widget_boxes.astype(np.float64)[:, None, :]
+    texts = text_boxes.astype(np.float64)[None, :, :]
+    inter_w = np.clip(np.minimum(widgets[..., 2], texts[..., 2]) - np.maximum(widgets[..., 0], texts[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(widgets[..., 3], texts[..., 3]) - np.maximum(widgets[..., 1], texts[..., 1]), 0, None)
+    area = (texts[..., 2] - texts[..., 0]) * (texts[..., 3] - texts[..., 1])
+    return np.divide(inter_w * inter_h, area, out=np.zeros(inter_w.shape), where=area > 0)
+
+# For every widget, the text lying most inside it (the nearest of equally contained ones) and that share,
+# or -1 when no text reaches min_containment. Widgets are processed in chunks over the whole text array.
+def contained_text_indices(widget_boxes, text_boxes, min_containment=0.5):
+    text_centers = box_centers(text_boxes.astype(np.float64))
+    indices = np.full(len(widget_boxes), -1, dtype=np.int64)
+    shares = np.zeros(len(widget_boxes))
+    chunk = max(1, CONTAINMENT_CHUNK_PAIRS // len(text_boxes))
+    for start in range(0, len(widget_boxes), chunk):
+        boxes = widget_boxes[start:start + chunk]
+        share = containment_matrix(boxes, text_boxes)
+        diff = box_centers(boxes.astype(np.float64))[:, None, :] - text_centers[None, :, :]
+        dist = np.einsum("nmk,nmk->nm", diff, diff)
+        best = share.max(axis=1)
+        idx = np.argmin(np.where(share >= best[:, None] - 1e-9, dist, np.inf), axis=1)
+        found = best >= min_containment
+        indices[start:start + chunk] = np.where(found, idx, -1)
+        shares[start:start + chunk] = np.where(found, best, 0.0)
+    return indices, shares
+
+# Match OCR text to the nearest YOLO bounding box, or with match="containment" to the text lying most inside it
+# (widgets without such a text still get the nearest one). In containment mode each element also records the
+# share of its text's area inside the widget.
+def match_texts_to_boxes(image_name, yolo_boxes, texts, search="auto", match="nearest", min_containment=0.5):
+    matched_entries = {"image_name": image_name, "ui_elements": []}
+    instrumentation.count("proximity.images")
+    if not yolo_boxes:
+        return matched_entries
+
+    instrumentation.count("proximity.widgets", len(yolo_boxes))
+    with instrumentation.span("proximity.match"):
+        if texts:
+            widget_boxes = np.asarray([yolo_box["bbox"] for yolo_box in yolo_boxes])
+            text_boxes = ocr_boxes(texts)
+            nearest = nearest_text_indices(widget_boxes, text_boxes, search)
+            shares = np.zeros(len(yolo_boxes))
+            if match == "containment":
+                contained, shares = contained_text_indices(widget_boxes, text_boxes, min_containment)
+                nearest = np.where(contained >= 0, contained, nearest)
+        else:
+            nearest = [None] * len(yolo_boxes)
+            shares = np.zeros(len(yolo_boxes))
+
+    for yolo_box, text_idx, share in zip(yolo_boxes, nearest, shares):
+        closest_text = texts[text_idx]["text"] if text_idx is not None else None
+        element = {
+            "class_id": yolo_box["class_id"],
+            "bbox": yolo_box["bbox"],
+            "matched_text": closest_text if closest_text else "No text nearby"
+        }
+        if match == "containment":
+            element["containment"] = round(float(share), 3)
+        matched_entries["ui_elements"].append(element)
+    return matched_entries
+
+# Read pixel boxes straight from a detections.jsonl record (no image size assumption needed)
+def jsonl_record_boxes(record):
+    return [{"class_id": d["class_id"], "bbox": [int(v) for v in d["bbox_xyxy"]]} for d in record["detections"]]
+
+# Widget boxes of image i of a detection store, in pixels
+def store_boxes(store, i):
+    return [{"class_id": int(class_id), "bbox": [int(v) for v in box]}
+            for class_id, box in zip(store.image_boxes(i)["class_id"], store.xyxy(i))]
+
+# Main function for proximity matching
+def proximity_matching(yolo_labels_dir, ocr_json_path, output_json_path, yolo_jsonl=None, image_dir=None, search="auto",
+                       yolo_store=None, ocr_store=None, match="nearest", min_containment=0.5):
+    # Load OCR results
+    with instrumentation.span("proximity.read_ocr"):
+        if ocr_store:
+            texts_store = DetectionStore(ocr_store)
+            ocr_data = [{"image_name": texts_store.name(i), "texts": texts_store.texts(i)} for i in range(len(texts_store))]
+        else:
+            with open(ocr_json_path, "r") as f:
+                ocr_data = json.load(f)
+
+    proximity_results = []
+
+    if yolo_store:
+        # Each image's boxes are one slice of the memory-mapped store, found by name
+        store = DetectionStore(yolo_store)
+        for ocr_entry in ocr_data:
+            i = store.index(ocr_entry["image_name"])
+            if i is None:
+                print(f"Skipping {ocr_entry['image_name']}, no YOLO detections found.")
+                continue
+            proximity_results.append(match_texts_to_boxes(ocr_entry["image_name"], store_boxes(store, i), ocr_entry["texts"],
+                                                          search, match, min_containment))
+    elif yolo_jsonl:
+        # Stream detection records one image at a time and look up the OCR texts for each
+        ocr_by_image = {entry["image_name"]: entry["texts"] for entry in ocr_data}
+        for record in iter_records(yolo_jsonl):
+            image_name = os.path.basename(record["image"])
+            if image_name not in ocr_by_image:
+                continue
+            yolo_boxes = jsonl_record_boxes(record)
+            proximity_results.append(match_texts_to_boxes(image_name, yolo_boxes, ocr_by_image[image_name], search,
+                                                          match, min_containment))
+    else:
+        # Process each OCR entry
+        for ocr_entry in ocr_data:
+            image_name = ocr_entry["image_name"]
+            label_file = os.path.join(yolo_labels_dir, image_name.replace(".jpg", ".txt"))
+
+            if not os.path.exists(label_file):
+                print(f"Skipping {image_name}, no YOLO label found.")
+                continue
+
+            # Real image size from the file header; without an image directory all images are assumed 1080x1920
+            IMAGE_WIDTH, IMAGE_HEIGHT = DEFAULT_IMAGE_SIZE
+            if image_dir:
+                try:
+                    IMAGE_WIDTH, IMAGE_HEIGHT = read_image_size(os.path.join(image_dir, image_name))
+                except (OSError, ValueError) as e:
+                    print(f"Skipping {image_name}, cannot read image size: {e}")
+                    continue
+
+            with instrumentation.span("proximity.read_labels"):
+                yolo_boxes = parse_yolo_labels(label_file, IMAGE_WIDTH, IMAGE_HEIGHT)
+            proximity_results.append(match_texts_to_boxes(image_name, yolo_boxes, ocr_entry["texts"], search,
+                                                          match, min_containment))
+
+    # Save results
+    with instrumentation.span("proximity.write"), open(output_json_path, "w") as f:
+        json.dump(proximity_results, f, indent=4)
+
+    print(f" Proximity matching completed!")
+    print(f" JSON results saved: {output_json_path}")
+    instrumentation.report()
+
+# Run the proximity matching process
+if __name__ == "__main__":
+    args = parse_args()
+    instrumentation.configure_from_args(args)
+    proximity_matching(args.yolo_labels_dir, args.ocr_json_path, args.output_json_path, args.yolo_jsonl,
+                       args.image_dir, args.search, args.yolo_store, args.ocr_store, args.match, args.min_containment)
@@ -0,0 +1,183 @@
+import os
+import json
+import argparse
+import numpy as np
+
+# Placeholder proximity_matching.py writes for widgets without text
+NO_TEXT = "No text nearby"
+
+# Matched widgets whose crops differ by more than this mean absolute pixel value (0-255) are changed even if
+# their text is the same, e.g. a switch turned ON next to the same label
+PIXEL_THRESHOLD = 10.0
+
+# Crops are compared on a grid of this many points per side
+CROP_GRID = 24
+
+# Set up command-line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description="Diff the widgets of consecutive screenshots, keeping only added, removed and changed elements")
+    parser.add_argument('--proximity_json', type=str, required=True, help="Output of proximity_matching.py for the screenshots of one scenario")
+    parser.add_argument('--output_json', type=str, required=True, help="Path to save the per-screen differences")
+    parser.add_argument('--iou_threshold', type=float, default=0.5, help="Minimum box IoU for two widgets of the same class to be the same element")
+    parser.add_argument('--image_dir', type=str, default=None, help="Directory containing the screenshots; matched widgets whose pixels changed (e.g. a toggled switch) are reported as changed too")
+    parser.add_argument('--pixel_threshold', type=float, default=PIXEL_THRESHOLD, help="Mean absolute pixel difference (0-255) above which a matched widget counts as changed (with --image_dir)")
+    return parser.parse_args()
+
+def normalized_text(text):
+    text = " ".join((text or "").split())
+    return "" if text == NO_TEXT else text.lower()
+
+# IoU of every box in boxes1 with every box in boxes2, as an (n1, n2) matrix
+def iou_matrix(boxes1, boxes2):
+    a = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+    x_min = np.maximum(a[:, None, 0], b[None, :, 0])
+    y_min = np.maximum(a[:, None, 1], b[None, :, 1])
+    x_max = np.minimum(a[:, None, 2], b[None, :, 2])
+    y_max = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x_max - x_min, 0, None) * np.clip(y_max - y_min, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+# Pair the elements of two consecutive screens: first greedily by box IoU among widgets of the same class,
+# then remaining widgets of the same class with the same non-empty text (e.g. a list that scrolled).
+# Returns (previous index, current index) pairs.
+def match_elements(previous, current, iou_threshold=0.5):
+    if not previous or not current:
+        return []
+    iou = iou_matrix([e["bbox"] for e in previous], [e["bbox"] for e in current])
+    same_class = np.array([[p["class_id"] == c["class_id"] for c in current] for p in previous])
+    iou = np.where(same_class, iou, 0.0)
+
+    pairs, used_previous, used_current = [], set(), set()
+    for flat in np.argsort(-iou, axis=None):
+        i, j = divmod(int(flat), len(current))
+        if iou[i, j] < iou_threshold:
+            break
+        if i in used_previous or j in used_current:
+            continue
+        pairs.append((i, j))
+        used_previous.add(i)
+        used_current.add(j)
+
+    by_text = {}
+    for i, element in enumerate(previous):
+        text = normalized_text(element.get("matched_text"))
+        if i not in used_previous and text:
+            by_text.setdefault((element["class_id"], text), []).append(i)
+    for j, element in enumerate(current):
+        candidates = by_text.get((element["class_id"], normalized_text(element.get("matched_text"))))
+        if j not in used_current and candidates:
+            pairs.append((candidates.pop(0), j))
+            used_current.add(j)
+    return pairs
+
+# Mean absolute difference (0-255) between the crops of box1 in image1 and box2 in image2. Both crops are sampled
+# on the same CROP_GRID x CROP_GRID grid, so boxes of slightly different size are compared without resizing.
+# None when a box lies outside its image.
+def crop_difference(image1, box1, image2, box2):
+    samples = []
+    for image, box in ((image1, box1), (image2, box2)):
+        img_h, img_w = image.shape[:2]
+        x_min, y_min = max(0, int(box[0])), max(0, int(box[1]))
+        x_max, y_max = min(img_w, int(box[2])), min(img_h, int(box[3]))
+        if x_max <= x_min or y_max <= y_min:
+            return None
+        xs = np.linspace(x_min, x_max - 1, CROP_GRID).astype(np.int64)
+        ys = np.linspace(y_min, y_max - 1, CROP_GRID).astype(np.int64)
+        samples.append(image[np.ix_(ys, xs)].astype(np.int16))
+    return float(np.abs(samples[0] - samples[1]).mean())
+
+# Differences between two screens: added and removed elements, and matched elements whose text changed.
+# With both screenshots (decoded arrays), matched elements whose crops differ by more than pixel_threshold
+# are changed as well, which catches state changes the matched text does not show (switches, check boxes).
+def diff_screens(previous, current, iou_threshold=0.5, previous_image=None, current_image=None,
+                 pixel_threshold=PIXEL_THRESHOLD):
+    pairs = match_elements(previous, current, iou_threshold)
+    matched_previous = {i for i, _ in pairs}
+    matched_current = {j for _, j in pairs}
+    compare_pixels = previous_image is not None and current_image is not None
+
+    def is_changed(i, j):
+        if normalized_text(previous[i].get("matched_text")) != normalized_text(current[j].get("matched_text")):
+            return True
+        if not compare_pixels:
+            return False
+        difference = crop_difference(previous_image, previous[i]["bbox"], current_image, current[j]["bbox"])
+        return difference is not None and difference > pixel_threshold
+
+    changed = [(i, j) for i, j in pairs if is_changed(i, j)]
+    return {
+        "added": [j for j in range(len(current)) if j not in matched_current],
+        "removed": [i for i in range(len(previous)) if i not in matched_previous],
+        "changed": changed,
+        "unchanged": [(i, j) for i, j in pairs if (i, j) not in changed],
+    }
+
+# Screenshot decoded for the pixel comparison, or None without an image directory or when it cannot be read
+def load_screen_image(image_dir, image_name):
+    if not image_dir:
+        return None
+    import cv2
+    image = cv2.imread(os.path.join(image_dir, image_name))
+    if image is None:
+        print(f"⚠️ Cannot read {image_name}, its widgets are compared by text only")
+    return image
+
+# Diff of every screen against the one before it; the first screen is all additions.
+# With image_dir, matched widgets are also compared by their pixels.
+def diff_sequence(screens, iou_threshold=0.5, image_dir=None, pixel_threshold=PIXEL_THRESHOLD):
+    diffs = []
+    previous = []
+    previous_image = None
+    for screen in screens:
+        current = screen["ui_elements"]
+        current_image = load_screen_image(image_dir, screen["image_name"])
+        diff = diff_screens(previous, current, iou_threshold, previous_image, current_image, pixel_threshold)
+        diffs.append({
+            "image_name": screen["image_name"],
+            "added": [current[j] for j in diff["added"]],
+            "removed": [previous[i] for i in diff["removed"]],
+            "changed": [{"before": previous[i], "after": current[j]} for i, j in diff["changed"]],
+            "unchanged": len(diff["unchanged"]),
+        })
+        previous, previous_image = current, current_image
+    return diffs
+
+# Text of a widget for a description line
+def display_text(element):
+    return element.get("matched_text") if normalized_text(element.get("matched_text")) else "no text"
+
+# Description lines of one screen's changes: added and removed as (caption, element), changed as
+# (caption, before, after), and the number of unchanged widgets
+def describe_changes(added, removed, changed, unchanged):
+    lines = [f"- Added: '{caption}' ({display_text(element)})" for caption, element in added]
+    lines += [f"- Removed: '{caption}' ({display_text(element)})" for caption, element in removed]
+    for caption, before, after in changed:
+        if display_text(before) == display_text(after):
+            # Same text, different pixels: the caption of the new crop describes the new state
+            lines.append(f"- Changed: '{caption}' ({display_text(after)}, appearance changed)")
+        else:
+            lines.append(f"- Changed: '{caption}' {display_text(before)} → {display_text(after)}")
+    if unchanged:
+        lines.append(f"- Unchanged: {unchanged} widgets")
+    return lines
+
+def main():
+    args = parse_args()
+    with open(args.proximity_json, "r") as f:
+        screens = json.load(f)
+
+    diffs = diff_sequence(screens, args.iou_threshold, args.image_dir, args.pixel_threshold)
+    with open(args.output_json, "w") as f:
+        json.dump(diffs, f, indent=4)
+
+    total = sum(len(screen["ui_elements"]) for screen in screens)
+    forwarded = sum(len(d["added"]) + len(d["changed"]) for d in diffs)
+    print(f"🎯 {len(diffs)} screens, {forwarded} of {total} widgets added or changed")
+    print(f"📄 Differences saved: {args.output_json}")
+
+if __name__ == "__main__":
+    main()
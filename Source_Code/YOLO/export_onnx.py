@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+from pathlib import Path
+import numpy as np
+import cv2
+
+from infer import find_images, result_to_outputs
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from onnx_runtime import require_onnxruntime, create_session, quantize_int8, int8_path
+
+# Command-line arguments setup
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export YOLO weights to ONNX (optionally int8) for CPU inference and check the boxes against PyTorch")
+    parser.add_argument('--weights', type=str, required=True, help="Path to the trained YOLO model weights file (.pt)")
+    parser.add_argument('--output_dir', type=str, required=True, help="Directory to save the ONNX model(s) in")
+    parser.add_argument('--imgsz', type=int, default=640, help="Input size of the exported model (the size infer.py runs at)")
+    parser.add_argument('--opset', type=int, default=17, help="ONNX opset version")
+    parser.add_argument('--int8', action='store_true', help="Also save a statically int8-quantized copy, calibrated on --calibration_images")
+    parser.add_argument('--calibration_images', type=str, default=None, help="Directory of screenshots to calibrate the int8 activation ranges on (default: --parity_images)")
+    parser.add_argument('--calibration_count', type=int, default=64, help="Screenshots used for the int8 calibration")
+    parser.add_argument('--skip_export', action='store_true', help="Only run the parity check on an existing export")
+    parser.add_argument('--parity_images', type=str, default=None, help="Directory of screenshots to compare detections on")
+    parser.add_argument('--parity_count', type=int, default=20, help="Screenshots used by the parity check")
+    parser.add_argument('--iou_threshold', type=float, default=0.5, help="Minimum IoU for a box of the ONNX model to count as the same detection")
+    parser.add_argument('--report_json', type=str, default=None, help="Path to save the parity report (default: parity.json in --output_dir)")
+    args = parser.parse_args()
+    if args.int8 and not args.skip_export and not (args.calibration_images or args.parity_images):
+        parser.error("--int8 needs screenshots to calibrate on: --calibration_images or --parity_images")
+    return args
+
+# Model input of one screenshot as Ultralytics prepares it: letterboxed into imgsz x imgsz with gray
+# padding, RGB, scaled to [0, 1], NCHW float32
+def letterbox_input(img, imgsz=640):
+    img_h, img_w = img.shape[:2]
+    scale = min(imgsz / img_h, imgsz / img_w)
+    new_w, new_h = round(img_w * scale), round(img_h * scale)
+    canvas = np.full((imgsz, imgsz, 3), 114, np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255
+
+# Calibration feeds for static int8 quantization, one screenshot per feed
+def calibration_feeds(onnx_path, image_paths, imgsz=640):
+    input_name = create_session(onnx_path).get_inputs()[0].name
+    for image_path in image_paths:
+        img = cv2.imread(str(image_path))
+        if img is not None:
+            yield {input_name: letterbox_input(img, imgsz)}
+
+# Export with a dynamic batch size, so infer.py --batch_size works with the ONNX model too.
+# Returns the fp32 model path, and the int8 one if requested. The int8 model is quantized statically:
+# dynamic quantization would turn the convolutions into ConvInteger nodes, which the CPU provider runs slowly.
+def export_yolo(weights_path, output_dir, imgsz=640, opset=17, int8=False, calibration_paths=()):
+    from ultralytics import YOLO
+    require_onnxruntime()
+    os.makedirs(output_dir, exist_ok=True)
+    exported = YOLO(weights_path).export(format="onnx", imgsz=imgsz, dynamic=True, opset=opset, simplify=False)
+    onnx_path = os.path.join(output_dir, Path(weights_path).stem + ".onnx")
+    shutil.move(str(exported), onnx_path)
+    paths = [onnx_path]
+    if int8:
+        paths.append(quantize_int8(onnx_path, int8_path(onnx_path), list(calibration_feeds(onnx_path, calibration_paths, imgsz))))
+    for path in paths:
+        print(f" Exported: {path}")
+    return paths
+
+# (N, M) IoU matrix of two arrays of [x_min, y_min, x_max, y_max] boxes
+def box_iou(boxes_a, boxes_b):
+    x_min = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y_min = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x_max = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y_max = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x_max - x_min, 0, None) * np.clip(y_max - y_min, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+# Pair the detections of two models greedily by IoU among boxes of the same class; returns (i, j, iou) triples
+def match_detections(reference, candidate, iou_threshold=0.5):
+    if not reference or not candidate:
+        return []
+    iou = box_iou(np.array([r["bbox_xyxy"] for r in reference], dtype=np.float64),
+                  np.array([c["bbox_xyxy"] for c in candidate], dtype=np.float64))
+    same_class = np.array([r["class_id"] for r in reference])[:, None] == np.array([c["class_id"] for c in candidate])[None, :]
+    iou = np.where(same_class, iou, 0.0)
+
+    pairs, used_reference, used_candidate = [], set(), set()
+    for flat in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat, iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        if i in used_reference or j in used_candidate:
+            continue
+        pairs.append((int(i), int(j), float(iou[i, j])))
+        used_reference.add(i)
+        used_candidate.add(j)
+    return pairs
+
+# Box drift of an exported model against the PyTorch weights on the same screenshots
+def parity_check(weights_path, onnx_path, image_paths, imgsz=640, iou_threshold=0.5):
+    from ultralytics import YOLO
+    torch_model = YOLO(weights_path)
+    onnx_model = YOLO(onnx_path, task="detect")
+
+    totals = {"images": 0, "torch_boxes": 0, "onnx_boxes": 0, "matched": 0}
+    ious, corner_drift, confidence_drift = [], [], []
+    for image_path in image_paths:
+        img = cv2.imread(str(image_path))
+        if img is None:
+            continue
+        img_h, img_w = img.shape[:2]
+        _, reference = result_to_outputs(torch_model(img, imgsz=imgsz, verbose=False)[0], image_path, img_h, img_w)
+        _, candidate = result_to_outputs(onnx_model(img, imgsz=imgsz, verbose=False)[0], image_path, img_h, img_w)
+        pairs = match_detections(reference, candidate, iou_threshold)
+
+        totals["images"] += 1
+        totals["torch_boxes"] += len(reference)
+        totals["onnx_boxes"] += len(candidate)
+        totals["matched"] += len(pairs)
+        for i, j, iou in pairs:
+            ious.append(iou)
+            corner_drift.append(np.abs(np.subtract(reference[i]["bbox_xyxy"], candidate[j]["bbox_xyxy"])).max())
+            confidence_drift.append(abs(reference[i]["confidence"] - candidate[j]["confidence"]))
+
+    # Recall/precision of the exported model's boxes, taking the PyTorch boxes as ground truth
+    return {
+        **totals,
+        "recall": round(totals["matched"] / totals["torch_boxes"], 4) if totals["torch_boxes"] else None,
+        "precision": round(totals["matched"] / totals["onnx_boxes"], 4) if totals["onnx_boxes"] else None,
+        "mean_iou": round(float(np.mean(ious)), 4) if ious else None,
+        "max_corner_drift_px": round(float(np.max(corner_drift)), 2) if corner_drift else None,
+        "max_confidence_drift": round(float(np.max(confidence_drift)), 4) if confidence_drift else None,
+    }
+
+def main():
+    args = parse_args()
+    if args.skip_export:
+        onnx_path = os.path.join(args.output_dir, Path(args.weights).stem + ".onnx")
+        paths = [path for path in (onnx_path, int8_path(onnx_path)) if os.path.exists(path)]
+    else:
+        calibration_paths = sorted(find_images(args.calibration_images or args.parity_images))[:args.calibration_count] if args.int8 else []
+        paths = export_yolo(args.weights, args.output_dir, args.imgsz, args.opset, args.int8, calibration_paths)
+
+    if args.parity_images:
+        image_paths = sorted(find_images(args.parity_images))[:args.parity_count]
+        report = {}
+        for path in paths:
+            report[os.path.basename(path)] = parity_check(args.weights, path, image_paths, args.imgsz, args.iou_threshold)
+            print(f" {os.path.basename(path)}: {report[os.path.basename(path)]}")
+        report_json = args.report_json or os.path.join(args.output_dir, "parity.json")
+        with open(report_json, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f" Parity report saved to: {report_json}")
+
+if __name__ == "__main__":
+    main()
@@ -1,91 +1,289 @@
-from ultralytics import YOLO
-from pathlib import Path
-import cv2
-import json
-import os
-import argparse
-
-def run_inference(weights_path, image_dir, output_dir):
-    # Load the trained YOLO model
-    model = YOLO(weights_path)
-
-    # Directories for saving outputs
-    output_img_dir = output_dir / 'annotated_images'
-    output_label_dir = output_dir / 'labels'
-    output_img_dir.mkdir(parents=True, exist_ok=True)
-    output_label_dir.mkdir(parents=True, exist_ok=True)
-
-    # Supported image extensions
-    image_extensions = ['.png', '.jpg', '.jpeg']
-
-    # Final result list for JSON
-    all_results = []
-
-    # Walk through all image files recursively
-    for image_path in Path(image_dir).rglob('*'):
-        if image_path.suffix.lower() in image_extensions and not image_path.name.startswith("._"):
-            img = cv2.imread(str(image_path))
-            if img is None:
-                print(f" Skipping unreadable image: {image_path}")
-                continue
-
-            print(f" Running YOLO on: {image_path}")
-            results = model(str(image_path))
-            r = results[0]
-
-            # Save annotated image
-            out_img_path = output_img_dir / f"{image_path.stem}_pred.jpg"
-            r.save(filename=str(out_img_path))
-
-            # Prepare label and JSON data
-            labels = []
-            for box in r.boxes:
-                cls_id = int(box.cls.item())
-                conf = float(box.conf.item())
-                xyxy = box.xyxy[0].tolist()
-                x1, y1, x2, y2 = xyxy
-
-                # Convert to YOLO format: (class, x_center, y_center, width, height) normalized
-                img_h, img_w = img.shape[:2]
-                x_center = (x1 + x2) / 2 / img_w
-                y_center = (y1 + y2) / 2 / img_h
-                width = (x2 - x1) / img_w
-                height = (y2 - y1) / img_h
-
-                label_line = f"{cls_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}"
-                labels.append(label_line)
-
-                all_results.append({
-                    "image": str(image_path),
-                    "class_id": cls_id,
-                    "confidence": round(conf, 4),
-                    "bbox_xyxy": [round(x, 2) for x in xyxy]
-                })
-
-            # Save YOLO .txt label file
-            label_file_path = output_label_dir / f"{image_path.stem}.txt"
-            with open(label_file_path, 'w') as f:
-                f.write('\n'.join(labels))
-
-    # Save all results to JSON
-    json_path = output_dir / 'detections.json'
-    with open(json_path, 'w') as jf:
-        json.dump(all_results, jf, indent=2)
-
-    print(f"\n Done! Outputs saved to: {output_dir}")
-    print(f"- Annotated images: {output_img_dir}")
-    print(f"- YOLO labels: {output_label_dir}")
-    print(f"- JSON file: {json_path}")
-
-
-if __name__ == "__main__":
-    # Command-line argument parsing
-    parser = argparse.ArgumentParser(description="Run YOLO inference on images and save results")
-    parser.add_argument('--weights', type=str, required=True, help="Path to the trained YOLO model weights file")
-    parser.add_argument('--image_dir', type=str, required=True, help="Directory containing images to process")
-    parser.add_argument('--output_dir', type=str, required=True, help="Directory to save the output (annotated images, labels, and JSON)")
-
-    args = parser.parse_args()
-
-    # Run the inference with provided arguments
-    run_inference(args.weights, args.image_dir, Path(args.output_dir))
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from functools import partial
+import cv2
+import json
+import os
+import sys
+import argparse
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from jsonl_records import JsonlWriter, completed_keys
+from detection_store import DetectionStore, DetectionStoreWriter, image_key
+from result_cache import ResultCache, file_digest, weights_fingerprint
+from model_client import ModelClient
+import instrumentation
+
+# Supported image extensions
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg']
+
+# Walk through all image files recursively
+def find_images(image_dir):
+    for image_path in Path(image_dir).rglob('*'):
+        if image_path.suffix.lower() in IMAGE_EXTENSIONS and not image_path.name.startswith("._"):
+            yield image_path
+
+# Decode an image once; the same array is used for the shape and the model input.
+# With a result cache, an image whose detections are already cached is not decoded at all.
+# Without decode (model server mode), the server reads the image and None is returned in its place.
+def load_image(image_path, cache=None, weights_fp=None, decode=True):
+    key = None
+    if cache is not None:
+        key = ResultCache.make_key(file_digest(image_path), "yolo", weights_fp)
+        cached = cache.get(key)
+        if cached is not None:
+            return image_path, None, key, cached
+    if not decode:
+        return image_path, None, key, None
+    with instrumentation.span("yolo.decode"):
+        return image_path, cv2.imread(str(image_path)), key, None
+
+# Split an iterable into lists of at most batch_size items
+def chunked(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Decode images in a background thread pool, keeping up to `prefetch` batches ready ahead of the model
+def iter_decoded_batches(image_paths, batch_size, workers, loader=load_image, prefetch=2):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for paths in chunked(image_paths, batch_size):
+            pending.append([pool.submit(loader, p) for p in paths])
+            if len(pending) > prefetch:
+                yield [f.result() for f in pending.popleft()]
+        while pending:
+            yield [f.result() for f in pending.popleft()]
+
+# Convert one YOLO result into label lines and JSON records
+def result_to_outputs(r, image_path, img_h, img_w):
+    labels = []
+    records = []
+    for box in r.boxes:
+        cls_id = int(box.cls.item())
+        conf = float(box.conf.item())
+        xyxy = box.xyxy[0].tolist()
+        x1, y1, x2, y2 = xyxy
+
+        # Convert to YOLO format: (class, x_center, y_center, width, height) normalized
+        x_center = (x1 + x2) / 2 / img_w
+        y_center = (y1 + y2) / 2 / img_h
+        width = (x2 - x1) / img_w
+        height = (y2 - y1) / img_h
+
+        label_line = f"{cls_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}"
+        labels.append(label_line)
+
+        records.append({
+            "image": str(image_path),
+            "class_id": cls_id,
+            "confidence": round(conf, 4),
+            "bbox_xyxy": [round(x, 2) for x in xyxy]
+        })
+    return labels, records
+
+def run_inference(weights_path, image_dir, output_dir, batch_size=1, workers=0, output_format="json", resume=False,
+                  cache_dir=None, cache_size_mb=1024, server=None, model=None, save_annotated=False):
+    # Load the trained YOLO model, or use the one kept loaded by the model server.
+    # An already loaded model (e.g. the stub detector of Benchmark/benchmark_stages.py) can be passed in instead.
+    client = None
+    if server:
+        client = ModelClient(server)
+    elif model is None:
+        from ultralytics import YOLO
+        model = YOLO(weights_path)
+
+    # Optional content-addressed result cache shared with the other stages
+    cache = None
+    loader = partial(load_image, decode=client is None)
+    if cache_dir:
+        cache = ResultCache(cache_dir, max_bytes=cache_size_mb * 1024 * 1024)
+        loader = partial(loader, cache=cache, weights_fp=weights_fingerprint(weights_path))
+
+    # Directories for saving outputs. Annotated images are only written on request;
+    # Annotation_rendering/render_annotations.py draws them from the results for the images actually looked at.
+    output_img_dir = output_dir / 'annotated_images'
+    output_label_dir = output_dir / 'labels'
+    if save_annotated:
+        output_img_dir.mkdir(parents=True, exist_ok=True)
+    if output_format != "store":
+        output_label_dir.mkdir(parents=True, exist_ok=True)
+
+    # Final result list for JSON, or a streaming writer with one record per image for JSONL,
+    # or the columnar detection store that replaces both the label files and the JSON.
+    # Store entries are named by their path relative to image_dir: screenshots of subfolders may share a file name.
+    all_results = []
+    image_paths = find_images(image_dir)
+    store_writer = None
+    if output_format == "store":
+        json_path = output_dir / 'detections_store'
+        if resume and (json_path / 'meta.json').exists():
+            done = set(DetectionStore(json_path).names())
+            print(f" Resuming: {len(done)} images already processed")
+            image_paths = (p for p in image_paths if image_key(p, image_dir) not in done)
+        store_writer = DetectionStoreWriter(json_path, append=resume)
+        writer = None
+    elif output_format == "jsonl":
+        json_path = output_dir / 'detections.jsonl'
+        if resume:
+            done = completed_keys(json_path, "image")
+            print(f" Resuming: {len(done)} images already processed")
+            image_paths = (p for p in image_paths if str(p) not in done)
+        writer = JsonlWriter(json_path, append=resume)
+    else:
+        json_path = output_dir / 'detections.json'
+        writer = None
+
+    # Write the label file and the JSON record(s) of one image
+    def emit(image_path, img_w, img_h, labels, records):
+        instrumentation.count("yolo.images")
+        instrumentation.count("yolo.boxes", len(records))
+        with instrumentation.span("yolo.write"):
+            write_outputs(image_path, img_w, img_h, labels, records)
+
+    def write_outputs(image_path, img_w, img_h, labels, records):
+        if store_writer is not None:
+            store_writer.add(image_key(image_path, image_dir), img_w, img_h,
+                             [{"bbox": rec["bbox_xyxy"], "class_id": rec["class_id"], "confidence": rec["confidence"]}
+                              for rec in records])
+            return
+
+        # Save YOLO .txt label file
+        label_file_path = output_label_dir / f"{image_path.stem}.txt"
+        with open(label_file_path, 'w') as f:
+            f.write('\n'.join(labels))
+
+        if writer is not None:
+            # The record is written last so --resume never skips an image with missing labels
+            writer.write({
+                "image": str(image_path),
+                "width": img_w,
+                "height": img_h,
+                "detections": [{k: v for k, v in rec.items() if k != "image"} for rec in records]
+            })
+        else:
+            all_results.extend(records)
+
+    # workers=0 keeps the original one-image-at-a-time path
+    if workers > 0:
+        batches = iter_decoded_batches(image_paths, batch_size, workers, loader)
+    else:
+        batches = ([loader(p) for p in paths] for paths in chunked(image_paths, batch_size))
+
+    for batch in batches:
+        ready = []
+        for image_path, img, key, cached in batch:
+            if cached is not None:
+                continue
+            if img is None and client is None:
+                print(f" Skipping unreadable image: {image_path}")
+                continue
+            instrumentation.log(f" Running YOLO on: {image_path}")
+            ready.append(img if client is None else image_path)
+
+        # One forward pass over the already decoded arrays, or one request to the model server
+        with instrumentation.span("yolo.forward"):
+            if client is not None:
+                annotated_paths = [output_img_dir / f"{p.stem}_pred.jpg" for p in ready] if save_annotated else None
+                results = iter(client.detect(ready, weights_path, annotated_paths) if ready else [])
+            else:
+                results = iter(model(ready) if ready else [])
+
+        # Emit in input order, mixing cache hits with fresh detections
+        for image_path, img, key, cached in batch:
+            if cached is not None:
+                # Byte-identical image already processed with the same weights
+                instrumentation.count("yolo.cache_hits")
+                img_w, img_h, labels = cached["width"], cached["height"], cached["labels"]
+                records = [dict(image=str(image_path), **det) for det in cached["detections"]]
+                emit(image_path, img_w, img_h, labels, records)
+                continue
+            if client is not None:
+                # Detected (and the annotated image saved) by the model server
+                detected = next(results)
+                if "error" in detected:
+                    print(f" Skipping unreadable image: {image_path}")
+                    continue
+                img_w, img_h, labels = detected["width"], detected["height"], detected["labels"]
+                records = [dict(image=str(image_path), **det) for det in detected["detections"]]
+                emit(image_path, img_w, img_h, labels, records)
+            else:
+                if img is None:
+                    continue
+                r = next(results)
+
+                # Save annotated image
+                if save_annotated:
+                    out_img_path = output_img_dir / f"{image_path.stem}_pred.jpg"
+                    with instrumentation.span("yolo.save_annotated"):
+                        r.save(filename=str(out_img_path))
+
+                # Prepare label and JSON data
+                img_h, img_w = img.shape[:2]
+                with instrumentation.span("yolo.postprocess"):
+                    labels, records = result_to_outputs(r, image_path, img_h, img_w)
+                emit(image_path, img_w, img_h, labels, records)
+
+            if cache is not None:
+                cache.put(key, "yolo", {
+                    "width": img_w,
+                    "height": img_h,
+                    "labels": labels,
+                    "detections": [{k: v for k, v in rec.items() if k != "image"} for rec in records]
+                })
+
+    if store_writer is not None:
+        store_writer.close()
+    elif writer is not None:
+        writer.close()
+    else:
+        # Save all results to JSON
+        with instrumentation.span("yolo.write"), open(json_path, 'w') as jf:
+            json.dump(all_results, jf, indent=2)
+
+    print(f"\n Done! Outputs saved to: {output_dir}")
+    if save_annotated:
+        print(f"- Annotated images: {output_img_dir}")
+    if store_writer is not None:
+        print(f"- Detection store: {json_path}")
+    else:
+        print(f"- YOLO labels: {output_label_dir}")
+        print(f"- JSON file: {json_path}")
+    if cache is not None:
+        print(f"- {cache.summary()}")
+        cache.close()
+    instrumentation.report()
+
+
+if __name__ == "__main__":
+    # Command-line argument parsing
+    parser = argparse.ArgumentParser(description="Run YOLO inference on images and save results")
+    parser.add_argument('--weights', type=str, required=True, help="Path to the trained YOLO model weights file (.pt, or the .onnx/.int8.onnx of export_onnx.py to run on ONNX Runtime)")
+    parser.add_argument('--image_dir', type=str, required=True, help="Directory containing images to process")
+    parser.add_argument('--output_dir', type=str, required=True, help="Directory to save the output (labels and JSON, plus annotated images with --save_annotated)")
+    parser.add_argument('--batch_size', type=int, default=1, help="Number of images passed to the model per forward call")
+    parser.add_argument('--workers', type=int, default=0, help="Background threads decoding images ahead of the model (0 = decode inline)")
+    parser.add_argument('--output_format', type=str, choices=['json', 'jsonl', 'store'], default='json', help="json: one detections.json at the end; jsonl: stream one record per image to detections.jsonl; store: columnar detections_store/ instead of labels and JSON (see Common/detection_store.py)")
+    parser.add_argument('--resume', action='store_true', help="With --output_format jsonl or store, skip images that already have a record")
+    parser.add_argument('--cache_dir', type=str, default=None, help="Directory of the shared result cache; unchanged images are not re-detected")
+    parser.add_argument('--cache_size_mb', type=int, default=1024, help="Maximum size of the result cache before least recently used entries are evicted")
+    parser.add_argument('--server', type=str, default=None, help="URL of a running Model_server/model_server.py (e.g. http://127.0.0.1:8765); the model is not loaded here")
+    parser.add_argument('--save_annotated', action='store_true', help="Also draw the boxes on every image and save it to annotated_images/ (off by default; Annotation_rendering/render_annotations.py draws them on demand)")
+    instrumentation.add_arguments(parser)
+
+    args = parser.parse_args()
+    if args.resume and args.output_format == 'json':
+        # detections.json is only written at the end, so an interrupted run leaves nothing to resume from
+        parser.error("--resume requires --output_format jsonl or store")
+    instrumentation.configure_from_args(args)
+
+    # Run the inference with provided arguments
+    run_inference(args.weights, args.image_dir, Path(args.output_dir), args.batch_size, args.workers,
+                  args.output_format, args.resume, args.cache_dir, args.cache_size_mb, args.server, save_annotated=args.save_annotated)
@@ -1,107 +1,152 @@
-import os
-import xml.etree.ElementTree as ET
-import cv2
-import torch
-import argparse
-
-# Check for GPU availability
-device = torch.device("cuda:1" if torch.cuda.is_available() else "cpu")
-
-# Updated class mapping with 'TextButton'
-class_map = {
-    "BackgroundImage": 0, "CheckedTextView": 1, "Icon": 2, "EditText": 3, "Image": 4,
-    "Text": 5, "Text Button": 6, "Drawer": 7, "PageIndicator": 8, "UpperTaskBar": 9,
-    "Modal": 10, "Switch": 11, "Spinner": 12, "Card": 13, "Multi-tab": 14, "Toolbar": 15,
-    "Bottom-Navigation": 16, "Remember": 17, "TextButton": 18  # Added TextButton to class_map
-}
-
-# Function to parse XML and extract bounding boxes
-def parse_xml(xml_file):
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    
-    labels, bboxes = [], []
-    
-    for obj in root.findall("object"):
-        label = obj.find("name").text
-        if label not in class_map:
-            print(f"Warning: Class '{label}' not in class_map. Skipping...")
-            continue
-
-        try:
-            xmin = float(obj.find("bndbox/xmin").text)
-            ymin = float(obj.find("bndbox/ymin").text)
-            xmax = float(obj.find("bndbox/xmax").text)
-            ymax = float(obj.find("bndbox/ymax").text)
-        except ValueError as e:
-            print(f"Error parsing bounding box coordinates for {label}: {e}")
-            continue
-
-        labels.append(label)
-        bboxes.append([xmin, ymin, xmax, ymax])
-    
-    return labels, bboxes
-
-# Convert bounding boxes to YOLO format
-def convert_to_yolo_format(bounds, img_width, img_height):
-    x_min, y_min, x_max, y_max = bounds
-    x_center = (x_min + x_max) / (2 * img_width)
-    y_center = (y_min + y_max) / (2 * img_height)
-    width = (x_max - x_min) / img_width
-    height = (y_max - y_min) / img_height
-    return x_center, y_center, width, height
-
-# Main function to process the files
-def process_files(xml_dir, image_dir, output_label_dir):
-    os.makedirs(output_label_dir, exist_ok=True)
-
-    # Process each XML file
-    for file in os.listdir(xml_dir):
-        if file.endswith(".xml"):
-            xml_path = os.path.join(xml_dir, file)
-            image_name = file.replace(".xml", ".jpg")
-            image_path = os.path.join(image_dir, image_name)
-
-            if not os.path.exists(image_path):
-                print(f"Warning: Image {image_name} not found. Skipping {file}...")
-                continue
-
-            # Load image to get dimensions
-            img = cv2.imread(image_path)
-            if img is None:
-                print(f"Warning: Unable to read {image_name}. Skipping...")
-                continue
-            img_height, img_width, _ = img.shape
-
-            # Parse XML
-            labels, bboxes = parse_xml(xml_path)
-            if not labels:
-                print(f"Warning: No valid objects found in {file}. Skipping...")
-                continue
-
-            # Create YOLO annotation file
-            label_file_path = os.path.join(output_label_dir, file.replace(".xml", ".txt"))
-            with open(label_file_path, "w") as label_f:
-                for i, bbox in enumerate(bboxes):
-                    class_id = class_map[labels[i]]
-                    x_center, y_center, width, height = convert_to_yolo_format(bbox, img_width, img_height)
-                    label_f.write(f"{class_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
-
-            print(f"Processed {file} -> {label_file_path}")
-
-    print("All XML files processed successfully on", device)
-
-# Command-line arguments setup
-def main():
-    parser = argparse.ArgumentParser(description="Convert XML annotations to YOLO format.")
-    parser.add_argument("xml_dir", type=str, help="Directory containing the XML annotation files.")
-    parser.add_argument("image_dir", type=str, help="Directory containing the image files.")
-    parser.add_argument("output_label_dir", type=str, help="Directory to store YOLO label files.")
-
-    args = parser.parse_args()
-
-    # Process files with the provided directories
-    process_files(args.xml_dir, args.image_dir, args.output_label_dir)
-
-if __name__ == "__main__":
-    main()
+import os
+import sys
+import argparse
+import xml.etree.ElementTree as ET
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+
+# Shared helpers live in Source_Code/Common
+sys.path.append(str(Path(__file__).resolve().parents[1] / "Common"))
+from image_header import read_image_size
+
+# Updated class mapping with 'TextButton'
+class_map = {
+    "BackgroundImage": 0, "CheckedTextView": 1, "Icon": 2, "EditText": 3, "Image": 4,
+    "Text": 5, "Text Button": 6, "Drawer": 7, "PageIndicator": 8, "UpperTaskBar": 9,
+    "Modal": 10, "Switch": 11, "Spinner": 12, "Card": 13, "Multi-tab": 14, "Toolbar": 15,
+    "Bottom-Navigation": 16, "Remember": 17, "TextButton": 18  # Added TextButton to class_map
+}
+
+# Function to parse XML and extract bounding boxes.
+# The file is parsed incrementally and each <object> is freed once read, so large annotation files are never
+# held in memory as a whole. Objects of unknown classes or with invalid coordinates are returned as skipped.
+def parse_xml(xml_file):
+    labels, bboxes, skipped = [], [], []
+
+    for _, elem in ET.iterparse(xml_file, events=("end",)):
+        if elem.tag != "object":
+            continue
+        label = elem.findtext("name")
+        if label not in class_map:
+            skipped.append(f"unknown class '{label}'")
+        else:
+            try:
+                bboxes.append([float(elem.findtext(f"bndbox/{key}")) for key in ("xmin", "ymin", "xmax", "ymax")])
+                labels.append(label)
+            except (TypeError, ValueError) as e:
+                skipped.append(f"bad coordinates for '{label}': {e}")
+        elem.clear()
+
+    return labels, bboxes, skipped
+
+# Convert bounding boxes to YOLO format
+def convert_to_yolo_format(bounds, img_width, img_height):
+    x_min, y_min, x_max, y_max = bounds
+    x_center = (x_min + x_max) / (2 * img_width)
+    y_center = (y_min + y_max) / (2 * img_height)
+    width = (x_max - x_min) / img_width
+    height = (y_max - y_min) / img_height
+    return x_center, y_center, width, height
+
+# Convert one XML file; returns (status, file name, skipped objects, detail).
+# A label newer than both its XML and its image is up to date and left as is, unless force is set.
+def convert_file(xml_path, image_dir, output_label_dir, force=False):
+    file = os.path.basename(xml_path)
+    image_path = os.path.join(image_dir, file.replace(".xml", ".jpg"))
+    label_file_path = os.path.join(output_label_dir, file.replace(".xml", ".txt"))
+
+    try:
+        image_mtime = os.stat(image_path).st_mtime
+    except OSError:
+        return "missing_image", file, [], image_path
+    if not force:
+        try:
+            if os.stat(label_file_path).st_mtime >= max(os.stat(xml_path).st_mtime, image_mtime):
+                return "up_to_date", file, [], label_file_path
+        except OSError:
+            pass
+
+    # Image dimensions from the file header; pixels are never decoded
+    try:
+        img_width, img_height = read_image_size(image_path)
+    except (OSError, ValueError, IndexError) as e:
+        return "unreadable_image", file, [], str(e)
+
+    try:
+        labels, bboxes, skipped = parse_xml(xml_path)
+    except ET.ParseError as e:
+        return "bad_xml", file, [], str(e)
+    if not labels:
+        return "no_objects", file, skipped, xml_path
+
+    # Create YOLO annotation file; written under a temporary name so an interrupted run never leaves a
+    # partial label that looks up to date
+    tmp_path = label_file_path + ".tmp"
+    with open(tmp_path, "w") as label_f:
+        for label, bbox in zip(labels, bboxes):
+            x_center, y_center, width, height = convert_to_yolo_format(bbox, img_width, img_height)
+            label_f.write(f"{class_map[label]} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
+    os.replace(tmp_path, label_file_path)
+    return "converted", file, skipped, label_file_path
+
+def convert_task(task):
+    return convert_file(*task)
+
+# Main function to process the files, spread over a pool of worker processes.
+# Prints one summary per run; with verbose, also one line per file that was not converted cleanly.
+def process_files(xml_dir, image_dir, output_label_dir, workers=None, force=False, chunksize=64, verbose=False):
+    os.makedirs(output_label_dir, exist_ok=True)
+    with os.scandir(xml_dir) as entries:
+        tasks = [(entry.path, image_dir, output_label_dir, force) for entry in entries if entry.name.endswith(".xml")]
+
+    statuses = Counter()
+    skipped_objects = Counter()
+    examples = {}
+    workers = workers or os.cpu_count() or 1
+
+    def record(result):
+        status, file, skipped, detail = result
+        statuses[status] += 1
+        for reason in skipped:
+            skipped_objects[reason.split(":")[0]] += 1
+        if status not in ("converted", "up_to_date"):
+            examples.setdefault(status, f"{file} ({detail})")
+        if verbose and (skipped or status not in ("converted", "up_to_date")):
+            print(f"{status}: {file} {detail} {'; '.join(skipped)}")
+
+    if workers == 1:
+        for task in tasks:
+            record(convert_task(task))
+    else:
+        with Pool(workers) as pool:
+            for result in pool.imap_unordered(convert_task, tasks, chunksize=chunksize):
+                record(result)
+
+    print(f"Processed {len(tasks)} XML files with {workers} worker(s): "
+          f"{statuses['converted']} converted, {statuses['up_to_date']} up to date")
+    for status in ("missing_image", "unreadable_image", "bad_xml", "no_objects"):
+        if statuses[status]:
+            print(f"Warning: {statuses[status]} skipped ({status.replace('_', ' ')}), e.g. {examples[status]}")
+    for reason, count in skipped_objects.most_common():
+        print(f"Warning: {count} objects skipped ({reason})")
+    return statuses
+
+# Command-line arguments setup
+def main():
+    parser = argparse.ArgumentParser(description="Convert XML annotations to YOLO format.")
+    parser.add_argument("xml_dir", type=str, help="Directory containing the XML annotation files.")
+    parser.add_argument("image_dir", type=str, help="Directory containing the image files.")
+    parser.add_argument("output_label_dir", type=str, help="Directory to store YOLO label files.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU; 1 converts in this process).")
+    parser.add_argument("--chunksize", type=int, default=64, help="XML files handed to a worker at a time.")
+    parser.add_argument("--force", action="store_true", help="Convert every file, even if its label is newer than its XML and image.")
+    parser.add_argument("--verbose", action="store_true", help="Print every file that was skipped or had objects skipped.")
+
+    args = parser.parse_args()
+
+    # Process files with the provided directories
+    process_files(args.xml_dir, args.image_dir, args.output_label_dir, args.workers, args.force, args.chunksize, args.verbose)
+
+if __name__ == "__main__":
+    main()